@@ -3,15 +3,15 @@ from datetime import timezone
 import logging
 import math
 import re
-import requests
 import bot.constants as constants
 import discord
+from bot.tools.leaderboards import LeaderboardBoard, LeaderboardService
 from bot.tools.oauthmanager import OAuthManager
 from bot.tracks import JamTrackHandler
 
 # a custom view for leaderboards so they load fast as shit
 class LeaderboardPaginatorView(discord.ui.View):
-    def __init__(self, song_event_id: str, season_str: str, instrument: constants.Instrument, user_id: int, oauth_manager: OAuthManager, matched_track: dict):
+    def __init__(self, song_event_id: str, season_str: str, instrument: constants.Instrument, user_id: int, oauth_manager: OAuthManager, matched_track: dict, leaderboard_service: LeaderboardService):
         super().__init__(timeout=60)
         self.user_id = user_id
         self.total_pages = 0
@@ -24,6 +24,7 @@ class LeaderboardPaginatorView(discord.ui.View):
         self.season_str = season_str
         self.instrument = instrument
         self.oauth_manager = oauth_manager
+        self.leaderboard_service = leaderboard_service
         self.embed_manager = LeaderboardEmbedHandler()
         self.matched_track = matched_track
         self.current_selected_in_page = 0
@@ -31,7 +32,7 @@ class LeaderboardPaginatorView(discord.ui.View):
         self.per_page = 10
 
     async def force_update(self):
-        embed = self.get_embed()
+        embed = await self.get_embed()
         self.update_buttons()
         await self.message.edit(embed=embed, view=self)
 
@@ -57,14 +58,13 @@ class LeaderboardPaginatorView(discord.ui.View):
         self.add_item(ScrollDownButton(style=discord.ButtonStyle.secondary, emoji=constants.DOWN_EMOJI, user_id=self.user_id, row=2))
         self.add_item(PaginatorButton(style=discord.ButtonStyle.secondary, emoji=constants.INFORMATION_EMOJI, user_id=self.user_id, row=2, label='View', disabled=True))
 
-    def get_embed(self):
+    async def get_embed(self):
         # the api returns 100 entries per page however we show 10 entries per page only
         # find the nearest page to the current page
         entry_start_page = page = self.current_page * self.per_page
         page = math.floor(entry_start_page / 100)
         # logging.info(f'At API page {page} of Embed page {self.current_page} in {entry_start_page}')
-        if self.page_data.get(str(page)) is None:
-            self.get_page_data(page)
+        await self.get_page_data(page)
 
         entries = self.page_data[str(page)]['entries']
 
@@ -87,28 +87,18 @@ class LeaderboardPaginatorView(discord.ui.View):
 
         return self.embed_manager.leaderboard_entries(selected_entries, title, self.account_names, self.current_selected_in_page, page_updated)
     
-    def load_all_pages(self):
-        self.get_page_data(0)
+    async def load_all_pages(self):
+        await self.get_page_data(0)
         for page in range(1, self.page_data['0']['totalPages']):
-            self.get_page_data(page)
+            await self.get_page_data(page)
 
-    def get_url(self, page):
-        return f'https://events-public-service-live.ol.epicgames.com/api/v1/leaderboards/FNFestival/{self.season_str}_{self.song_event_id}/{self.song_event_id}_{self.instrument.lb_code}/{self.oauth_manager.account_id}?page={page}&rank=0&teamAccountIds&showLiveSessions=false&appId=Fortnite'
+    def get_board(self) -> LeaderboardBoard:
+        return LeaderboardBoard.solo(self.season_str, self.song_event_id, self.instrument.lb_code)
             
-    def get_page_data(self, page):
-        url = self.get_url(page)
-        logging.info(f'[GET] {url}')
-        headers = {
-            'Authorization': self.oauth_manager.session_token
-        }
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 401 or response.status_code == 403:
-            self.oauth_manager._create_token()
-            raise Exception('Please try again.')
-
-        response.raise_for_status()
-        data = response.json()
+    async def get_page_data(self, page):
+        # served from the shared page cache when possible, neighbouring pages are prefetched
+        result = await self.leaderboard_service.get_page(self.get_board(), page)
+        data = result.data
 
         update = False
         if self.total_pages == 0: update = True
@@ -117,14 +107,7 @@ class LeaderboardPaginatorView(discord.ui.View):
         if update:
             self.update_buttons()
 
-        account_ids = []
-        for entry in data['entries']:
-            account_ids.extend(entry['teamAccountIds'])
-
-        account_names = self.oauth_manager.get_accounts(account_ids)
-        for account in account_names:
-            self.account_names[account.account_id] = account.display_name
-
+        self.account_names.update(result.account_names)
         self.page_data[str(page)] = data
 
     async def on_timeout(self):
@@ -138,8 +121,8 @@ class LeaderboardPaginatorView(discord.ui.View):
             logging.error(f"An error occurred during on_timeout: {e}, {type(e)}, {self.message}")
 
 class BandLeaderboardView(LeaderboardPaginatorView):
-    def __init__(self, song_event_id, season_str, band_type: constants.BandType, user_id, oauth_manager, matched_track):
-        super().__init__(song_event_id, season_str, None, user_id, oauth_manager, matched_track)
+    def __init__(self, song_event_id, season_str, band_type: constants.BandType, user_id, oauth_manager, matched_track, leaderboard_service):
+        super().__init__(song_event_id, season_str, None, user_id, oauth_manager, matched_track, leaderboard_service)
 
         self.per_page = 2
         self.band_type = band_type
@@ -163,11 +146,10 @@ class BandLeaderboardView(LeaderboardPaginatorView):
         self.add_item(ScrollDownButton(style=discord.ButtonStyle.secondary, emoji=constants.DOWN_EMOJI, user_id=self.user_id, row=2))
         self.add_item(PaginatorButton(style=discord.ButtonStyle.secondary, emoji=constants.INFORMATION_EMOJI, user_id=self.user_id, row=2, label='View', disabled=True))
 
-    def get_embed(self):
+    async def get_embed(self):
         entry_start_page = page = self.current_page * self.per_page
         page = math.floor(entry_start_page / 100)
-        if self.page_data.get(str(page)) is None:
-            self.get_page_data(page)
+        await self.get_page_data(page)
 
         entries = self.page_data[str(page)]['entries']
         try:
@@ -185,12 +167,12 @@ class BandLeaderboardView(LeaderboardPaginatorView):
 
         return self.embed_manager.band_leaderboard_entries(selected_entries, title, self.account_names, self.current_selected_in_page, page_updated)
     
-    def get_url(self, page):
-        return f'https://events-public-service-live.ol.epicgames.com/api/v1/leaderboards/FNFestival/{self.season_str}_{self.song_event_id}/{self.song_event_id}_Band_{self.band_type.code}/{self.oauth_manager.account_id}?page={page}&rank=0&teamAccountIds&showLiveSessions=false&appId=Fortnite'
+    def get_board(self) -> LeaderboardBoard:
+        return LeaderboardBoard.band(self.season_str, self.song_event_id, self.band_type.code)
 
 class AllTimeLeaderboardView(LeaderboardPaginatorView):
-    def __init__(self, song_event_id, season_str, lbtype: constants.AllTimeLBType, user_id, oauth_manager, matched_track):
-        super().__init__(song_event_id, season_str, None, user_id, oauth_manager, matched_track)
+    def __init__(self, song_event_id, season_str, lbtype: constants.AllTimeLBType, user_id, oauth_manager, matched_track, leaderboard_service):
+        super().__init__(song_event_id, season_str, None, user_id, oauth_manager, matched_track, leaderboard_service)
 
         self.alltime_lbtype: constants.AllTimeLBType = lbtype
         if self.alltime_lbtype.is_band:
@@ -215,14 +197,13 @@ class AllTimeLeaderboardView(LeaderboardPaginatorView):
         self.add_item(ScrollDownButton(style=discord.ButtonStyle.secondary, emoji=constants.DOWN_EMOJI, user_id=self.user_id, row=2))
         self.add_item(PaginatorButton(style=discord.ButtonStyle.secondary, emoji=constants.INFORMATION_EMOJI, user_id=self.user_id, row=2, label='View', disabled=True))
 
-    def get_url(self, page):
-        return f'https://events-public-service-live.ol.epicgames.com/api/v1/leaderboards/FNFestival/alltime_{self.song_event_id}_{self.alltime_lbtype.code}/alltime/{self.oauth_manager.account_id}?page={page}&rank=0&teamAccountIds&showLiveSessions=false&appId=Fortnite'
+    def get_board(self) -> LeaderboardBoard:
+        return LeaderboardBoard.alltime(self.song_event_id, self.alltime_lbtype.code)
 
-    def get_embed(self):
+    async def get_embed(self):
         entry_start_page = page = self.current_page * self.per_page
         page = math.floor(entry_start_page / 100)
-        if self.page_data.get(str(page)) is None:
-            self.get_page_data(page)
+        await self.get_page_data(page)
 
         entries = self.page_data[str(page)]['entries']
 
@@ -258,7 +239,7 @@ class PaginatorButton(discord.ui.Button):
         await interaction.response.defer() 
         view: LeaderboardPaginatorView = self.view
         self.update_page(view)
-        embed = view.get_embed()
+        embed = await view.get_embed()
         view.update_buttons()
         await interaction.edit_original_response(embed=embed, view=view)
 class FirstButton(PaginatorButton):
@@ -400,18 +381,13 @@ class JumpPlayerModal(discord.ui.Modal):
     async def jump_to_account_id(self, accid, interaction: discord.Interaction):
         await interaction.response.send_message('Please wait...', ephemeral=True)
 
-        self.view.get_page_data(0)
-        if await self.check_page(accid, 0, interaction):
-            return
-        
-        total_pages = self.view.page_data['0']['totalPages']
-
-        if total_pages > 1:
-            for page_idx in range(1, total_pages):
-                self.view.get_page_data(page_idx)
+        found = await self.view.leaderboard_service.find_team(self.view.get_board(), accid)
+        if found is not None:
+            page_idx, _ = found
+            await self.view.get_page_data(page_idx)
 
-                if await self.check_page(accid, page_idx, interaction):
-                    return
+            if await self.check_page(accid, page_idx, interaction):
+                return
 
         await interaction.edit_original_response(embed=constants.common_error_embed(f"Could not find an entry for {accid}."))
 
@@ -422,7 +398,7 @@ class JumpPlayerModal(discord.ui.Modal):
         if len(accountid) > 0:
             await self.jump_to_account_id(accountid, interaction)
         else:
-            accounts = self.view.oauth_manager.search_users(username)
+            accounts = await self.view.oauth_manager.search_users(username)
             if len(accounts) == 1:
                 await self.jump_to_account_id(accounts[0].account_id, interaction)
             else:
@@ -761,8 +737,8 @@ class LeaderboardCommandHandler:
         # Use the first matched track
         matched_track = matched_tracks[0]
 
-        view = LeaderboardPaginatorView(matched_track['track']['su'], constants.get_season_lb_str(), chosen_instrument, interaction.user.id, self.bot.oauth_manager, matched_track)
-        view.message = await interaction.edit_original_response(embed=view.get_embed(), view=view)
+        view = LeaderboardPaginatorView(matched_track['track']['su'], constants.get_season_lb_str(), chosen_instrument, interaction.user.id, self.bot.oauth_manager, matched_track, self.bot.leaderboard_service)
+        view.message = await interaction.edit_original_response(embed=await view.get_embed(), view=view)
 
     async def handle_band_interaction(self, interaction: discord.Interaction, song:str, band_type:constants.BandTypes):
         oauth: OAuthManager = self.bot.oauth_manager
@@ -784,8 +760,8 @@ class LeaderboardCommandHandler:
 
         matched_track = matched_tracks[0]
 
-        view = BandLeaderboardView(matched_track['track']['su'], constants.get_season_lb_str(), chosen_band_type, interaction.user.id, oauth, matched_track)
-        view.message = await interaction.edit_original_response(embed=view.get_embed(), view=view)
+        view = BandLeaderboardView(matched_track['track']['su'], constants.get_season_lb_str(), chosen_band_type, interaction.user.id, oauth, matched_track, self.bot.leaderboard_service)
+        view.message = await interaction.edit_original_response(embed=await view.get_embed(), view=view)
 
     async def handle_alltime_interaction(self, interaction: discord.Interaction, song: str, type: constants.AllTimeLBTypes):
         oauth: OAuthManager = self.bot.oauth_manager
@@ -804,5 +780,5 @@ class LeaderboardCommandHandler:
         await interaction.response.defer() # Makes the bot say Thinking...
         matched_track = matched_tracks[0]
 
-        view = AllTimeLeaderboardView(matched_track['track']['su'], constants.get_season_lb_str(), chosen_instrument, interaction.user.id, oauth, matched_track)
-        view.message = await interaction.edit_original_response(embed=view.get_embed(), view=view)
+        view = AllTimeLeaderboardView(matched_track['track']['su'], constants.get_season_lb_str(), chosen_instrument, interaction.user.id, oauth, matched_track, self.bot.leaderboard_service)
+        view.message = await interaction.edit_original_response(embed=await view.get_embed(), view=view)
@@ -1,10 +1,10 @@
-from bot.commands.lyricsv2 import LyricParser
+from bot.commands.lyricsv2 import OverdriveIndex, assign_lyrics, assign_phrase_notes
+import functools
 import io
 import os
 from typing import Literal
 
 import discord
-import requests
 from bot import constants
 import mido
 from mido.midifiles.tracks import _to_abstime
@@ -16,6 +16,8 @@ import random
 import textwrap
 
 from bot.tools import midi
+from bot.tools.rendercache import ALBUM_ART_CACHE, FileCache
+from bot.tools.renderpool import RENDER_POOL
 from bot.tracks import JamTrackHandler
 
 class LyricsError(Exception):
@@ -38,6 +40,66 @@ event_map = {
     'outro': 'Outro',
 }
 
+@functools.lru_cache(maxsize=32)
+def get_font(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    """Loads each (font file, size) once per process instead of once per render."""
+    return ImageFont.truetype(font_path, size)
+
+# fonts come from get_font, so the same font is always the same object and hashes the same
+@functools.lru_cache(maxsize=16384)
+def measure_length(font: ImageFont.FreeTypeFont, text: str) -> float:
+    return font.getlength(text)
+
+@functools.lru_cache(maxsize=16384)
+def measure_bbox(font: ImageFont.FreeTypeFont, text: str) -> tuple[int, int, int, int]:
+    return font.getbbox(text)
+
+@functools.lru_cache(maxsize=256)
+def gradient_fill(w: int, h: int, colour_start: tuple, colour_end: tuple) -> Image.Image:
+    """A `w`x`h` horizontal gradient between two colours. Treat the result as read only, it is shared."""
+
+    row = []
+    for ix in range(w):
+        t = ix / (w - 1) if w > 1 else 0
+        r = int(colour_start[0] + (colour_end[0] - colour_start[0]) * t)
+        g = int(colour_start[1] + (colour_end[1] - colour_start[1]) * t)
+        b = int(colour_start[2] + (colour_end[2] - colour_start[2]) * t)
+        row.append((r, g, b, 255))
+
+    grad = Image.new('RGBA', (w, 1))
+    grad.putdata(row)
+    return grad.resize((w, h), Image.NEAREST)
+
+# bump whenever draw_lyrics or draw_lyrics_legacy change, so old renders are not served
+LYRICS_RENDERER_VERSION = 1
+
+LYRICS_RENDER_CACHE = FileCache('cache/lyrics/img/', max_bytes=256 * 1024 * 1024, name='lyrics')
+
+def render_lyrics_image(sentences: list[str], album_art_path: str, track: dict, legacy: bool, out_path: str) -> str:
+    # runs inside a render pool worker, only the path travels back
+    handler = LyricsHandler()
+    if legacy:
+        image = handler.draw_lyrics_legacy(
+            sentences=sentences, 
+            font_path="bot/data/Fonts/InterTight-Bold.ttf",
+            album_art_path=album_art_path,
+            line_spacing=10,
+            text_colour=(255, 255, 255),
+            song_name=track['track'].get('tt'), artist_name=track['track'].get('an')
+        )
+    else:
+        image = handler.draw_lyrics(
+            sentences=sentences, 
+            font_path="bot/data/Fonts/InterTight-Bold.ttf",
+            album_art_path=album_art_path,
+            line_spacing=10,
+            text_colour=(255, 255, 255),
+            song_data=track
+        )
+
+    image.save(out_path)
+    return out_path
+
 class LyricsHandler():
     def __init__(self):
         self.midi_tool = midi.MidiArchiveTools()
@@ -58,13 +120,6 @@ class LyricsHandler():
         
         track = matched_tracks[0]
 
-        midi = track['track']['mu']
-        midi_path = await self.midi_tool.save_chart(midi)
-        parser = LyricParser()
-        parser.parse(midi_path)
-
-        # return
-
         try:
             if pt == 'No':
                 fname = await self.load_lyrics(track, legacy=style == 'Legacy')
@@ -104,14 +159,18 @@ class LyricsHandler():
         midi_path = await self.midi_tool.save_chart(midi)
         
         midi_slug = midi_path.split('/')[-1].replace('.mid', '')
-        print(midi_slug)
 
-        os.makedirs('cache/lyrics', exist_ok=True)
-        os.makedirs('cache/lyrics/img', exist_ok=True)
+        # the plain text holds no drawing, so it does not depend on the style
+        variant = 'text' if plain_text else ('legacy' if legacy else 'stable')
+        ext = 'txt' if plain_text else 'png'
+        cache_name = f"lyrics_{track['track']['sn']}_{midi_slug}_{variant}_v{LYRICS_RENDERER_VERSION}.{ext}"
 
-        fname = f"cache/lyrics/img/lyrics_{track['track']['sn']}_{midi_slug}.png"
-        # if os.path.exists(fname):
-        #     return fname
+        cached = LYRICS_RENDER_CACHE.get(cache_name)
+        if cached:
+            if plain_text:
+                with open(cached, 'r', encoding='utf-8') as f:
+                    return f.read()
+            return cached
 
         mid = mido.MidiFile(midi_path, charset='utf-8')
         tracks: list[mido.MidiTrack] = mid.tracks
@@ -199,37 +258,8 @@ class LyricsHandler():
                 overdrive_phrases.append(cur_overdrive_phrase)
                 cur_overdrive_phrase = None
 
-        for lyric in messages_only_lyrics:
-            # Find the sung note that matches this lyric
-            matching_sung = discord.utils.find(lambda s: s['start'] == lyric.time, sung)
-            if matching_sung:
-                # find if this sung note is within an overdrive phrase
-                # by checking if its start time is between the start and end of any overdrive phrase
-                matching_sung['text'] = lyric.text
-                # # Find the phrase that contains this sung note
-                # matching_phrase = discord.utils.find(lambda p: p['start'] <= matching_sung['start'] <= p['end'], phrases)
-                # if matching_phrase:
-                #     matching_phrase['lyrics'].append(lyric.text)
-
-        for phrase in phrases:
-            phrase['notes'] = []
-            for s in sung:
-                # if it starts after or when the phrase starts
-                a = s['start'] >= phrase['start']
-                # if it ends before or when the phrase ends
-                b = s['end'] <= phrase['end']
-                # if it has valid text
-                c = s['text'] and len(s['text'].strip()) > 0
-
-                # if it ends before the next phrase starts (if there is a next phrase)
-                next_phrase = discord.utils.find(lambda p: p['start'] > phrase['start'], phrases)
-                if next_phrase:
-                    d = s['end'] < next_phrase['start']
-                else:
-                    d = True
-
-                if a and b and c and d:
-                    phrase['notes'].append(s)
+        assign_lyrics(sung, messages_only_lyrics)
+        assign_phrase_notes(phrases, sung)
 
         sentences = []
 
@@ -254,11 +284,9 @@ class LyricsHandler():
                     }]
                 })
 
+        overdrive_index = OverdriveIndex(overdrive_phrases)
         for phrase in phrases:
-            is_overdrive_active = discord.utils.find(lambda od: od['start'] <= phrase['start'] < od['end'], overdrive_phrases)
-
-            if is_overdrive_active:
-                print(phrase['notes'])
+            if overdrive_index.contains(phrase['start']):
                 phrase['notes'].insert(0, {
                     'start': phrase['start'],
                     'end': phrase['start'],
@@ -332,42 +360,18 @@ class LyricsHandler():
 
             sentences.append(sentence_text.strip())
 
-        aa = track['track'].get('au')
-        rq = requests.get(aa)
-        album_art_path = f"cache/lyrics/album_art_{track['track']['sn']}_{midi_slug}.jpg"
-        with open(album_art_path, 'wb') as f:
-            f.write(rq.content)
-
-        # attempt to get song and artist from track metadata (safe fallbacks)
-        song_name = track['track'].get('tt')
-        artist_name = track['track'].get('an')
-
-        if not plain_text:
-            if legacy:
-                image = self.draw_lyrics_legacy(
-                    sentences=sentences, 
-                    font_path="bot/data/Fonts/InterTight-Bold.ttf",
-                    album_art_path=album_art_path,
-                    line_spacing=10,
-                    text_colour=(255, 255, 255),
-                    song_name=song_name, artist_name=artist_name
-                )
-            else:
-                image = self.draw_lyrics(
-                    sentences=sentences, 
-                    font_path="bot/data/Fonts/InterTight-Bold.ttf",
-                    album_art_path=album_art_path,
-                    line_spacing=10,
-                    text_colour=(255, 255, 255),
-                    song_data=track
-                )
-        else:
-            return '\n'.join(sentences)
-            
-        # Save the image
-        image.save(fname)
+        if plain_text:
+            content = '\n'.join(sentences)
+            LYRICS_RENDER_CACHE.put(cache_name, content.encode('utf-8'))
+            return content
+
+        album_art_path = await ALBUM_ART_CACHE.fetch(track['track'].get('au'))
+
+        # Draw and save the image off the event loop
+        fname = LYRICS_RENDER_CACHE.path_for(cache_name)
+        await RENDER_POOL.submit(render_lyrics_image, sentences, album_art_path, track, legacy, fname)
 
-        return fname
+        return LYRICS_RENDER_CACHE.stored(cache_name)
 
     def draw_lyrics(self, sentences, 
         album_art_path, 
@@ -393,12 +397,12 @@ class LyricsHandler():
         pro_vocals_difficulty = song_data['track']['in'].get('bd', -1)
 
         try:
-            font = ImageFont.truetype(font_path, font_size)
-            font_sections = ImageFont.truetype(font_path, int(font_size / 1.5))
+            font = get_font(font_path, font_size)
+            font_sections = get_font(font_path, int(font_size / 1.5))
             header_height = max(0, 256 - margin)
-            font_title = ImageFont.truetype(font_path, 35)
-            font_artist = ImageFont.truetype(font_path, 30)
-            font_meta = ImageFont.truetype(font_path, 20)
+            font_title = get_font(font_path, 35)
+            font_artist = get_font(font_path, 30)
+            font_meta = get_font(font_path, 20)
         except IOError:
             print(f"Error: The font file '{font_path}' was not found.")
             return None
@@ -418,7 +422,7 @@ class LyricsHandler():
             current_line = ""
             for word in words:
                 test_line = f"{current_line} {word}".strip()
-                if font.getlength(test_line) <= text_area_width:
+                if measure_length(font, test_line) <= text_area_width:
                     current_line = test_line
                 else:
                     wrapped_lines.append(f'{prefix}{current_line}')
@@ -445,7 +449,7 @@ class LyricsHandler():
                     text = event_map.get(text.lower(), text)
                     is_section = True
 
-                text_bbox = font_to_use.getbbox(text)
+                text_bbox = measure_bbox(font_to_use, text)
                 text_height = text_bbox[3] - text_bbox[1]
                 h += text_height
                 if i < len(sentence_data['lines']) - 1:
@@ -662,8 +666,8 @@ class LyricsHandler():
             logo_path = os.path.join('bot', 'data', 'Logo', 'logo_update_every_season.png')
             if os.path.exists(logo_path):
                 wmark_text = 'festivaltracker.org'
-                font_wmark = ImageFont.truetype(font_path, 20)
-                wt_bbox = font_wmark.getbbox(wmark_text)
+                font_wmark = get_font(font_path, 20)
+                wt_bbox = measure_bbox(font_wmark, wmark_text)
                 wt_w = wt_bbox[2] - wt_bbox[0]
                 wt_h = wt_bbox[3] - wt_bbox[1]
 
@@ -702,23 +706,23 @@ class LyricsHandler():
         def ellipsize(text, font_obj, max_w):
             if not text:
                 return ''
-            if font_obj.getlength(text) <= max_w:
+            if measure_length(font_obj, text) <= max_w:
                 return text
             ell = '...'
             low, high = 0, len(text)
             while low < high:
                 mid = (low + high) // 2
                 candidate = text[:mid].rstrip() + ell
-                if font_obj.getlength(candidate) <= max_w:
+                if measure_length(font_obj, candidate) <= max_w:
                     low = mid + 1
                 else:
                     high = mid
             candidate = text[:max(0, low-1)].rstrip() + ell
-            if font_obj.getlength(candidate) <= max_w:
+            if measure_length(font_obj, candidate) <= max_w:
                 return candidate
             for i in range(len(text), 0, -1):
                 t = text[:i].rstrip() + ell
-                if font_obj.getlength(t) <= max_w:
+                if measure_length(font_obj, t) <= max_w:
                     return t
             return ell
 
@@ -738,11 +742,11 @@ class LyricsHandler():
             dur_sec = int(duration) % 60
             meta_line = f"{dur_min}:{dur_sec:02d}"
 
-        title_bbox = font_title.getbbox(title)
-        artist_bbox = font_artist.getbbox(artist)
+        title_bbox = measure_bbox(font_title, title)
+        artist_bbox = measure_bbox(font_artist, artist)
         title_h = title_bbox[3] - title_bbox[1] if title else 0
         artist_h = artist_bbox[3] - artist_bbox[1] if artist else 0
-        meta_h = (font_meta.getbbox(meta_line)[3] - font_meta.getbbox(meta_line)[1]) if meta_line else 0
+        meta_h = (measure_bbox(font_meta, meta_line)[3] - measure_bbox(font_meta, meta_line)[1]) if meta_line else 0
 
         # Difficulty bar dimensions
         diff_display = (pro_vocals_difficulty + 1) if pro_vocals_difficulty >= 0 else None
@@ -752,7 +756,7 @@ class LyricsHandler():
         bar_seg_gap = 4
         bar_total_w = bar_total_segments * bar_seg_w + (bar_total_segments - 1) * bar_seg_gap
         diff_label = f"{diff_display}/{bar_total_segments}" if diff_display is not None else ''
-        diff_label_w = font_meta.getlength(diff_label) if diff_label else 0
+        diff_label_w = measure_length(font_meta, diff_label) if diff_label else 0
         diff_row_h = bar_seg_h if diff_display is not None else 0
 
         spacing = 10
@@ -794,7 +798,7 @@ class LyricsHandler():
                 )
             label_x = bar_x + bar_total_w + 10
             label_rgba = (text_colour[0], text_colour[1], text_colour[2], int(0.6 * 255))
-            label_y_offset = int((bar_seg_h - (font_meta.getbbox(diff_label)[3] - font_meta.getbbox(diff_label)[1])) / 2)
+            label_y_offset = int((bar_seg_h - (measure_bbox(font_meta, diff_label)[3] - measure_bbox(font_meta, diff_label)[1])) / 2)
             draw_overlay.text((label_x, bar_y + label_y_offset - 5), diff_label, font=font_meta, fill=label_rgba)
         
         # Horizontal separator
@@ -810,7 +814,7 @@ class LyricsHandler():
 
         # Draw Lyrics per Column
         def draw_gradient_text(base_img, pos, text, font_obj, colour_start, colour_end):
-            bbox = font_obj.getbbox(text)
+            bbox = measure_bbox(font_obj, text)
             x0, y0, x1, y1 = bbox
             w = max(1, x1 - x0)
             h = max(1, y1 - y0)
@@ -819,14 +823,7 @@ class LyricsHandler():
             md = ImageDraw.Draw(txt_mask)
             md.text((-x0, -y0), text, font=font_obj, fill=255)
 
-            grad = Image.new('RGBA', (w, h))
-            gd = ImageDraw.Draw(grad)
-            for ix in range(w):
-                t = ix / (w - 1) if w > 1 else 0
-                r = int(colour_start[0] + (colour_end[0] - colour_start[0]) * t)
-                g = int(colour_start[1] + (colour_end[1] - colour_start[1]) * t)
-                b = int(colour_start[2] + (colour_end[2] - colour_start[2]) * t)
-                gd.line([(ix, 0), (ix, h)], fill=(r, g, b, 255))
+            grad = gradient_fill(w, h, colour_start, colour_end)
 
             px = pos[0] + x0
             py = pos[1] + y0
@@ -871,7 +868,7 @@ class LyricsHandler():
                     else:
                         draw_text.text((x_position, y_position), text, font=font_to_use, fill=cur_colour)
 
-                    text_height = font_to_use.getbbox(text)[3] - font_to_use.getbbox(text)[1]
+                    text_height = measure_bbox(font_to_use, text)[3] - measure_bbox(font_to_use, text)[1]
                     y_position += text_height
                     if is_section:
                         if not is_first_in_col:
@@ -910,14 +907,14 @@ class LyricsHandler():
         text_area_width = max_width - (2 * margin)
         
         try:
-            font = ImageFont.truetype(font_path, font_size)
-            font_sections = ImageFont.truetype(font_path, int(font_size / 1.5))
+            font = get_font(font_path, font_size)
+            font_sections = get_font(font_path, int(font_size / 1.5))
             # Header area settings: reserve space so everything below starts at y=256
             # margin + header_height == 256 -> header_height = 256 - margin
             header_height = max(0, 256 - margin)
             # Larger title/artist fonts for header
-            font_title = ImageFont.truetype(font_path, 35)
-            font_artist = ImageFont.truetype(font_path, 30)
+            font_title = get_font(font_path, 35)
+            font_artist = get_font(font_path, 30)
         except IOError:
             print(f"Error: The font file '{font_path}' was not found.")
             return None
@@ -937,7 +934,7 @@ class LyricsHandler():
             current_line = ""
             for word in words:
                 test_line = f"{current_line} {word}".strip()
-                if font.getlength(test_line) <= text_area_width:
+                if measure_length(font, test_line) <= text_area_width:
                     current_line = test_line
                 else:
                     wrapped_lines.append(f'{prefix}{current_line}')
@@ -965,7 +962,7 @@ class LyricsHandler():
 
                 line = line.replace('[[OD]]', '')
                 line = line.replace('SPECIAL-', '')
-                text_bbox = font_to_use.getbbox(line)
+                text_bbox = measure_bbox(font_to_use, line)
                 text_height = text_bbox[3] - text_bbox[1]
                 y_offset += text_height
                 if i < len(sentence_data['lines']) - 1: # Add line_spacing between wrapped lines
@@ -1142,7 +1139,7 @@ class LyricsHandler():
         def ellipsize(text, font_obj, max_w):
             if not text:
                 return ''
-            if font_obj.getlength(text) <= max_w:
+            if measure_length(font_obj, text) <= max_w:
                 return text
             ell = '...'
             # binary-search like shrink
@@ -1150,17 +1147,17 @@ class LyricsHandler():
             while low < high:
                 mid = (low + high) // 2
                 candidate = text[:mid].rstrip() + ell
-                if font_obj.getlength(candidate) <= max_w:
+                if measure_length(font_obj, candidate) <= max_w:
                     low = mid + 1
                 else:
                     high = mid
             candidate = text[:max(0, low-1)].rstrip() + ell
             # final fallback brute force
-            if font_obj.getlength(candidate) <= max_w:
+            if measure_length(font_obj, candidate) <= max_w:
                 return candidate
             for i in range(len(text), 0, -1):
                 t = text[:i].rstrip() + ell
-                if font_obj.getlength(t) <= max_w:
+                if measure_length(font_obj, t) <= max_w:
                     return t
             return ell
 
@@ -1168,8 +1165,8 @@ class LyricsHandler():
         artist = ellipsize(artist_name or '', font_artist, header_avail_width)
 
         # Center the two lines vertically relative to the album art's area
-        title_bbox = font_title.getbbox(title)
-        artist_bbox = font_artist.getbbox(artist)
+        title_bbox = measure_bbox(font_title, title)
+        artist_bbox = measure_bbox(font_artist, artist)
         title_h = title_bbox[3] - title_bbox[1] if title else 0
         artist_h = artist_bbox[3] - artist_bbox[1] if artist else 0
         spacing = 12
@@ -1225,7 +1222,7 @@ class LyricsHandler():
                     # We'll render gradient text instead of solid colour
                     def draw_gradient_text(base_img, pos, text, font_obj, colour_start, colour_end):
                         # compute bbox and size
-                        bbox = font_obj.getbbox(text)
+                        bbox = measure_bbox(font_obj, text)
                         x0, y0, x1, y1 = bbox
                         w = max(1, x1 - x0)
                         h = max(1, y1 - y0)
@@ -1236,14 +1233,7 @@ class LyricsHandler():
                         md.text((-x0, -y0), text, font=font_obj, fill=255)
 
                         # create horizontal gradient
-                        grad = Image.new('RGBA', (w, h))
-                        gd = ImageDraw.Draw(grad)
-                        for ix in range(w):
-                            t = ix / (w - 1) if w > 1 else 0
-                            r = int(colour_start[0] + (colour_end[0] - colour_start[0]) * t)
-                            g = int(colour_start[1] + (colour_end[1] - colour_start[1]) * t)
-                            b = int(colour_start[2] + (colour_end[2] - colour_start[2]) * t)
-                            gd.line([(ix, 0), (ix, h)], fill=(r, g, b, 255))
+                        grad = gradient_fill(w, h, colour_start, colour_end)
 
                         # paste gradient using text mask
                         px = pos[0] + x0
@@ -1259,7 +1249,7 @@ class LyricsHandler():
                 else:
                     if not is_overdrive:
                         draw_text.text((x_position, y_position), text, font=font_to_use, fill=cur_colour)
-                text_height = font_to_use.getbbox(text)[3] - font_to_use.getbbox(text)[1]
+                text_height = measure_bbox(font_to_use, text)[3] - measure_bbox(font_to_use, text)[1]
                 # print('Adding line spacing by ' + str(text_height) + ' to ' + str(y_position))
                 y_position += text_height
                 if is_section:
@@ -1296,8 +1286,8 @@ class LyricsHandler():
             # Draw footer text right-aligned with 45px right margin
             draw_footer = ImageDraw.Draw(composed)
             footer_text = 'festivaltracker.org'
-            font_wmark = ImageFont.truetype(font_path, 25)
-            text_bbox = font_wmark.getbbox(footer_text)
+            font_wmark = get_font(font_path, 25)
+            text_bbox = measure_bbox(font_wmark, footer_text)
             text_w = text_bbox[2] - text_bbox[0]
             text_h = text_bbox[3] - text_bbox[1]
             text_x = max_width - 45 - text_w
@@ -1,3 +1,4 @@
+import bisect
 import json
 import discord
 import re
@@ -7,6 +8,70 @@ from mido.midifiles.tracks import _to_abstime
 class LyricsError(Exception):
     pass
 
+def assign_lyrics(sung: list[dict], lyrics: list[mido.MetaMessage]):
+    """Sets the text of the first sung note starting on each lyric's tick."""
+
+    sung_by_start = {}
+    for s in sung:
+        sung_by_start.setdefault(s['start'], s)
+
+    for lyric in lyrics:
+        matching_sung = sung_by_start.get(lyric.time)
+        if matching_sung:
+            matching_sung['text'] = lyric.text
+
+def assign_phrase_notes(phrases: list[dict], sung: list[dict]):
+    """Fills `phrase['notes']` with the sung notes (with text) inside each phrase.
+
+    A note belongs to a phrase if it starts and ends within it and ends before the next phrase
+    starts. Both lists must be sorted by start, so only the notes starting inside the phrase
+    are looked at instead of all of them.
+    """
+
+    phrase_starts = [p['start'] for p in phrases]
+    sung_starts = [s['start'] for s in sung]
+
+    for phrase in phrases:
+        next_phrase_idx = bisect.bisect_right(phrase_starts, phrase['start'])
+        next_phrase_start = phrase_starts[next_phrase_idx] if next_phrase_idx < len(phrases) else None
+
+        phrase['notes'] = []
+        for i in range(bisect.bisect_left(sung_starts, phrase['start']), len(sung)):
+            s = sung[i]
+            # notes end after they start, so nothing from here on can end within the phrase
+            if s['start'] > phrase['end']:
+                break
+
+            if s['end'] > phrase['end']:
+                continue
+            if not (s['text'] and len(s['text'].strip()) > 0):
+                continue
+            if next_phrase_start is not None and s['end'] >= next_phrase_start:
+                continue
+
+            phrase['notes'].append(s)
+
+class OverdriveIndex:
+    def __init__(self, overdrive_phrases: list[dict]):
+        """Answers whether a tick falls inside any overdrive phrase in O(log n).
+
+        Keeps the overdrive phrases sorted by start, along with the furthest end seen so far, so
+        a tick is inside one of them if any phrase starting at or before it ends after it.
+        """
+
+        ordered = sorted(overdrive_phrases, key=lambda od: od['start'])
+        self.starts = [od['start'] for od in ordered]
+        self.max_ends = []
+
+        max_end = None
+        for od in ordered:
+            max_end = od['end'] if max_end is None else max(max_end, od['end'])
+            self.max_ends.append(max_end)
+
+    def contains(self, tick) -> bool:
+        idx = bisect.bisect_right(self.starts, tick) - 1
+        return idx >= 0 and tick < self.max_ends[idx]
+
 class LyricParser:
     def __init__(self, ):
         pass
@@ -97,42 +162,12 @@ class LyricParser:
                 overdrive_phrases.append(cur_overdrive_phrase)
                 cur_overdrive_phrase = None
 
-        for lyric in messages_only_lyrics:
-            # Find the sung note that matches this lyric
-            matching_sung = discord.utils.find(lambda s: s['start'] == lyric.time, sung)
-            if matching_sung:
-                # find if this sung note is within an overdrive phrase
-                # by checking if its start time is between the start and end of any overdrive phrase
-                matching_sung['text'] = lyric.text
-                # # Find the phrase that contains this sung note
-                # matching_phrase = discord.utils.find(lambda p: p['start'] <= matching_sung['start'] <= p['end'], phrases)
-                # if matching_phrase:
-                #     matching_phrase['lyrics'].append(lyric.text)
-
-        for phrase in phrases:
-            phrase['notes'] = []
-            for s in sung:
-                # if it starts after or when the phrase starts
-                a = s['start'] >= phrase['start']
-                # if it ends before or when the phrase ends
-                b = s['end'] <= phrase['end']
-                # if it has valid text
-                c = s['text'] and len(s['text'].strip()) > 0
-
-                # if it ends before the next phrase starts (if there is a next phrase)
-                next_phrase = discord.utils.find(lambda p: p['start'] > phrase['start'], phrases)
-                if next_phrase:
-                    d = s['end'] < next_phrase['start']
-                else:
-                    d = True
-
-                if a and b and c and d:
-                    phrase['notes'].append(s)
-
+        assign_lyrics(sung, messages_only_lyrics)
+        assign_phrase_notes(phrases, sung)
 
+        overdrive_index = OverdriveIndex(overdrive_phrases)
         for phrase in phrases:
-            is_overdrive_active = discord.utils.find(lambda od: od['start'] <= phrase['start'] < od['end'], overdrive_phrases)
-            if is_overdrive_active:
+            if overdrive_index.contains(phrase['start']):
                 phrase['is_overdrive'] = True
 
         # sort them again just in case
@@ -142,6 +177,20 @@ class LyricParser:
         messages = list(_to_abstime(section_track))
         messages_only_sub_section_separators = list(filter(lambda m: m.type == 'note_on' and m.velocity > 0 and m.note == 10, messages))
         messages_only_meta = list(filter(lambda m: isinstance(m, mido.MetaMessage), messages))
+
+        # both come out of the track in time order
+        meta_times = [m.time for m in messages_only_meta]
+        separator_times = [sep.time for sep in messages_only_sub_section_separators]
+        phrase_starts = [p['start'] for p in phrases]
+
+        def first_meta_after(time):
+            idx = bisect.bisect_right(meta_times, time)
+            return messages_only_meta[idx] if idx < len(messages_only_meta) else None
+
+        def phrases_between(adjusted_start, adjusted_end=None):
+            lo = bisect.bisect_left(phrase_starts, adjusted_start)
+            hi = bisect.bisect_right(phrase_starts, adjusted_end) if adjusted_end is not None else len(phrases)
+            return phrases[lo:hi]
         
         # section markers
         for m in messages_only_meta:
@@ -149,36 +198,37 @@ class LyricParser:
                 # we're gonna find all the sub-section separators within this section
                 # DO NOT USE adjusted times here!
                 related_sub_sections = []
-                next_section = discord.utils.find(lambda s: s.time > m.time, messages_only_meta)
+                next_section = first_meta_after(m.time)
+                lo = bisect.bisect_left(separator_times, m.time)
                 if next_section:
-                    related_sub_sections = list(filter(
-                        lambda sep: sep.time >= m.time and sep.time < next_section.time, 
-                        messages_only_sub_section_separators))
+                    hi = bisect.bisect_left(separator_times, next_section.time)
+                    related_sub_sections = messages_only_sub_section_separators[lo:hi]
                 else:
-                    related_sub_sections = list(filter(
-                        lambda sep: sep.time >= m.time, 
-                        messages_only_sub_section_separators))
+                    related_sub_sections = messages_only_sub_section_separators[lo:]
 
                 print(related_sub_sections)
 
                 sub_sections = []
 
+                related_times = [sep.time for sep in related_sub_sections]
+
                 for ssep in related_sub_sections:
                     related_phrases = []
 
                     # find all the phrases WITHIN this sub section marker and the next (if there is)
                     adjusted_start = ssep.time - (mid.ticks_per_beat * 1.5)
-                    next_ssep = discord.utils.find(lambda s: s.time > ssep.time, related_sub_sections)
+                    next_ssep_idx = bisect.bisect_right(related_times, ssep.time)
+                    next_ssep = related_sub_sections[next_ssep_idx] if next_ssep_idx < len(related_sub_sections) else None
                     if next_ssep:
                         adjusted_end = next_ssep.time - (mid.ticks_per_beat * 1.5)
-                        related_phrases = list(filter(lambda p: p['start'] >= adjusted_start and p['start'] <= adjusted_end, phrases))
+                        related_phrases = phrases_between(adjusted_start, adjusted_end)
                     else:
                         # if we can't find the next separator we will use the next section instead
                         # find the next section
-                        next_section = discord.utils.find(lambda s: s.time > m.time, messages_only_meta)
+                        next_section = first_meta_after(m.time)
                         if next_section:
                             adjusted_end = next_section.time - (mid.ticks_per_beat * 1.5)
-                            related_phrases = list(filter(lambda p: p['start'] >= adjusted_start and p['start'] <= adjusted_end, phrases))
+                            related_phrases = phrases_between(adjusted_start, adjusted_end)
                         else:
                             # this code should NEVER be ran
                             print('ALERT!!!!!!!')
@@ -186,7 +236,7 @@ class LyricParser:
                             print('ALERT!!!!!!!')
                             print('ALERT!!!!!!!')
                             print('ALERT!!!!!!!')
-                            related_phrases = list(filter(lambda p: p['start'] >= adjusted_start, phrases))
+                            related_phrases = phrases_between(adjusted_start)
 
                     sub_sections.append({
                         'phrases': related_phrases,
@@ -1,10 +1,11 @@
+import asyncio
 import logging
 import os
 import re
-import subprocess
 import discord
 
 from bot import constants
+from bot.tools.chopt import CHOPT_RUNNER, ChoptResult
 from bot.tools.midi import MidiArchiveTools
 from bot.tracks import JamTrackHandler
 
@@ -13,23 +14,13 @@ class PathCommandHandler():
         self.jam_track_handler = JamTrackHandler()
         self.midi_tool = MidiArchiveTools()
 
-    # Function to call chopt.exe and capture its output
-    def run_chopt(self, midi_file: str, command_instrument: str, output_image: str, squeeze_percent: int = 20, instrument: constants.Instrument = None, difficulty: str = 'expert', extra_args: list = [], binary_id = 1):
+    def chopt_args(self, command_instrument: str, squeeze_percent: int = 20, instrument: constants.Instrument = None, difficulty: str = 'expert', extra_args: list = []) -> list[str]:
         engine = 'fnf'
 
-        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
         # if instrument.midi == 'PLASTIC DRUMS' and binary_id == 1:
         #     engine = 'ch'
-        
-        if os.name == 'nt':
-            chopt_exe = os.path.join(script_dir, 'data', 'Binaries', 'Windows', 'CHOpt', str(binary_id), 'CHOpt.exe')
-        else:
-            chopt_exe = os.path.join(script_dir, 'data', 'Binaries', 'Linux', 'CHOpt', str(binary_id), 'CHOpt.sh')
 
-        chopt_command = [
-            chopt_exe, 
-            '-f', midi_file, 
+        chopt_args = [
             '--engine', engine, 
             '--squeeze', str(squeeze_percent),
             '--early-whammy', '0',
@@ -38,23 +29,53 @@ class PathCommandHandler():
 
         # Only add --no-pro-drums flag if it's NOT Pro Drums
         if instrument.midi != 'PLASTIC DRUMS':
-            chopt_command.append('--no-pro-drums')
+            chopt_args.append('--no-pro-drums')
 
-        chopt_command.extend([
-            '-i', command_instrument, 
-            '-o', os.path.join(constants.TEMP_FOLDER, output_image)
-        ])
+        chopt_args.extend(['-i', command_instrument])
+        chopt_args.extend(extra_args)
 
-        chopt_command.extend(extra_args)
+        return chopt_args
 
-        logging.info(f'Running CHOpt: "{' '.join(chopt_command)}"')
+    def song_ini(self, track_title: str, artist_title: str) -> str:
+        return "[song]\nname = " + track_title + "\n" + "artist = " + artist_title + "\n" + "charter = Festival Tracker"
 
-        result = subprocess.run(chopt_command, text=True, capture_output=True)
-
-        if result.returncode != 0:
-            raise Exception("CHOpt Error: " + result.stderr)
-
-        return result.stdout.strip()
+    # Function to call chopt.exe and capture its output
+    async def run_chopt(self, midi_file: str, command_instrument: str, squeeze_percent: int = 20, instrument: constants.Instrument = None, difficulty: str = 'expert', extra_args: list = [], binary_id = 1, song_ini: str = '') -> ChoptResult:
+        chopt_args = self.chopt_args(command_instrument, squeeze_percent, instrument=instrument, difficulty=difficulty, extra_args=extra_args)
+        return await CHOPT_RUNNER.run(midi_file, chopt_args, binary_id=binary_id, song_ini=song_ini)
+
+    async def precompute_paths(self, track: dict) -> int:
+        """Queues Expert paths at the default squeeze for every instrument of `track`, so they are cached before anyone asks."""
+
+        short_name = track['track']['sn']
+        midi_file = await self.midi_tool.save_chart(track['track']['mu'], log=False)
+        song_ini = self.song_ini(track['track']['tt'], track['track']['an'])
+        expert = constants.Difficulties.Expert.value
+
+        session_hash = f'pathwarmup_{short_name}'
+        queued = 0
+        for instrument in constants.Instruments.__members__.values():
+            instrument = instrument.value
+            if not instrument.path_enabled:
+                continue
+
+            chart_file = midi_file
+            if instrument.replace != None:
+                # mido is slow and synchronous, keep it off the event loop
+                chart_file = await asyncio.to_thread(self.midi_tool.modify_midi_file, midi_file, instrument, instrument.lb_code, short_name, output_folder=constants.session_folder(session_hash))
+
+            # same defaults as /path
+            squeeze_percent = 95 if instrument.lb_code == 'Solo_PeripheralVocals' else 20
+            chopt_args = self.chopt_args(instrument.chopt, squeeze_percent, instrument=instrument, difficulty=expert.chopt)
+
+            if CHOPT_RUNNER.queue_background(chart_file, chopt_args, binary_id=instrument.binary_id, song_ini=song_ini):
+                queued += 1
+
+        # the charts have been read into the queue already
+        constants.delete_session_files(session_hash)
+
+        logging.info(f'Queued {queued} paths to precompute for {short_name}')
+        return queued
     
     def process_acts(self, arr):
         sum_phrases = 0
@@ -144,22 +165,20 @@ class PathCommandHandler():
 
         modified_midi_file = None
         if chosen_instrument.replace != None:
-            modified_midi_file = self.midi_tool.modify_midi_file(midi_file, chosen_instrument, session_hash, short_name)
+            modified_midi_file = self.midi_tool.modify_midi_file(midi_file, chosen_instrument, session_hash, short_name, output_folder=constants.session_folder(session_hash))
             if not modified_midi_file:
                 await interaction.edit_original_response(embed=constants.common_error_embed(f"Failed to modify MIDI for '{instrument}'."))
                 return
             midi_file = modified_midi_file
 
-        song_ini_w_path = f'{os.path.dirname(midi_file)}/song.ini'
-        # print(song_ini_w_path)
-        open(song_ini_w_path, 'w', encoding="utf-8").write("[song]\nname = " + track_title + "\n" + "artist = " + artist_title + "\n" + "charter = Festival Tracker")
+        song_ini = self.song_ini(track_title, artist_title)
 
         output_image = f"{short_name}_{chosen_instrument.chopt.lower()}_path_{session_hash}.png".replace(' ', '_')
 
         binary_id = chosen_instrument.binary_id
-        chopt_output = self.run_chopt(midi_file, command_instrument, output_image, squeeze_percent, instrument=chosen_instrument, difficulty=chosen_diff.chopt,extra_args=extra_arguments, binary_id=binary_id)
+        chopt_result = await self.run_chopt(midi_file, command_instrument, squeeze_percent, instrument=chosen_instrument, difficulty=chosen_diff.chopt,extra_args=extra_arguments, binary_id=binary_id, song_ini=song_ini)
 
-        filtered_output = '\n'.join([line for line in chopt_output.splitlines() if "Optimising, please wait..." not in line])
+        filtered_output = '\n'.join([line for line in chopt_result.output.splitlines() if "Optimising, please wait..." not in line])
 
         description = (
             f"**Instrument & Diff.:** {display_instrument} ({chosen_diff.english})\n"
@@ -169,8 +188,9 @@ class PathCommandHandler():
         for arg in field_argument_descriptors:
             description += f'{arg}\n'
 
-        if os.path.exists(os.path.join(constants.TEMP_FOLDER, output_image)):
-            file = discord.File(os.path.join(constants.TEMP_FOLDER, output_image), filename=output_image)
+        if os.path.exists(chopt_result.image_path):
+            # the image stays in the path cache, it is only attached under a friendlier name
+            file = discord.File(chopt_result.image_path, filename=output_image)
 
             container = discord.ui.Container()
             container.accent_colour = constants.ACCENT_COLOUR
@@ -1,13 +1,89 @@
-from datetime import datetime, timezone
+import asyncio
+from datetime import datetime
+import hashlib
 import json
-import logging
 import discord
-import requests
 from PIL import Image
-import io
 import bot.constants as constants
 from bot.views.setlists_views import SetlistView
 from PIL import ImageFilter, ImageEnhance
+from bot.tools.renderpool import RENDER_POOL
+from bot.tools.rendercache import ALBUM_ART_CACHE, FileCache, save_image
+
+SETLIST_COLLAGE_CACHE = FileCache(f'{constants.CACHE_FOLDER}setlists/', max_bytes=64 * 1024 * 1024, name='setlists')
+SETLIST_BACKGROUND_NAME = 'background_1024.png'
+
+def render_setlist_background(output_path: str) -> None:
+    # runs inside a render pool worker
+    grid_w, grid_h = 512 * 2, 512 * 2
+    bg = Image.open("bot/data/Logo/Festival_Tracker_Fuser_sat.png").convert("RGBA")
+    bg = bg.resize((grid_w, grid_h))
+    bg = bg.filter(ImageFilter.GaussianBlur(radius=75))
+    bg = ImageEnhance.Brightness(bg).enhance(0.4)
+    save_image(bg, output_path)
+
+def render_setlist_collage(art_paths: list[str], background_path: str, output_path: str) -> None:
+    # runs inside a render pool worker, the art is already 512x512 RGBA
+    all_imgs = [Image.open(path).convert("RGBA") for path in art_paths]
+
+    grid = Image.open(background_path).convert("RGBA")
+
+    if len(all_imgs) <= 4:
+        # normal
+        imgs = list(all_imgs)
+        while len(imgs) < 4:
+            imgs.append(Image.new("RGBA", (512, 512), (0, 0, 0, 0)))
+        positions = [(0, 0), (512, 0), (0, 512), (512, 512)]
+        for img, pos in zip(imgs, positions):
+            grid.paste(img, pos, img)
+    else:
+        # mini 4x4 in last grid slot
+        first_three = all_imgs[:3]
+        for img, pos in zip(first_three, [(0, 0), (512, 0), (0, 512)]):
+            grid.paste(img, pos, img)
+        overflow = all_imgs[3:7]
+        mini_positions = [(512, 512), (768, 512), (512, 768), (768, 768)]
+        for img, mini_pos in zip(overflow, mini_positions):
+            mini = img.resize((256, 256))
+            grid.paste(mini, mini_pos, mini)
+
+    save_image(grid, output_path)
+
+_background_task: asyncio.Task = None
+
+async def _render_setlist_background() -> str:
+    await RENDER_POOL.submit(render_setlist_background, SETLIST_COLLAGE_CACHE.path_for(SETLIST_BACKGROUND_NAME))
+    return SETLIST_COLLAGE_CACHE.stored(SETLIST_BACKGROUND_NAME)
+
+async def get_setlist_background() -> str:
+    global _background_task
+
+    background_path = SETLIST_COLLAGE_CACHE.get(SETLIST_BACKGROUND_NAME)
+    if background_path:
+        return background_path
+
+    # every setlist of a command asks at once on a cold cache, only one of them draws it
+    if _background_task is None or _background_task.done():
+        _background_task = asyncio.create_task(_render_setlist_background())
+    return await asyncio.shield(_background_task)
+
+async def get_setlist_collage(shortnames: list[str], art_urls: list[str], active_until_date: datetime) -> str:
+    """Path to the collage of a setlist, drawn once per setlist contents and end date."""
+
+    key = hashlib.sha1(json.dumps([shortnames, art_urls, active_until_date.isoformat()]).encode('utf-8')).hexdigest()
+    cache_name = f'{key}.png'
+
+    cached = SETLIST_COLLAGE_CACHE.get(cache_name)
+    if cached:
+        return cached
+
+    background_path = await get_setlist_background()
+
+    # only the covers which end up in the collage
+    art_paths = await ALBUM_ART_CACHE.thumbnails(art_urls[:7], 512)
+
+    await RENDER_POOL.submit(render_setlist_collage, art_paths, background_path, SETLIST_COLLAGE_CACHE.path_for(cache_name))
+    return SETLIST_COLLAGE_CACHE.stored(cache_name)
 
 class SetlistHandler():
     def __init__(self, bot):
@@ -18,71 +94,20 @@ class SetlistHandler():
 
         await interaction.response.defer()
 
-        logging.debug(f'[GET] {constants.FN_CALENDAR}')
-        headers = {
-            'Authorization': self.bot.oauth_manager.session_token
-        }
-        response = requests.get(constants.FN_CALENDAR, headers=headers)
-        data = response.json()
-
-        print(data)
-        # open('debug_daily.json', 'w').write(json.dumps(data, indent=4))
-
-        track_list = constants.get_jam_tracks(use_cache=True)
-
-        available_setlists = {}
-
-        channels = data.get('channels', {})
-        client_events_data = channels.get('client-events', {})
-        states = client_events_data.get('states', [])
-
-        current_time = datetime.now(timezone.utc)
-        
-        valid_states = [state for state in states if datetime.fromisoformat(state['validFrom'].replace('Z', '+00:00')) <= current_time]
-        valid_states.sort(key=lambda x: datetime.fromisoformat(x['validFrom'].replace('Z', '+00:00')), reverse=True)
-
-        if not valid_states:
+        calendar = await self.bot.calendar.get()
+        if not calendar.has_state:
             raise ValueError("No valid states found")
 
-        active_events = valid_states[0].get('activeEvents', [])
-        for event in active_events:
-            event_type = event.get('eventType', '')
-            active_since = event.get('activeSince', '')
-            active_until = event.get('activeUntil', '')
-
-            active_since_date = datetime.fromisoformat(active_since.replace('Z', '+00:00')) if active_since else None
-            active_until_date = datetime.fromisoformat(active_until.replace('Z', '+00:00')) if active_until else None
-
-            if event_type.startswith('Sparks_CuratedSetlist') and active_since_date and active_until_date:
-                if active_since_date <= current_time <= active_until_date:
-                    setlist_meta = event_type.split(':')[0]
-                    setlist_class = setlist_meta.split(',')[0]
-                    setlist_idx = int(setlist_class.split('_')[-1])
-                    
-                    setlist_values = event_type.split(':')[1]
-                    setlist_songs: list[str] = setlist_values.split(',')
-                    normalised = [song.lstrip().rstrip() for song in setlist_songs]
+        track_list = constants.get_jam_tracks(use_cache=True)
 
-                    available_setlists[f"setlist_{setlist_idx}"] = normalised + [active_until_date]
+        tracks_by_shortname = {track['track']['sn']: track for track in track_list}
 
         containers: list[discord.ui.Container] = []
-        img_bytes = []
-
-        def _sort_key(item):
-            key = item[0]
-            parts = key.rsplit('_', 1)
-            if len(parts) == 2 and parts[1].isdigit():
-                return int(parts[1])
-            return key
-
-        available_setlists = dict(sorted(available_setlists.items(), key=_sort_key))
+        collages = []
 
-        for setlist_id, setlist_data in available_setlists.items():
+        for setlist_id, (shortnames, active_until_date) in calendar.setlists.items():
             container = discord.ui.Container()
 
-            shortnames = setlist_data[:-1]
-            active_until_date = setlist_data[-1]
-
             setlist_names = ['Daily Vibes', 'Spotlight', 'Festival Selects']
             idx = int(setlist_id.split('_')[-1]) - 1
             if idx > len(setlist_names) - 1:
@@ -97,7 +122,7 @@ class SetlistHandler():
             auurls = []
 
             for shortname in shortnames:
-                track_info = discord.utils.find(lambda t: t['track']['sn'] == shortname, track_list)
+                track_info = tracks_by_shortname.get(shortname)
                 if not track_info:
                     track_info = {'track': {'tt': shortname, 'an': '[Song Not Found]', 'dn': 0, 'au': 'https://festivaltracker.org/assets/img/no_album_art.png'}}
 
@@ -112,41 +137,7 @@ class SetlistHandler():
             td = discord.ui.TextDisplay(f"{len(shortnames)} songs · {length}\n{songsstr}Ends {discord.utils.format_dt(active_until_date, 'R')}")
             container.add_item(td)
 
-            all_imgs = []
-            for url in auurls:
-                r = requests.get(url)
-                img = Image.open(io.BytesIO(r.content)).convert("RGBA").resize((512, 512))
-                all_imgs.append(img)
-
-            grid_w, grid_h = 512 * 2, 512 * 2
-            bg = Image.open("bot/data/Logo/Festival_Tracker_Fuser_sat.png").convert("RGBA")
-            bg = bg.resize((grid_w, grid_h))
-            bg = bg.filter(ImageFilter.GaussianBlur(radius=75))
-            bg = ImageEnhance.Brightness(bg).enhance(0.4)
-            grid = bg
-
-            if len(all_imgs) <= 4:
-                # normal
-                imgs = list(all_imgs)
-                while len(imgs) < 4:
-                    imgs.append(Image.new("RGBA", (512, 512), (0, 0, 0, 0)))
-                positions = [(0, 0), (512, 0), (0, 512), (512, 512)]
-                for img, pos in zip(imgs, positions):
-                    grid.paste(img, pos, img)
-            else:
-                # mini 4x4 in last grid slot
-                first_three = all_imgs[:3]
-                for img, pos in zip(first_three, [(0, 0), (512, 0), (0, 512)]):
-                    grid.paste(img, pos, img)
-                overflow = all_imgs[3:7]
-                mini_positions = [(512, 512), (768, 512), (512, 768), (768, 768)]
-                for img, mini_pos in zip(overflow, mini_positions):
-                    mini = img.resize((256, 256))
-                    grid.paste(mini, mini_pos, mini)
-
-            img_bytes_io = io.BytesIO()
-            grid.save(img_bytes_io, format="PNG")
-            grid_image_bytes = img_bytes_io.getvalue()
+            collages.append((setlist_id, get_setlist_collage(shortnames, auurls, active_until_date)))
 
             container.add_item(discord.ui.MediaGallery(
                 discord.MediaGalleryItem(f"attachment://{setlist_id}.png")
@@ -156,12 +147,14 @@ class SetlistHandler():
             container.add_item(discord.ui.Separator())
             container.add_item(discord.ui.TextDisplay(f"-# Festival Tracker"))
 
-            img_bytes.append( (f"{setlist_id}.png", grid_image_bytes) )
-
             containers.append(container)
 
+        # every setlist's collage at once, each is cached until the setlist changes
+        collage_paths = await asyncio.gather(*[collage for _, collage in collages])
+        files = [discord.File(path, filename=f"{setlist_id}.png") for (setlist_id, _), path in zip(collages, collage_paths)]
+
         view = SetlistView(containers=containers, user_id=interaction.user.id)
         view.update_components()
 
-        msg = await interaction.followup.send(view=view, files=[discord.File(io.BytesIO(img_data), filename=img_name) for img_name, img_data in img_bytes], wait=True)
+        msg = await interaction.followup.send(view=view, files=files, wait=True)
         view.message = msg
\ No newline at end of file
@@ -9,6 +9,7 @@ import hashlib
 import json
 import logging
 import os
+import shutil
 
 import discord
 import requests
@@ -47,6 +48,11 @@ TEMP_FOLDER = "temp/"
 if not os.path.exists(TEMP_FOLDER):
     os.makedirs(TEMP_FOLDER)
 
+# every session gets its own folder in here, see session_folder
+SESSIONS_FOLDER = "temp/sessions/"
+if not os.path.exists(SESSIONS_FOLDER):
+    os.makedirs(SESSIONS_FOLDER)
+
 config = ConfigParser()
 config.read('config.ini')
 BOT_OWNERS: list[int] = [int(uid) for uid in config.get('bot', 'bot_owners', fallback="").split(', ')]
@@ -70,6 +76,10 @@ EPIC_DEVICE_AUTH_CLIENT_SECRET: str = config.get('bot', 'epic_device_auth_client
 
 IS_DEVELOPER_ENVIRONMENT = config.getboolean('bot', 'is_developer_environment', fallback=False)
 
+# /metrics for Prometheus, only reachable from this machine by default; port 0 turns it off
+METRICS_HOST: str = config.get('bot', 'metrics_host', fallback='127.0.0.1')
+METRICS_PORT: int = config.getint('bot', 'metrics_port', fallback=9108)
+
 SPARKS_MIDI_KEY: str = config.get('bot', 'sparks_midi_key') #b64
 AGREEMENTS_DATA = json.loads(open('bot/agreements/index.json', 'r').read())
 
@@ -221,25 +231,6 @@ OAUTH_MANAGER: OAuthManager = None
 
 from bot.tools.taskregistry import TASK_REGISTRY, register_task
 
-class Analytic:
-    def __init__(self, interaction: discord.Interaction):
-        self.is_dm: bool = interaction.guild == None
-        self.guild_name: str = "DMs"
-        self.guild_id: int = None
-        self.command_name: str = None
-        self.guild_member_count: int = 0
-        if not self.is_dm:
-            self.guild_name = interaction.guild.name
-        if not self.is_dm:
-            self.guild_id = interaction.guild.id
-        if not self.is_dm:
-            self.guild_member_count = interaction.guild.member_count
-        if interaction.command:
-            self.command_name = interaction.command.qualified_name
-        self.interaction_language: str = interaction.locale
-        self.interaction_data: dict = interaction.data
-        self.time: datetime = interaction.created_at
-
 class PaginatorView(discord.ui.View):
     def __init__(self, embeds, user_id):
         super().__init__(timeout=30)
@@ -747,13 +738,19 @@ def generate_session_hash(user_id, song_name):
 
     return str(hash_int % 10**8).zfill(8)
 
+def session_folder(session_hash) -> str:
+    """The temp folder for one session, created on first use and removed by delete_session_files."""
+    folder = os.path.join(SESSIONS_FOLDER, str(session_hash))
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
 def delete_session_files(session_hash):
+    folder = os.path.join(SESSIONS_FOLDER, str(session_hash))
     try:
-        for file_name in os.listdir(TEMP_FOLDER):
-            if session_hash in file_name:
-                file_path = os.path.join(TEMP_FOLDER, file_name)
-                os.remove(file_path)
-                logging.info(f"Deleted file: {file_path}")
+        shutil.rmtree(folder)
+        logging.info(f"Deleted session folder: {folder}")
+    except FileNotFoundError:
+        pass
     except Exception as e:
         logging.error(f"Error while cleaning up files for session {session_hash}", exc_info=e)
 
@@ -1,10 +1,13 @@
 from datetime import datetime
 import enum
-from typing import List
+import logging
+import time
+from typing import Awaitable, Callable, List
 
 import aiosqlite
 import discord
-import asyncio
+
+from bot.tools.metrics import DB_LOCK_WAIT, TimedLock
 
 import os
 import base64
@@ -104,13 +107,228 @@ class WishlistEntry():
         self.lock_rotation_active = lock_rotation_active
         self.lock_shop_active = lock_shop_active
 
+class Migration():
+    def __init__(self, version: int, name: str, apply: Callable[[aiosqlite.Connection], Awaitable[None]]) -> None:
+        """A single schema migration.
+
+        Properties:
+            `version` The schema version the database is at after this migration.
+            `name` Short name, stored alongside the version in `schema_migrations`.
+            `apply` Coroutine which performs the migration on the given connection.
+        """
+
+        self.version = version
+        self.name = name
+        self.apply = apply
+
+async def _migration_baseline(db: aiosqlite.Connection) -> None:
+    # the original schema, so a fresh database goes through the same steps as an old one
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS channel_subscriptions (
+            channel_id TEXT PRIMARY KEY,
+            guild_id TEXT,
+            events TEXT,
+            roles TEXT
+        );
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_subscriptions (
+            user_id TEXT PRIMARY KEY,
+            events TEXT
+        );
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS wishlists (
+            user_id TEXT,
+            shortname TEXT,
+            created_at TEXT,
+            lock_rotation_active INTEGER DEFAULT 0,
+            lock_shop_active INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, shortname)
+        );
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS profiles (
+            user_id TEXT PRIMARY KEY
+        );
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS agreements (
+            user_id TEXT PRIMARY KEY,
+            privacy_policy_accepted INTEGER DEFAULT 0,
+            privacy_policy_version TEXT,
+            terms_of_service_accepted INTEGER DEFAULT 0,
+            terms_of_service_version TEXT
+        );
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS votes (
+            user_id TEXT,
+            shortname TEXT,
+            timestamp TEXT,
+            vote_direction INTEGER,
+            vote_channel_id TEXT,
+            vote_server_id TEXT,
+            vote_source_window TEXT,
+            vote_made_within_new_until_window INTEGER,
+            PRIMARY KEY (user_id, shortname)
+        );
+    ''')
+
+def _split_csv(value: str | None) -> list[str]:
+    return [part for part in (value or '').split(',') if len(part) > 0]
+
+async def _migration_integer_keys(db: aiosqlite.Connection) -> None:
+    # snowflakes become INTEGER, and the comma separated events/roles columns
+    # are moved into their own tables so they can be queried and indexed
+    await db.execute('''
+        CREATE TABLE channel_subscriptions_new (
+            channel_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL
+        );
+    ''')
+    await db.execute('''
+        CREATE TABLE channel_subscription_events (
+            channel_id INTEGER NOT NULL REFERENCES channel_subscriptions(channel_id) ON DELETE CASCADE,
+            event TEXT NOT NULL,
+            PRIMARY KEY (channel_id, event)
+        ) WITHOUT ROWID;
+    ''')
+    await db.execute('''
+        CREATE TABLE channel_subscription_roles (
+            channel_id INTEGER NOT NULL REFERENCES channel_subscriptions(channel_id) ON DELETE CASCADE,
+            role_id INTEGER NOT NULL,
+            PRIMARY KEY (channel_id, role_id)
+        ) WITHOUT ROWID;
+    ''')
+
+    async with db.execute("SELECT channel_id, guild_id, events, roles FROM channel_subscriptions") as cursor:
+        channel_rows = await cursor.fetchall()
+
+    await db.executemany(
+        "INSERT OR IGNORE INTO channel_subscriptions_new (channel_id, guild_id) VALUES (?, ?)",
+        [(int(row[0]), int(row[1])) for row in channel_rows]
+    )
+    await db.executemany(
+        "INSERT OR IGNORE INTO channel_subscription_events (channel_id, event) VALUES (?, ?)",
+        [(int(row[0]), event) for row in channel_rows for event in _split_csv(row[2])]
+    )
+    await db.executemany(
+        "INSERT OR IGNORE INTO channel_subscription_roles (channel_id, role_id) VALUES (?, ?)",
+        [(int(row[0]), int(role_id)) for row in channel_rows for role_id in _split_csv(row[3])]
+    )
+
+    await db.execute('''
+        CREATE TABLE user_subscriptions_new (
+            user_id INTEGER PRIMARY KEY
+        );
+    ''')
+    await db.execute('''
+        CREATE TABLE user_subscription_events (
+            user_id INTEGER NOT NULL REFERENCES user_subscriptions(user_id) ON DELETE CASCADE,
+            event TEXT NOT NULL,
+            PRIMARY KEY (user_id, event)
+        ) WITHOUT ROWID;
+    ''')
+
+    async with db.execute("SELECT user_id, events FROM user_subscriptions") as cursor:
+        user_rows = await cursor.fetchall()
+
+    await db.executemany(
+        "INSERT OR IGNORE INTO user_subscriptions_new (user_id) VALUES (?)",
+        [(int(row[0]),) for row in user_rows]
+    )
+    await db.executemany(
+        "INSERT OR IGNORE INTO user_subscription_events (user_id, event) VALUES (?, ?)",
+        [(int(row[0]), event) for row in user_rows for event in _split_csv(row[1])]
+    )
+
+    await db.execute('''
+        CREATE TABLE wishlists_new (
+            user_id INTEGER NOT NULL,
+            shortname TEXT NOT NULL,
+            created_at TEXT,
+            lock_rotation_active INTEGER DEFAULT 0,
+            lock_shop_active INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, shortname)
+        );
+    ''')
+    await db.execute('''
+        INSERT OR IGNORE INTO wishlists_new (user_id, shortname, created_at, lock_rotation_active, lock_shop_active)
+        SELECT CAST(user_id AS INTEGER), shortname, created_at, lock_rotation_active, lock_shop_active FROM wishlists
+    ''')
+
+    await db.execute('''
+        CREATE TABLE profiles_new (
+            user_id INTEGER PRIMARY KEY
+        );
+    ''')
+    await db.execute("INSERT OR IGNORE INTO profiles_new (user_id) SELECT CAST(user_id AS INTEGER) FROM profiles")
+
+    await db.execute('''
+        CREATE TABLE agreements_new (
+            user_id INTEGER PRIMARY KEY,
+            privacy_policy_accepted INTEGER DEFAULT 0,
+            privacy_policy_version TEXT,
+            terms_of_service_accepted INTEGER DEFAULT 0,
+            terms_of_service_version TEXT
+        );
+    ''')
+    await db.execute('''
+        INSERT OR IGNORE INTO agreements_new (user_id, privacy_policy_accepted, privacy_policy_version, terms_of_service_accepted, terms_of_service_version)
+        SELECT CAST(user_id AS INTEGER), privacy_policy_accepted, privacy_policy_version, terms_of_service_accepted, terms_of_service_version FROM agreements
+    ''')
+
+    # vote direction:
+    # 0 is negative
+    # 1 is positive
+    # timestamp in UTC is iso8601 format
+
+    # vote_made_within_new_until_window is unused
+    await db.execute('''
+        CREATE TABLE votes_new (
+            user_id INTEGER NOT NULL,
+            shortname TEXT NOT NULL,
+            timestamp TEXT,
+            vote_direction INTEGER,
+            vote_channel_id INTEGER,
+            vote_server_id INTEGER,
+            vote_source_window TEXT,
+            vote_made_within_new_until_window INTEGER,
+            PRIMARY KEY (user_id, shortname)
+        );
+    ''')
+    await db.execute('''
+        INSERT OR IGNORE INTO votes_new (user_id, shortname, timestamp, vote_direction, vote_channel_id, vote_server_id, vote_source_window, vote_made_within_new_until_window)
+        SELECT CAST(user_id AS INTEGER), shortname, timestamp, vote_direction, CAST(vote_channel_id AS INTEGER), CAST(vote_server_id AS INTEGER), vote_source_window, vote_made_within_new_until_window FROM votes
+    ''')
+
+    for table in ['channel_subscriptions', 'user_subscriptions', 'wishlists', 'profiles', 'agreements', 'votes']:
+        await db.execute(f"DROP TABLE {table}")
+        await db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+async def _migration_secondary_indexes(db: aiosqlite.Connection) -> None:
+    # guild cleanup, per-shortname vote counts and wishlist fan-in
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_channel_subscriptions_guild_id ON channel_subscriptions (guild_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_votes_shortname ON votes (shortname, vote_direction)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_wishlists_shortname ON wishlists (shortname)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_channel_subscription_events_event ON channel_subscription_events (event)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_user_subscription_events_event ON user_subscription_events (event)")
+
+# append only, never edit a migration that has already shipped
+MIGRATIONS: list[Migration] = [
+    Migration(1, 'baseline', _migration_baseline),
+    Migration(2, 'integer_keys_and_normalised_subscriptions', _migration_integer_keys),
+    Migration(3, 'secondary_indexes', _migration_secondary_indexes),
+]
+
 class Config:
     def __init__(self) -> None:
         self.channels: list[SubscriptionChannel] = []
         self.users: list[SubscriptionUser] = []
         self.db: aiosqlite.Connection
         # jolly good golly im NOT getting errors now, you silly wonkie toots!
-        self.lock = asyncio.Lock()
+        self.lock = TimedLock(DB_LOCK_WAIT)
 
         # last usage for each uid of the update button to prevent spam
         # only once every 10 seconds
@@ -120,119 +338,128 @@ class Config:
         self.db = await aiosqlite.connect('festivaltracker.db')
         async with self.lock:
             await self.db.execute("PRAGMA journal_mode=WAL;")
-            await self.db.execute('''
-                CREATE TABLE IF NOT EXISTS channel_subscriptions (
-                    channel_id TEXT PRIMARY KEY,
-                    guild_id TEXT,
-                    events TEXT,
-                    roles TEXT
-                );
-            ''')
-            await self.db.execute('''
-                CREATE TABLE IF NOT EXISTS user_subscriptions (
-                    user_id TEXT PRIMARY KEY,
-                    events TEXT 
-                );
-            ''')
-            await self.db.execute('''
-                CREATE TABLE IF NOT EXISTS wishlists (
-                    user_id TEXT,
-                    shortname TEXT,
-                    created_at TEXT,
-                    lock_rotation_active INTEGER DEFAULT 0,
-                    lock_shop_active INTEGER DEFAULT 0,
-                    PRIMARY KEY (user_id, shortname)
-                );
-            ''')
-
-            await self.db.execute('''
-                CREATE TABLE IF NOT EXISTS profiles (
-                    user_id TEXT PRIMARY KEY
-                );
-            ''')
-
-            # agreements
-            await self.db.execute('''
-                CREATE TABLE IF NOT EXISTS agreements (
-                    user_id TEXT PRIMARY KEY,
-                    privacy_policy_accepted INTEGER DEFAULT 0,
-                    privacy_policy_version TEXT,
-                    terms_of_service_accepted INTEGER DEFAULT 0,
-                    terms_of_service_version TEXT
-                );
-            ''')
-            await self.db.commit()
+            await self.migrate()
+            await self.db.execute("PRAGMA foreign_keys=ON;")
+
+    async def schema_version(self) -> int:
+        async with self.db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations") as cursor:
+            row = await cursor.fetchone()
+            return row[0]
+
+    async def migrate(self) -> None:
+        # foreign keys cannot be toggled inside a transaction, and the table rebuilds need them off
+        await self.db.execute("PRAGMA foreign_keys=OFF;")
+        await self.db.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL,
+                duration_ms REAL NOT NULL
+            );
+        ''')
+        await self.db.commit()
+
+        current_version = await self.schema_version()
+        logging.info(f'Database schema is at version {current_version}')
+
+        for migration in MIGRATIONS:
+            if migration.version <= current_version:
+                continue
+
+            logging.info(f'Applying migration {migration.version} ({migration.name})...')
+            start = time.perf_counter()
+
+            await self.db.execute("BEGIN")
+            try:
+                await migration.apply(self.db)
+                duration_ms = (time.perf_counter() - start) * 1000
+                await self.db.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at, duration_ms) VALUES (?, ?, ?, ?)",
+                    (migration.version, migration.name, datetime.utcnow().isoformat(), duration_ms)
+                )
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                logging.critical(f'Migration {migration.version} ({migration.name}) failed, rolled back')
+                raise
 
-            # voting
-            # vote direction:
-            # 0 is negative
-            # 1 is positive
-            # timestamp in UTC is iso8601 format
-
-            # vote_made_within_new_until_window is unused
-            await self.db.execute('''
-                CREATE TABLE IF NOT EXISTS votes (
-                    user_id TEXT,
-                    shortname TEXT,
-                    timestamp TEXT,
-                    vote_direction INTEGER,
-                    vote_channel_id TEXT,
-                    vote_server_id TEXT,
-                    vote_source_window TEXT,
-                    vote_made_within_new_until_window INTEGER,
-                    PRIMARY KEY (user_id, shortname)
-                );
-            ''')
-            await self.db.commit()
+            logging.info(f'Migration {migration.version} ({migration.name}) applied in {duration_ms:.2f}ms')
 
     async def close_connection(self) -> None:
         if self.db:
             await self.db.close()
 
+    async def _fetch_channels(self, where: str = '', params: tuple = ()) -> list[SubscriptionChannel]:
+        # must be called while holding self.lock
+        async with self.db.execute(f'''
+            SELECT
+                c.channel_id,
+                (SELECT GROUP_CONCAT(e.event) FROM channel_subscription_events e WHERE e.channel_id = c.channel_id),
+                (SELECT GROUP_CONCAT(r.role_id) FROM channel_subscription_roles r WHERE r.channel_id = c.channel_id)
+            FROM channel_subscriptions c {where}
+        ''', params) as cursor:
+            rows = await cursor.fetchall()
+            return [
+                SubscriptionChannel(row[0], _split_csv(row[1]), [int(role_id) for role_id in _split_csv(row[2])])
+                for row in rows
+            ]
+
+    async def _fetch_users(self, where: str = '', params: tuple = ()) -> list[SubscriptionUser]:
+        # must be called while holding self.lock
+        async with self.db.execute(f'''
+            SELECT
+                u.user_id,
+                (SELECT GROUP_CONCAT(e.event) FROM user_subscription_events e WHERE e.user_id = u.user_id)
+            FROM user_subscriptions u {where}
+        ''', params) as cursor:
+            rows = await cursor.fetchall()
+            return [SubscriptionUser(row[0], _split_csv(row[1])) for row in rows]
+
     async def _channel_remove(self, channel: discord.TextChannel) -> None:
         async with self.lock:
             await self.db.execute(
                 "DELETE FROM channel_subscriptions WHERE guild_id = ? AND channel_id = ?",
-                (str(channel.guild.id), str(channel.id))
+                (channel.guild.id, channel.id)
             )
             await self.db.commit()
 
     async def _channel(self, channel: discord.TextChannel) -> SubscriptionChannel | None:
         async with self.lock:
-            async with self.db.execute(
-                "SELECT channel_id, events, roles FROM channel_subscriptions WHERE guild_id = ? AND channel_id = ?",
-                (str(channel.guild.id), str(channel.id))
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    channel_id, events_str, roles_str = row
-                    events = events_str.split(',') 
-                    roles = [int(role_id) for role_id in roles_str.split(',') if len(role_id) > 0] if roles_str else []
-                    return SubscriptionChannel(int(channel_id), events, roles)
-                return None
-            
+            channels = await self._fetch_channels("WHERE c.guild_id = ? AND c.channel_id = ?", (channel.guild.id, channel.id))
+            return channels[0] if channels else None
+
     async def _channel_add(self, channel: discord.TextChannel, default_events = ['announcements'], role_ids = []) -> None:
         async with self.lock:
-            await self.db.execute(
-                "INSERT OR IGNORE INTO channel_subscriptions (guild_id, channel_id, events, roles) VALUES (?, ?, ?, ?)",
-                (str(channel.guild.id), str(channel.id), ",".join(default_events), ",".join(role_ids))
+            cursor = await self.db.execute(
+                "INSERT OR IGNORE INTO channel_subscriptions (guild_id, channel_id) VALUES (?, ?)",
+                (channel.guild.id, channel.id)
             )
+            if cursor.rowcount > 0:
+                await self.db.executemany(
+                    "INSERT OR IGNORE INTO channel_subscription_events (channel_id, event) VALUES (?, ?)",
+                    [(channel.id, event) for event in default_events]
+                )
+                await self.db.executemany(
+                    "INSERT OR IGNORE INTO channel_subscription_roles (channel_id, role_id) VALUES (?, ?)",
+                    [(channel.id, int(role_id)) for role_id in role_ids]
+                )
             await self.db.commit()
 
     async def _channel_edit_events(self, channel: discord.TextChannel, events: list[str]) -> None:
         async with self.lock:
-            await self.db.execute(
-                "UPDATE channel_subscriptions SET events = ? WHERE guild_id = ? AND channel_id = ?",
-                (",".join(events), str(channel.guild.id), str(channel.id))
+            await self.db.execute("DELETE FROM channel_subscription_events WHERE channel_id = ?", (channel.id,))
+            await self.db.executemany(
+                "INSERT OR IGNORE INTO channel_subscription_events (channel_id, event) VALUES (?, ?)",
+                [(channel.id, event) for event in events]
             )
             await self.db.commit()
 
     async def _channel_edit_roles(self, channel: discord.TextChannel, roles: list[discord.Object]) -> None:
-        role_ids = [str(role.id) for role in roles]
         async with self.lock:
-            await self.db.execute(
-                "UPDATE channel_subscriptions SET roles = ? WHERE guild_id = ? AND channel_id = ?",
-                (",".join(role_ids), str(channel.guild.id), str(channel.id))
+            await self.db.execute("DELETE FROM channel_subscription_roles WHERE channel_id = ?", (channel.id,))
+            await self.db.executemany(
+                "INSERT OR IGNORE INTO channel_subscription_roles (channel_id, role_id) VALUES (?, ?)",
+                [(channel.id, role.id) for role in roles]
             )
             await self.db.commit()
 
@@ -245,19 +472,11 @@ class Config:
     async def subscription_guild(self, operation: Literal['get_channels', 'remove'], guild: discord.Guild) -> list[SubscriptionChannel] | None:
         async with self.lock:
             if operation == 'get_channels':
-                async with self.db.execute("SELECT channel_id, events, roles FROM channel_subscriptions WHERE guild_id = ?", (str(guild.id),)) as cursor:
-                    rows = await cursor.fetchall()
-                    channels = []
-                    for row in rows:
-                        channel_id, events_str, roles_str = row
-                        events = events_str.split(',') 
-                        roles = [int(role_id) for role_id in roles_str.split(',') if len(role_id) > 0] if roles_str else []
-                        channels.append(SubscriptionChannel(int(channel_id), events, roles)) 
-                    return channels 
+                return await self._fetch_channels("WHERE c.guild_id = ?", (guild.id,))
             elif operation == 'remove':
                 await self.db.execute(
                     "DELETE FROM channel_subscriptions WHERE guild_id = ?",
-                    (str(guild.id),)
+                    (guild.id,)
                 )
                 await self.db.commit()
             return None
@@ -271,40 +490,23 @@ class Config:
     async def subscription_user(self, operation: Literal['get', 'edit'], user: discord.User | discord.Object, **kwargs) -> SubscriptionUser | None:
         async with self.lock:
             if operation == 'get':
-                async with self.db.execute(
-                    "SELECT user_id, events FROM user_subscriptions WHERE user_id = ?",
-                    (str(user.id),)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        user_id, events_str = row
-                        events = events_str.split(',')
-                        return SubscriptionUser(int(user_id), events)
-                    return None
+                users = await self._fetch_users("WHERE u.user_id = ?", (user.id,))
+                return users[0] if users else None
             elif operation == 'edit':
                 events = kwargs.get('events', [])
-                async with self.db.execute(
-                    "SELECT user_id FROM user_subscriptions WHERE user_id = ?",
-                    (str(user.id),)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        if len(events) > 0:
-                            await self.db.execute(
-                                "UPDATE user_subscriptions SET events = ? WHERE user_id = ?",
-                                (",".join(events), str(user.id))
-                            )
-                        else:
-                            await self.db.execute(
-                                "DELETE FROM user_subscriptions WHERE user_id = ?",
-                                (str(user.id),)
-                            )
-                    else:
-                        await self.db.execute(
-                            "INSERT INTO user_subscriptions (user_id, events) VALUES (?, ?)",
-                            (str(user.id), ",".join(events))
-                        )
-                    await self.db.commit()
+                if len(events) > 0:
+                    await self.db.execute("INSERT OR IGNORE INTO user_subscriptions (user_id) VALUES (?)", (user.id,))
+                    await self.db.execute("DELETE FROM user_subscription_events WHERE user_id = ?", (user.id,))
+                    await self.db.executemany(
+                        "INSERT OR IGNORE INTO user_subscription_events (user_id, event) VALUES (?, ?)",
+                        [(user.id, event) for event in events]
+                    )
+                else:
+                    await self.db.execute(
+                        "DELETE FROM user_subscriptions WHERE user_id = ?",
+                        (user.id,)
+                    )
+                await self.db.commit()
             return None
 
     @overload
@@ -322,27 +524,13 @@ class Config:
     async def subscription_global(self, operation: Literal['get_all_channels', 'get_all_users', 'delete_channels_with_query', 'delete_users_with_query'], **kwargs) -> list[SubscriptionChannel] | list[SubscriptionUser] | None:
         async with self.lock:
             if operation == 'get_all_channels':
-                channels = []
-                async with self.db.execute("SELECT channel_id, events, roles FROM channel_subscriptions") as cursor:
-                    rows = await cursor.fetchall()
-                    for row in rows:
-                        channel_id, events_str, roles_str = row
-                        events = events_str.split(',') 
-                        roles = [int(role_id) for role_id in roles_str.split(',') if len(role_id) > 0] if roles_str else []
-                        channels.append(SubscriptionChannel(int(channel_id), events, roles))
-                    return channels 
+                return await self._fetch_channels()
             elif operation == 'get_all_users':
-                users = []
-                async with self.db.execute("SELECT user_id, events FROM user_subscriptions") as cursor:
-                    rows = await cursor.fetchall()
-                    for row in rows:
-                        user_id, events_str = row
-                        events = events_str.split(',')
-                        users.append(SubscriptionUser(int(user_id), events))
-                    return users
+                return await self._fetch_users()
             elif operation == 'delete_channels_with_query':
                 query = kwargs.get('query')
                 if query is not None:
+                    # events and roles are removed by ON DELETE CASCADE
                     await self.db.execute(f"DELETE FROM channel_subscriptions {query}")
                     await self.db.commit()
             elif operation == 'delete_users_with_query':
@@ -384,7 +572,7 @@ class Config:
                 if user and shortname:
                     await self.db.execute(
                         "INSERT OR REPLACE INTO wishlists (user_id, shortname, created_at, lock_rotation_active, lock_shop_active) VALUES (?, ?, ?, ?, ?)",
-                        (str(user.id), shortname, datetime.now().isoformat(), 0, 0)
+                        (user.id, shortname, datetime.now().isoformat(), 0, 0)
                     )
                     await self.db.commit()
             elif operation == 'remove':
@@ -393,7 +581,7 @@ class Config:
                 if user and shortname:
                     await self.db.execute(
                         "DELETE FROM wishlists WHERE user_id = ? AND shortname = ?",
-                        (str(user.id), shortname)
+                        (user.id, shortname)
                     )
                     await self.db.commit()
             elif operation == 'check':
@@ -402,7 +590,7 @@ class Config:
                 if user and shortname:
                     async with self.db.execute(
                         "SELECT 1 FROM wishlists WHERE user_id = ? AND shortname = ?",
-                        (str(user.id), shortname)
+                        (user.id, shortname)
                     ) as cursor:
                         row = await cursor.fetchone()
                         return row is not None
@@ -412,7 +600,7 @@ class Config:
                 if user:
                     async with self.db.execute(
                         "SELECT shortname, created_at, lock_rotation_active, lock_shop_active FROM wishlists WHERE user_id = ?",
-                        (str(user.id),)
+                        (user.id,)
                     ) as cursor:
                         rows = await cursor.fetchall()
                         return [
@@ -427,11 +615,13 @@ class Config:
                         ] if rows else []
                 return []
             elif operation == 'get_all':
-                async with self.db.execute("SELECT user_id, shortname, created_at, lock_rotation_active, lock_shop_active FROM wishlists") as cursor:
+                async with self.db.execute(
+                    "SELECT user_id, shortname, created_at, lock_rotation_active, lock_shop_active FROM wishlists"
+                ) as cursor:
                     rows = await cursor.fetchall()
                     return [
                         WishlistEntry(
-                            user=discord.Object(id=int(row[0])),
+                            user=discord.Object(id=row[0]),
                             shortname=row[1],
                             created_at=datetime.fromisoformat(row[2]),
                             lock_rotation_active=bool(row[3]),
@@ -447,7 +637,7 @@ class Config:
                     column = f"lock_{lock_type}_active"
                     await self.db.execute(
                         f"UPDATE wishlists SET {column} = ? WHERE user_id = ? AND shortname = ?",
-                        (lock_status, str(entry.user.id), entry.shortname)
+                        (lock_status, entry.user.id, entry.shortname)
                     )
                     await self.db.commit()
             return None
@@ -460,7 +650,7 @@ class Config:
             if operation == 'create':
                 await self.db.execute(
                     "INSERT OR IGNORE INTO profiles (user_id) VALUES (?)",
-                    (str(user_id),)
+                    (int(user_id),)
                 )
                 await self.db.commit()
 
@@ -472,7 +662,7 @@ class Config:
 
     async def agreement(self, operation: Literal['get', 'update'], user: discord.User | discord.Object | str, **kwargs) -> dict | None:
         async with self.lock:
-            user_id = user if isinstance(user, str) else str(user.id)
+            user_id = int(user) if isinstance(user, str) else user.id
             if operation == 'get':
                 async with self.db.execute(
                     "SELECT privacy_policy_accepted, privacy_policy_version, terms_of_service_accepted, terms_of_service_version FROM agreements WHERE user_id = ?",
@@ -494,7 +684,7 @@ class Config:
 
                 if agreement_type and agreement_version and agreement_accepted is not None:
                     await self.db.execute("INSERT OR IGNORE INTO agreements (user_id) VALUES (?)", (user_id,))
-                    
+
                     if agreement_type == 'privacy_policy':
                         await self.db.execute(
                             "UPDATE agreements SET privacy_policy_accepted = ?, privacy_policy_version = ? WHERE user_id = ?",
@@ -510,20 +700,20 @@ class Config:
 
     @overload
     async def vote(self, operation: Literal['add'], user: discord.User | discord.Object | str, shortname: str, vote_direction: int, vote_channel_id: int, vote_server_id: int, vote_source_window: str, vote_made_within_new_until_window: bool) -> None: ...
-    
+
     @overload
     async def vote(self, operation: Literal['update'], user: discord.User | discord.Object | str, shortname: str, vote_direction: int, vote_channel_id: int, vote_server_id: int, vote_source_window: str, vote_made_within_new_until_window: bool) -> None: ...
 
     @overload
     async def vote(self, operation: Literal['remove'], user: discord.User | discord.Object | str, shortname: str) -> dict | None: ...
-    
+
     # gets the user's vote direction for a song
     @overload
     async def vote(self, operation: Literal['get'], user: discord.User | discord.Object | str, shortname: str) -> int: ...
-    
+
     async def vote(self, operation: Literal['add', 'update', 'remove', 'get'], user: discord.User | discord.Object | str, shortname: str = None, **kwargs) -> int | dict | None:
         async with self.lock:
-            user_id = user if isinstance(user, str) else str(user.id)
+            user_id = int(user) if isinstance(user, str) else user.id
 
             # check if user has accepted policies directly to avoid self.lock deadlock
             async with self.db.execute(
@@ -531,7 +721,7 @@ class Config:
                 (user_id,)
             ) as cursor:
                 row = await cursor.fetchone()
-            
+
             # if user has not accepted both policies, do not add vote.
             if not row or not (row[0] and row[1]):
                 raise PolicyException(f"Please accept the privacy policy and terms of service to vote for songs. You can do this with /agreements.")
@@ -545,18 +735,18 @@ class Config:
                 vote_server_id = kwargs.get('vote_server_id')
                 vote_source_window = kwargs.get('vote_source_window')
                 vote_made_within_new_until_window = kwargs.get('vote_made_within_new_until_window')
-                
+
                 if shortname and vote_direction is not None:
                     # INSERT OR REPLACE automatically updates the row if user_id + shortname already exists
                     await self.db.execute("""
                         INSERT OR REPLACE INTO votes (
-                            user_id, 
-                            shortname, 
+                            user_id,
+                            shortname,
                             timestamp,
-                            vote_direction, 
-                            vote_channel_id, 
-                            vote_server_id, 
-                            vote_source_window, 
+                            vote_direction,
+                            vote_channel_id,
+                            vote_server_id,
+                            vote_source_window,
                             vote_made_within_new_until_window
                         ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                     """, (
@@ -564,8 +754,8 @@ class Config:
                         shortname,
                         datetime.utcnow().isoformat(),
                         vote_direction,
-                        str(vote_channel_id) if vote_channel_id is not None else None,
-                        str(vote_server_id) if vote_server_id is not None else None,
+                        int(vote_channel_id) if vote_channel_id is not None else None,
+                        int(vote_server_id) if vote_server_id is not None else None,
                         vote_source_window,
                         1 if vote_made_within_new_until_window else 0
                     ))
@@ -577,7 +767,7 @@ class Config:
                         (user_id, shortname)
                     ) as cursor:
                         row = await cursor.fetchone()
-                    
+
                     if row:
                         old_vote = {
                             "vote_direction": row[0],
@@ -603,13 +793,13 @@ class Config:
                     ) as cursor:
                         row = await cursor.fetchone()
                         return row[0] if row is not None else None
-                
+
             return None
 
     async def get_vote_counts(self, shortname: str) -> dict[str, int]:
         async with self.lock:
             async with self.db.execute('''
-                SELECT 
+                SELECT
                     SUM(CASE WHEN vote_direction = 1 THEN 1 ELSE 0 END),
                     SUM(CASE WHEN vote_direction = 0 THEN 1 ELSE 0 END)
                 FROM votes WHERE shortname = ?
@@ -622,4 +812,4 @@ class Config:
                     }
                 return {"upvotes": 0, "downvotes": 0}
 
-    
\ No newline at end of file
+
@@ -3,6 +3,7 @@ import mido
 import asyncio
 import json
 import os
+import shutil
 import time
 import cloudscraper
 import discord.ext.tasks as tasks
@@ -22,6 +23,12 @@ from bot.tools.midi import MidiArchiveTools
 from bot.tools.oauthmanager import OAuthManager
 from bot.tracks import JamTrackHandler
 from bot.tools.bestsellersrenderer import BestsellersRenderer
+from bot.tools.browserpool import BROWSER_POOL
+from bot.tools.leaderboardexport import LeaderboardExporter
+from bot.tools.leaderboards import LeaderboardBoard
+from bot.tools.renderpool import RENDER_POOL
+from bot.tools.tempsweeper import TempSweeper
+from bot.tools.cachequota import CACHE_QUOTAS
 
 class TestCog(commands.Cog):
     def __init__(self, bot: constants.BotExt):
@@ -314,7 +321,7 @@ class TestCog(commands.Cog):
 
         oauth: OAuthManager = self.bot.oauth_manager
         try:
-            account = oauth.search_users(current)
+            account = await oauth.search_users(current)
             return [
                 app_commands.Choice(name='No results, please type your entire username.', value='NORESULTS')
             ]
@@ -461,10 +468,9 @@ class TestCog(commands.Cog):
 
         await interaction.response.send_message(embed=embed)
 
-        url = "https://cdn2.unrealengine.com/fn_bsdata/ebb74910-dd35-44b8-b826-d58dc16c6456.json"
-        print( f"[GET] {url} ")
-        response = requests.get(url)
-        bestsellers_data = response.json()
+        bestsellers_renderer: BestsellersRenderer = self.bot.bestsellers_renderer
+        await bestsellers_renderer.fetch_bestsellers()
+        bestsellers_data = json.loads(bestsellers_renderer.bestsellers_body)
 
         country_best_sellers = {}
 
@@ -476,19 +482,7 @@ class TestCog(commands.Cog):
 
         total_countries = len(country_best_sellers)
 
-        logging.debug(f'[GET] {constants.FN_CATALOG}')
-        headers = {
-            'Authorization': self.bot.oauth_manager.session_token
-        }
-        response = requests.get(constants.FN_CATALOG, headers=headers)
-        if response.status_code == 401 or response.status_code == 403:
-            self.bot.oauth_manager._create_token()
-            raise Exception('Please try again.')
-        
-        data = response.json()
-
-        storefront = discord.utils.find(lambda storefront: storefront['name'] == 'BRWeeklyStorefront', data['storefronts'])
-        shop_tracks = storefront['catalogEntries']
+        storefront = await self.bot.storefront.get()
         
         jamtrack_bestellers = {}
 
@@ -500,7 +494,7 @@ class TestCog(commands.Cog):
                 country_name = f'Invalid({country_code})'
 
             for offer_id in data:
-                offer_info = discord.utils.find(lambda item: item['offerId'] == offer_id, shop_tracks)
+                offer_info = storefront.offers_by_id.get(offer_id)
                 if not offer_info:
                     continue
 
@@ -550,12 +544,13 @@ class TestCog(commands.Cog):
 
         bestsellers_renderer: BestsellersRenderer = self.bot.bestsellers_renderer
 
+        start = time.perf_counter()
         output_path = await bestsellers_renderer.capture_renderer_screenshot(auto=auto, cols=cols)
         if not output_path:
             await interaction.edit_original_response(content="Rendering the bestsellers image timed out.")
             return
 
-        await interaction.edit_original_response(attachments=[discord.File(output_path, 'bestsellers_renderer.png')])
+        await interaction.edit_original_response(content=f"Rendered in `{time.perf_counter() - start:.2f}s`\n`{BROWSER_POOL}`", attachments=[discord.File(output_path, 'bestsellers_renderer.png')])
 
     @test_group.command(name="pro_vocals_json", description="Get all karaoke songs as a JSON array")
     async def pro_vocals_json(self, interaction: discord.Interaction):
@@ -732,6 +727,142 @@ class TestCog(commands.Cog):
 
         await interaction.edit_original_response(content="Done!")
 
+    @test2_group.command(name="export_leaderboard", description="Export a whole leaderboard as a gzipped CSV file")
+    @app_commands.describe(song = "A search query: an artist, song name, or shortname.")
+    @app_commands.describe(instrument = "The instrument board to export. Ignored if band is given.")
+    @app_commands.describe(band = "The band board to export.")
+    @app_commands.describe(season = "The season number, defaults to the current season.")
+    @app_commands.choices(
+        instrument=[
+            app_commands.Choice(name=kt.value.english, value=kt.value.lb_code) for kt in constants.Instruments.__members__.values() if kt.value.lb_enabled
+        ],
+        band=[
+            app_commands.Choice(name=kt.value.english, value=kt.value.code) for kt in constants.BandTypes.__members__.values()
+        ]
+    )
+    async def export_leaderboard(self, interaction: discord.Interaction, song: str, instrument: app_commands.Choice[str] = None, band: app_commands.Choice[str] = None, season: int = None):
+        if not (interaction.user.id in constants.BOT_OWNERS):
+            await interaction.response.send_message(content="You are not authorized to run this command.", ephemeral=True)
+            return
+
+        if not instrument and not band:
+            await interaction.response.send_message(content="Give an instrument or a band type.", ephemeral=True)
+            return
+
+        if season and season not in constants.SEASONS:
+            await interaction.response.send_message(content=f"Season {season} does not exist, the latest is {constants.SEASON_NUMBER}.", ephemeral=True)
+            return
+
+        tracklist = constants.get_jam_tracks(use_cache=True, max_cache_age=600)
+        matched_tracks = JamTrackHandler().fuzzy_search_tracks(tracklist, song) if tracklist else None
+        if not matched_tracks:
+            await interaction.response.send_message(content=f"The search query \"{song}\" did not yield any results.")
+            return
+
+        await interaction.response.defer()
+
+        song_event_id = matched_tracks[0]['track']['su']
+        season_str = constants.get_season_lb_str(season) if season else constants.get_season_lb_str()
+        if band:
+            board = LeaderboardBoard.band(season_str, song_event_id, band.value)
+        else:
+            board = LeaderboardBoard.solo(season_str, song_event_id, instrument.value)
+
+        path = os.path.join(constants.TEMP_FOLDER, f'{board.event_id}_{board.window_id}.csv.gz')
+        try:
+            result = await LeaderboardExporter(self.bot.leaderboard_service).export(board, path)
+        except Exception as e:
+            logging.warning(f'Could not export {board}', exc_info=e)
+            await interaction.edit_original_response(content=f"Export failed: {e}")
+            return
+
+        content = f"Exported {result.rows} rows from {result.pages} pages in {result.duration:.1f}s"
+        if os.path.getsize(path) < 25 * 1024 * 1024:
+            await interaction.edit_original_response(content=content, attachments=[discord.File(path)])
+            os.remove(path)
+        else:
+            await interaction.edit_original_response(content=f"{content}\nThe file is too big to upload, it is at `{path}`")
+
+    @test2_group.command(name="account_cache", description="Show the account display name cache statistics")
+    async def account_cache(self, interaction: discord.Interaction):
+        cache = self.bot.account_cache
+
+        embed = discord.Embed(title="Account Name Cache", colour=constants.ACCENT_COLOUR)
+        embed.add_field(name="Entries", value=f"`{len(cache)}` / `{cache.max_entries}`")
+        embed.add_field(name="Hit Rate", value=f"`{cache.hit_rate * 100:.1f}%`")
+        embed.add_field(name="Hits / Misses", value=f"`{cache.hits}` / `{cache.misses}`")
+        embed.add_field(name="Upstream Requests", value=f"`{cache.upstream_requests}`")
+
+        await interaction.response.send_message(embed=embed)
+
+    @test2_group.command(name="render_pool", description="Show the render worker pool statistics")
+    async def render_pool(self, interaction: discord.Interaction):
+        pool = RENDER_POOL
+
+        embed = discord.Embed(title="Render Pool", colour=constants.ACCENT_COLOUR)
+        embed.add_field(name="Workers", value=f"`{pool.workers}`")
+        embed.add_field(name="Queue Depth", value=f"`{pool.queue_depth}` (max `{pool.max_queue_depth}`)")
+        embed.add_field(name="Jobs", value=f"`{pool.completed}` done, `{pool.failed}` failed, `{pool.timed_out}` timed out")
+        embed.add_field(name="Average Time", value=f"`{pool.average_seconds:.2f}s`")
+
+        await interaction.response.send_message(embed=embed)
+
+    @test2_group.command(name="disk_usage", description="Show how much disk the temp and cache folders use")
+    async def disk_usage(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+
+        sweeper: TempSweeper = self.bot.temp_sweeper
+        usage = await asyncio.to_thread(sweeper.disk_usage)
+        total, used, free = shutil.disk_usage('.')
+
+        lines = '\n'.join([f"{folder}: {files} files, {size / 1024 / 1024:.1f} MB" for folder, files, size in usage])
+        sessions = len(os.listdir(constants.SESSIONS_FOLDER))
+
+        embed = discord.Embed(title="Disk Usage", colour=constants.ACCENT_COLOUR)
+        embed.add_field(name="Folders", value=f"```{lines}```", inline=False)
+        embed.add_field(name="Open Sessions", value=f"`{sessions}`")
+        embed.add_field(name="Swept", value=f"`{sweeper.removed}` entries, `{sweeper.freed_bytes / 1024 / 1024:.1f} MB`")
+        embed.add_field(name="Disk", value=f"`{used / 1024 ** 3:.1f}` / `{total / 1024 ** 3:.1f} GB` used, `{free / 1024 ** 3:.1f} GB` free")
+
+        await interaction.edit_original_response(embed=embed)
+
+    @test2_group.command(name="cache_quotas", description="Show the size, budget and hit rate of every cache")
+    async def cache_quotas(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+
+        embed = discord.Embed(title="Cache Quotas", colour=constants.ACCENT_COLOUR)
+        for cache in list(CACHE_QUOTAS.caches.values()):
+            # sizes are only known after a scan, take a fresh one
+            await asyncio.to_thread(CACHE_QUOTAS.scan, cache)
+            embed.add_field(name=cache.name, value=
+                f"Size: `{cache.size_bytes / 1024 / 1024:.1f}` / `{cache.max_bytes / 1024 / 1024:.0f} MB` ({cache.entries} entries)\n" +
+                f"Hit Rate: `{cache.hit_rate * 100:.1f}%` (`{cache.hits}` / `{cache.misses}`)\n" +
+                f"Evicted: `{cache.evictions}`", inline=False)
+
+        await interaction.edit_original_response(embed=embed)
+
+    @test2_group.command(name="bestsellers_history", description="Rank history of an offer in a country's best sellers")
+    @app_commands.describe(offer_id = "The offer id, e.g. v2:/...")
+    @app_commands.describe(country = "Two letter country code")
+    async def bestsellers_history(self, interaction: discord.Interaction, offer_id: str, country: str):
+        await interaction.response.defer()
+
+        archive = self.bot.bestsellers_renderer.archive
+        history = await asyncio.to_thread(archive.rank_history, offer_id, country)
+
+        lines = []
+        previous_rank = -1
+        for timestamp, rank in history:
+            # only show when the rank changed
+            if rank == previous_rank:
+                continue
+            previous_rank = rank
+            lines.append(f"<t:{timestamp}:f> {f'#{rank}' if rank else 'Not listed'}")
+
+        embed = discord.Embed(title=f"Best Sellers History ({country.upper()})", description="\n".join(lines[-40:]) or "No archived changes.", colour=constants.ACCENT_COLOUR)
+        embed.set_footer(text=f"{len(history)} archived changes · {archive}")
+        await interaction.edit_original_response(embed=embed)
+
     @test2_group.command(name="packages_versions", description="Lists the versions of the packages used in the bot.")
     async def packages_versions(self, interaction: discord.Interaction):
         await interaction.response.defer()
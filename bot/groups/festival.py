@@ -8,6 +8,7 @@ import requests
 
 from bot import constants
 from bot.tools.oauthmanager import OAuthManager
+from bot.tools.metrics import HTTP_TRACE
 
 class FortniteCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -18,7 +19,7 @@ class FortniteCog(commands.Cog):
 
     @fortnite_group.command(name="status", description="See if Fortnite is currently online or offline.")
     async def fortnitestatus_command(self, interaction: discord.Interaction):
-        session = aiohttp.ClientSession()
+        session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
 
         lightswitch_url = 'https://lightswitch-public-service-prod06.ol.epicgames.com/lightswitch/api/service/bulk/status?serviceId=Fortnite'
         logging.debug(f'[GET] {lightswitch_url}')
@@ -26,7 +27,7 @@ class FortniteCog(commands.Cog):
         await interaction.response.defer()
 
         response = await session.get(lightswitch_url, headers={
-            'Authorization': self.oauth.session_token    
+            'Authorization': await self.oauth.get_token()
         })
         data = await response.json()
         # print(data)
@@ -61,8 +62,9 @@ class FortniteCog(commands.Cog):
 
         await interaction.response.defer()
 
+        token = await self.oauth.get_token()
         response = requests.get(discovery_profile, headers={
-            'Authorization': self.oauth.session_token
+            'Authorization': token
         })
 
         # epiclabs = f'https://fn-service-discovery-live-public.ogs.live.on.epicgames.com/api/v1/creator/page/63ba52bf92554227820f4dd0a8cc6845?playerId={self.oauth.account_id}&limit=100'
@@ -100,7 +102,7 @@ class FortniteCog(commands.Cog):
         data = response.json()
 
         links_req = requests.post(links_info, json=payload, headers={
-            'Authorization': self.oauth.session_token
+            'Authorization': token
         })
         links_req.raise_for_status()
         # print(links_req.text)
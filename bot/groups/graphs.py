@@ -5,6 +5,7 @@ from discord.ext import commands
 
 from bot import constants, database
 from bot.tools.graph import GraphingFuncs
+from bot.tools.renderpool import RENDER_POOL
 from bot.tools.midi import MidiArchiveTools
 from bot.tracks import JamTrackHandler
 from bot import constants as const
@@ -94,10 +95,11 @@ class GraphCommandsHandler():
         midi_file = await self.midi_tool.save_chart(song_url)
         
         image_path = f'{short_name}_pdi_graph_{session_hash}.png'
-        GraphingFuncs().generate_no_notes_pdi_chart(midi_path=midi_file, path=image_path, song_name=track_title, song_artist=artist_title)
+        output_path = os.path.join(constants.session_folder(session_hash), image_path)
+        await RENDER_POOL.submit(GraphingFuncs().generate_no_notes_pdi_chart, midi_path=midi_file, path=output_path, song_name=track_title, song_artist=artist_title)
         
         embed = discord.Embed(title=f"Note counts for\n**{track_title}** - *{artist_title}*", colour=constants.ACCENT_COLOUR)
-        file = discord.File(os.path.join(constants.TEMP_FOLDER, image_path), filename=image_path)
+        file = discord.File(output_path, filename=image_path)
         embed.set_image(url=f"attachment://{image_path}")
         embed.set_thumbnail(url=album_art_url)
         embed.set_footer(text="Festival Tracker")
@@ -132,10 +134,11 @@ class GraphCommandsHandler():
         midi_file = await self.midi_tool.save_chart(song_url)
         
         image_path = f'{short_name}_lift_graph_{session_hash}.png'
-        GraphingFuncs().generate_no_notes_pdi_chart(midi_path=midi_file, path=image_path, song_name=track_title, song_artist=artist_title, lifts=True)
+        output_path = os.path.join(constants.session_folder(session_hash), image_path)
+        await RENDER_POOL.submit(GraphingFuncs().generate_no_notes_pdi_chart, midi_path=midi_file, path=output_path, song_name=track_title, song_artist=artist_title, lifts=True)
         
         embed = discord.Embed(title=f"Lift counts for\n**{track_title}** - *{artist_title}*", colour=constants.ACCENT_COLOUR)
-        file = discord.File(os.path.join(constants.TEMP_FOLDER, image_path), filename=image_path)
+        file = discord.File(output_path, filename=image_path)
         embed.set_image(url=f"attachment://{image_path}")
         embed.set_thumbnail(url=album_art_url)
         embed.set_footer(text="Festival Tracker")
@@ -173,10 +176,11 @@ class GraphCommandsHandler():
         midi_file = await self.midi_tool.save_chart(song_url)
         
         image_path = f'{short_name}_nps_graph_{session_hash}.png'
-        GraphingFuncs().generate_nps_chart(midi_path=midi_file, path=image_path, inst=chosen_instrument, diff=chosen_diff, song_name=track_title, song_artist=artist_title)
+        output_path = os.path.join(constants.session_folder(session_hash), image_path)
+        await RENDER_POOL.submit(GraphingFuncs().generate_nps_chart, midi_path=midi_file, path=output_path, inst=chosen_instrument, diff=chosen_diff, song_name=track_title, song_artist=artist_title)
         
         embed = discord.Embed(title=f"NPS Graph for\n**{track_title}** - *{artist_title}*", colour=constants.ACCENT_COLOUR)
-        file = discord.File(os.path.join(constants.TEMP_FOLDER, image_path), filename=image_path)
+        file = discord.File(output_path, filename=image_path)
         embed.set_image(url=f"attachment://{image_path}")
         embed.set_thumbnail(url=album_art_url)
         embed.set_footer(text="Festival Tracker")
@@ -215,10 +219,11 @@ class GraphCommandsHandler():
         midi_file = await self.midi_tool.save_chart(song_url)
         
         image_path = f'{short_name}_lanes_graph_{session_hash}.png'
-        GraphingFuncs().generate_lanes_chart(midi_path=midi_file, spath=image_path, inst=chosen_instrument, diff=chosen_diff, song_name=track_title, song_artist=artist_title)
+        output_path = os.path.join(constants.session_folder(session_hash), image_path)
+        await RENDER_POOL.submit(GraphingFuncs().generate_lanes_chart, midi_path=midi_file, spath=output_path, inst=chosen_instrument, diff=chosen_diff, song_name=track_title, song_artist=artist_title)
         
         embed = discord.Embed(title=f"Notes per lane graph for\n**{track_title}** - *{artist_title}*", colour=constants.ACCENT_COLOUR)
-        file = discord.File(os.path.join(constants.TEMP_FOLDER, image_path), filename=image_path)
+        file = discord.File(output_path, filename=image_path)
         embed.set_image(url=f"attachment://{image_path}")
         embed.set_thumbnail(url=album_art_url)
         embed.set_footer(text="Festival Tracker")
@@ -58,18 +58,19 @@ class RandomCog(commands.Cog):
             await interaction.response.send_message(embed=constants.common_error_embed('Could not get tracks.'), ephemeral=True)
             return
         
-        shop_tracks = self.shop_handler.fetch_shop_tracks()
-        weekly_tracks = self.daily_handler.fetch_daily_shortnames()
+        storefront = await self.bot.storefront.get()
+        shop_tracks = storefront.jam_track_offers
+        calendar = await self.bot.calendar.get()
+        weekly_tracks = await self.daily_handler.fetch_daily_shortnames()
 
         if shop:
             def inshop(obj):
-                return discord.utils.find(lambda offer: offer['meta']['templateId'] == obj['track']['ti'], shop_tracks)
+                return obj['track']['ti'] in storefront.offers_by_template
             track_list = list(filter(inshop, track_list))
 
         if daily:
             def indaily(obj):
-                sn = obj['track']['sn']
-                return discord.utils.find(lambda t: t['metadata']['track']['sn'] == sn, weekly_tracks) != None
+                return calendar.in_rotation(obj['track']['sn'])
 
             track_list = list(filter(indaily, track_list))
 
@@ -92,18 +93,17 @@ class RandomCog(commands.Cog):
             await interaction.response.send_message(cembed=constants.common_error_embed('Could not get tracks.'), ephemeral=True)
             return
         
-        shop_tracks = self.shop_handler.fetch_shop_tracks()
-        daily_tracks = self.daily_handler.fetch_daily_shortnames()
+        storefront = await self.bot.storefront.get()
+        calendar = await self.bot.calendar.get()
 
         if shop:
             def inshop(obj):
-                return discord.utils.find(lambda offer: offer['meta']['templateId'] == obj['track']['ti'], shop_tracks)
+                return obj['track']['ti'] in storefront.offers_by_template
             track_list = list(filter(inshop, track_list))
 
         if daily:
             def indaily(obj):
-                sn = obj['track']['sn']
-                return discord.utils.find(lambda t: t['metadata']['track']['sn'] == sn, daily_tracks) != None
+                return calendar.in_rotation(obj['track']['sn'])
 
             track_list = list(filter(indaily, track_list))
 
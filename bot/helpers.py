@@ -1,4 +1,3 @@
-from datetime import datetime, timezone
 import difflib
 import logging
 import math
@@ -7,7 +6,6 @@ import random
 import re
 
 import discord
-import requests
 from bot import constants
 from bot.constants import OneButtonSimpleView
 from discord.ext import commands
@@ -229,52 +227,24 @@ class DailyCommandHandler:
 
         return embeds
 
-    def fetch_daily_shortnames(self):
+    async def fetch_daily_shortnames(self):
         try:
-            logging.debug(f'[GET] {constants.FN_CALENDAR}')
-            headers = {
-                'Authorization': self.bot.oauth_manager.session_token
-            }
-            response = requests.get(constants.FN_CALENDAR, headers=headers)
-            data = response.json()
-
-            track_list = constants.get_jam_tracks(use_cache=True)
-            # open('response.json', 'w').write(response.text)
-
-            channels = data.get('channels', {})
-            client_events_data = channels.get('client-events', {})
-            states = client_events_data.get('states', [])
-
-            current_time = datetime.now(timezone.utc)
-            
-            valid_states = [state for state in states if datetime.fromisoformat(state['validFrom'].replace('Z', '+00:00')) <= current_time]
-            valid_states.sort(key=lambda x: datetime.fromisoformat(x['validFrom'].replace('Z', '+00:00')), reverse=True)
-
-            if not valid_states:
+            calendar = await self.bot.calendar.get()
+            if not calendar.has_state:
                 logging.error("No valid states found")
                 return None
 
-            active_events = valid_states[0].get('activeEvents', [])
+            track_list = constants.get_jam_tracks(use_cache=True)
+            tracks_by_shortname = {track['track']['sn']: track for track in track_list}
 
             daily_tracks = []
-            for event in active_events:
-                event_type = event.get('eventType', '')
-                active_since = event.get('activeSince', '')
-                active_until = event.get('activeUntil', '')
-
-                active_since_date = datetime.fromisoformat(active_since.replace('Z', '+00:00')) if active_since else None
-                active_until_date = datetime.fromisoformat(active_until.replace('Z', '+00:00')) if active_until else None
-
-                if (event_type.startswith('PilgrimSong.') or event_type.startswith('Sparks.Spotlight.')) and active_since_date and active_until_date:
-                    if active_since_date <= current_time <= active_until_date:
-                        shortname = event_type.replace('PilgrimSong.', '').replace('Sparks.Spotlight.', '')
-                        related_spotlight = discord.utils.find(lambda event: event['eventType'] == f'Sparks.Spotlight.{shortname}', active_events)
-                        track_data = discord.utils.find(lambda t: t['track']['sn'] == shortname, track_list)
-                        if track_data:
-                            daily_tracks.append({
-                                'metadata': track_data,
-                                'in_spotlight': related_spotlight != None
-                            })
+            for shortname in calendar.rotation:
+                track_data = tracks_by_shortname.get(shortname)
+                if track_data:
+                    daily_tracks.append({
+                        'metadata': track_data,
+                        'in_spotlight': calendar.in_spotlight(shortname)
+                    })
 
             return daily_tracks
         except Exception as e:
@@ -285,7 +255,7 @@ class DailyCommandHandler:
         # tracks = constants.get_jam_tracks() # Fix circular import...
 
         await interaction.response.defer()
-        weekly_songs = self.fetch_daily_shortnames()
+        weekly_songs = await self.fetch_daily_shortnames()
 
         # if not tracks or not weekly_songs:
         #     await interaction.response.send_message(embed=constants.common_error_embed('Could not get tracks.'), ephemeral=True)
@@ -355,7 +325,7 @@ class ShopCommandHandler:
         return embeds
 
     async def handle_interaction(self, interaction:discord.Interaction):
-        shop_tracks = self.fetch_shop_tracks()
+        shop_tracks = await self.fetch_shop_tracks()
         jam_tracks = constants.get_jam_tracks() # Fix circular import...
 
         await interaction.response.defer()
@@ -372,21 +342,10 @@ class ShopCommandHandler:
         view = constants.PaginatorView(embeds, interaction.user.id)
         view.message = await interaction.edit_original_response(embed=view.get_embed(), view=view)
 
-    def fetch_shop_tracks(self) -> list:
-        logging.debug(f'[GET] {constants.FN_CATALOG}')
-        headers = {
-            'Authorization': self.bot.oauth_manager.session_token
-        }
-        response = requests.get(constants.FN_CATALOG, headers=headers)
-        if response.status_code == 401 or response.status_code == 403:
-            self.bot.oauth_manager._create_token()
-            raise Exception('Please try again.')
-
-        data = response.json()
-
-        storefront = discord.utils.find(lambda storefront: storefront['name'] == 'BRWeeklyStorefront', data['storefronts'])
-        shop_tracks = list(filter(lambda item: item['meta']['templateId'].startswith('SparksSong:'), storefront['catalogEntries']))
-        return shop_tracks
+    async def fetch_shop_tracks(self) -> list:
+        storefront = await self.bot.storefront.get()
+        # copied, callers sort it
+        return list(storefront.jam_track_offers)
         
 class TracklistHandler:
     def __init__(self, bot) -> None:
@@ -30,6 +30,7 @@ from bot.tracks import ActionView
 import bot.tools.compare_midi as midi_comparison
 
 import bot.tools.sparks_tracks as sparks_tracks
+from bot.tools.metrics import NOTIFICATIONS
 # import cloudscraper # FUCK YOU CLOUDFLARE (jk i love you)
 
 def save_known_songs(songs):
@@ -178,23 +179,27 @@ class HistoryHandler():
     def comparison_process(self, old_midi_file, new_midi_file, session_hash, track_name):
         return midi_comparison.run_comparison(old_midi_file, new_midi_file, session_hash, track_name)
 
-    async def process_chart_url_change(self, old_url:str, new_url:str, track_name:str, last_modified_old, last_modified_new, session_hash:str, title: str = 'No title', artist: str = 'No artist'):
+    async def process_chart_url_change(self, old_url:str, new_url:str, track_name:str, last_modified_old, last_modified_new, session_hash:str, title: str = 'No title', artist: str = 'No artist', output_folder: str = None):
         """
         # dict: song information
         # list(str): files
         this function now returns only a Tuple[Dict, List(str)]
+        files are written to `output_folder`, the session folder of `session_hash` by default
         """
         old_midi_file = await self.midi_handler.save_chart(old_url)
         new_midi_file = await self.midi_handler.save_chart(new_url)
 
+        if not output_folder:
+            output_folder = constants.session_folder(session_hash)
+
         if old_midi_file and new_midi_file:
-            old_midi_out_path = os.path.join(constants.TEMP_FOLDER, f"{track_name}_old_{session_hash}.mid")
-            new_midi_out_path = os.path.join(constants.TEMP_FOLDER, f"{track_name}_new_{session_hash}.mid")
+            old_midi_out_path = os.path.join(output_folder, f"{track_name}_old_{session_hash}.mid")
+            new_midi_out_path = os.path.join(output_folder, f"{track_name}_new_{session_hash}.mid")
 
             shutil.copy(old_midi_file, old_midi_out_path)
             shutil.copy(new_midi_file, new_midi_out_path)
 
-            comparison = functools.partial(midi_comparison.run_comparison, old_midi_out_path, new_midi_out_path, session_hash, song_name=title, artist_name=artist)
+            comparison = functools.partial(midi_comparison.run_comparison, old_midi_out_path, new_midi_out_path, session_hash, song_name=title, artist_name=artist, output_folder=output_folder)
 
             # comparison_command = ['python', 'compare_midi.py', old_midi_out_path, new_midi_out_path, session_hash, track_name]
             # result = subprocess.run(comparison_command, capture_output=True, text=True)
@@ -207,7 +212,7 @@ class HistoryHandler():
             # Check for the completion flag in the output
             if comparison_result == True:
                 # Now that comparison is complete, check for any image output
-                comparison_images = [f for f in os.listdir(constants.TEMP_FOLDER) if f.endswith(f'{session_hash}.png')]
+                comparison_images = [f for f in os.listdir(output_folder) if f.endswith(f'{session_hash}.png')]
 
                 logging.debug(comparison_images)
 
@@ -218,7 +223,7 @@ class HistoryHandler():
                     list_of_images = []
 
                     for image in comparison_images:
-                        image_path = os.path.abspath(os.path.join(constants.TEMP_FOLDER, image))
+                        image_path = os.path.abspath(os.path.join(output_folder, image))
                         list_of_images.append(image_path)
 
                     return ({
@@ -366,8 +371,10 @@ class HistoryHandler():
 
             real_session_hash = f"{session_hash}_{i}"
 
+            # every step goes in the same folder, so the view can delete them all at once
             this_res = await self.process_chart_url_change(
-                old_midi_file, new_midi_file, shortname, old_midi[0], new_midi[0], real_session_hash, title=actual_title, artist=actual_artist
+                old_midi_file, new_midi_file, shortname, old_midi[0], new_midi[0], real_session_hash, title=actual_title, artist=actual_artist,
+                output_folder=constants.session_folder(session_hash)
             )
             logging.info(this_res)
             results.append(this_res)
@@ -436,6 +443,8 @@ class LoopCheckHandler():
         self.history_handler = HistoryHandler(bot)
         self.midi_tools = MidiArchiveTools()
         self.jam_track_handler = JamTrackHandler()
+        # keeps fire and forget tasks referenced until they finish
+        self._background_tasks: set[asyncio.Task] = set()
 
     async def handle_activity_task(self):
         tracks = constants.get_jam_tracks(use_cache=True, max_cache_age=600)
@@ -635,13 +644,16 @@ class LoopCheckHandler():
 
                     try:
                         message = await channel.send(content=content, embed=embed, view=view)
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Added.value.id, outcome='sent')
 
                     except discord.Forbidden as e:
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Added.value.id, outcome='forbidden')
                         logging.warning(f"Channel {channel.id} cannot be sent messages to, skipped", exc_info=e)
                         break
                         
                     except Exception as e:
                         logging.warning(f"Error sending message to channel {channel.id}", exc_info=e)
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Added.value.id, outcome='failed')
 
             if modified_songs and JamTrackEvents.Modified.value.id in channel_to_send.events:
                 logging.info(f"Modified songs sending to channel {channel.id}")
@@ -682,13 +694,16 @@ class LoopCheckHandler():
 
                     try:
                         message = await channel.send(view=view, files=[discord.File(fpath) for fpath in files[:10]] if files and len(files) > 0 else None)
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Modified.value.id, outcome='sent')
 
                     except discord.Forbidden as e:
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Modified.value.id, outcome='forbidden')
                         logging.warning(f"Channel {channel.id} cannot be sent messages to, skipped", exc_info=e)
                         break
 
                     except Exception as e:
                         logging.warning(f"Error sending message to channel {channel.id}", exc_info=e)
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Modified.value.id, outcome='failed')
 
             if removed_songs and JamTrackEvents.Removed.value.id in channel_to_send.events:
                 logging.info(f"Removed songs sending to channel {channel.id}")
@@ -696,13 +711,16 @@ class LoopCheckHandler():
                     embed = await self.embed_handler.generate_track_embed(removed_song, is_removed=True)
                     try:
                         message = await channel.send(content=content, embed=embed)
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Removed.value.id, outcome='sent')
 
                     except discord.Forbidden as e:
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Removed.value.id, outcome='forbidden')
                         logging.warning(f"Channel {channel.id} cannot be sent messages to, skipped", exc_info=e)
                         break
 
                     except Exception as e:
                         logging.warning(f"Error sending message to channel {channel.id}", exc_info=e)
+                        NOTIFICATIONS.inc(event=JamTrackEvents.Removed.value.id, outcome='failed')
 
         logging.info(f"Done checking for new songs: New: {len(new_songs)} | Modified: {len(modified_songs)} | Removed: {len(removed_songs)}")
 
@@ -712,6 +730,21 @@ class LoopCheckHandler():
         for _hash in session_hashes_all:
             constants.delete_session_files(str(_hash))
 
+        if self.bot.PRECOMPUTE_PATHS:
+            charts_to_warm = new_songs + [new for old, new in modified_songs if old['track'].get('mu') != new['track'].get('mu')]
+            if len(charts_to_warm) > 0:
+                # announcements go out first, nobody has to wait for this
+                task = asyncio.create_task(self.precompute_paths(charts_to_warm))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+
+    async def precompute_paths(self, tracks: list[dict]):
+        for track in tracks:
+            try:
+                await self.bot.path_handler.precompute_paths(track)
+            except Exception as e:
+                logging.warning(f"Could not queue paths for {track['track']['sn']}", exc_info=e)
+
 class HistoryException(Exception):
     def __init__(self, desc, *args: object) -> None:
         self.desc = desc
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import discord.ext.tasks as tasks
+
+import bot.constants as constants
+from bot.tools.oauthmanager import OAuthManager
+from bot.tools.taskregistry import TASK_REGISTRY
+
+ACCOUNT_CACHE_FILE = f'{constants.CACHE_FOLDER}AccountNames.json'
+
+class AccountNameCache:
+    def __init__(self, oauth_manager: OAuthManager, ttl: float = 86400, max_entries: int = 50000, path: str = ACCOUNT_CACHE_FILE) -> None:
+        """Caches Epic account id -> display name.
+
+        Entries live for `ttl` seconds and the least recently used ones are dropped past
+        `max_entries`. Accounts without a display name (or which no longer exist) are
+        cached as None so they are not asked for again on every page.
+
+        Properties:
+            `hits` Ids served from the cache.
+            `misses` Ids which had to be resolved upstream.
+            `upstream_requests` Requests made to the account service.
+        """
+
+        self.oauth_manager = oauth_manager
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+
+        # account id -> (display name, stored at, as a unix timestamp so it survives restarts)
+        self._names: OrderedDict[str, tuple[Optional[str], float]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._dirty = False
+
+        self.hits = 0
+        self.misses = 0
+        self.upstream_requests = 0
+
+        self.load()
+
+        self.save_task: tasks.Loop = self.save_loop
+        TASK_REGISTRY.append(self.save_loop)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except Exception as e:
+            logging.warning(f'Could not load account names from {self.path}', exc_info=e)
+            return
+
+        now = time.time()
+        for account_id, (display_name, stored_at) in stored.items():
+            if now - stored_at <= self.ttl:
+                self._names[account_id] = (display_name, stored_at)
+
+        self._evict()
+        logging.info(f'Loaded {len(self._names)} account names from {self.path}')
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+
+        self._write(dict(self._names))
+        self._dirty = False
+
+    def _write(self, names: dict[str, tuple[Optional[str], float]]) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(names, f)
+        os.replace(tmp_path, self.path)
+
+    @tasks.loop(minutes=10, name="Save Account Names")
+    async def save_loop(self):
+        if not self._dirty:
+            return
+
+        # copied on the event loop, get_names keeps changing the cache while the thread writes
+        names = dict(self._names)
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, names)
+        except Exception as e:
+            self._dirty = True
+            logging.warning('Could not save account names', exc_info=e)
+
+    def cached_name(self, account_id: str) -> tuple[bool, Optional[str]]:
+        cached = self._names.get(account_id)
+        if cached is None:
+            return (False, None)
+
+        display_name, stored_at = cached
+        if time.time() - stored_at > self.ttl:
+            del self._names[account_id]
+            return (False, None)
+
+        self._names.move_to_end(account_id)
+        return (True, display_name)
+
+    async def get_names(self, account_ids: list[str]) -> dict[str, Optional[str]]:
+        """Resolves display names for `account_ids`, going upstream only for the ones not cached."""
+
+        names: dict[str, Optional[str]] = {}
+        waiting: dict[str, asyncio.Future] = {}
+        to_fetch: list[str] = []
+
+        for account_id in dict.fromkeys(account_ids):
+            found, display_name = self.cached_name(account_id)
+            if found:
+                self.hits += 1
+                names[account_id] = display_name
+                continue
+
+            self.misses += 1
+            if account_id in self._pending:
+                # someone else is already resolving it, wait for theirs
+                waiting[account_id] = self._pending[account_id]
+            else:
+                to_fetch.append(account_id)
+
+        if to_fetch:
+            loop = asyncio.get_running_loop()
+            futures = {account_id: loop.create_future() for account_id in to_fetch}
+            self._pending.update(futures)
+            waiting.update(futures)
+
+            try:
+                fetched = await self._fetch(to_fetch)
+                for account_id, future in futures.items():
+                    future.set_result(fetched.get(account_id))
+            except BaseException as e:
+                for future in futures.values():
+                    if isinstance(e, Exception):
+                        future.set_exception(e)
+                        # mark it retrieved, the exception is raised for us anyway
+                        future.exception()
+                    else:
+                        future.cancel()
+                raise
+            finally:
+                for account_id in to_fetch:
+                    self._pending.pop(account_id, None)
+
+        for account_id, future in waiting.items():
+            names[account_id] = await future
+
+        return names
+
+    async def _fetch(self, account_ids: list[str]) -> dict[str, Optional[str]]:
+        self.upstream_requests += (len(account_ids) + 99) // 100
+        accounts = await self.oauth_manager.get_accounts(account_ids)
+
+        now = time.time()
+        fetched: dict[str, Optional[str]] = {account_id: None for account_id in account_ids}
+        for account in accounts:
+            fetched[account.account_id] = account.display_name
+
+        for account_id, display_name in fetched.items():
+            self._names[account_id] = (display_name, now)
+            self._names.move_to_end(account_id)
+
+        self._evict()
+        self._dirty = True
+        return fetched
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _evict(self) -> None:
+        while len(self._names) > self.max_entries:
+            self._names.popitem(last=False)
+
+    def __str__(self) -> str:
+        return f"AccountNameCache(entries={len(self)}, {self.hits=}, {self.misses=}, {self.upstream_requests=})".replace('self.', '')
@@ -0,0 +1,251 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Optional
+
+import bot.constants as constants
+
+BESTSELLERS_ARCHIVE_FOLDER = f'{constants.CACHE_FOLDER}bestsellers_archive/'
+LEGACY_ARCHIVE_FOLDER = f'{constants.CACHE_FOLDER}archive_best_sellers/'
+
+class ArchiveEntry:
+    def __init__(self, timestamp: int, bestsellers_hash: str, shop_hash: Optional[str]) -> None:
+        """One best sellers change, pointing at the blobs it was archived with.
+
+        Properties:
+            `timestamp` When the change was seen, unix seconds.
+            `bestsellers_hash` sha256 of the best sellers response.
+            `shop_hash` sha256 of the storefront at that time, None if it was not archived.
+        """
+
+        self.timestamp = timestamp
+        self.bestsellers_hash = bestsellers_hash
+        self.shop_hash = shop_hash
+
+    def to_dict(self) -> dict:
+        return {'ts': self.timestamp, 'bestsellers': self.bestsellers_hash, 'shop': self.shop_hash}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ArchiveEntry':
+        return cls(data['ts'], data['bestsellers'], data.get('shop'))
+
+    def __str__(self) -> str:
+        return f"ArchiveEntry({self.timestamp=}, {self.bestsellers_hash=}, {self.shop_hash=})".replace('self.', '')
+
+class BestsellersArchive:
+    def __init__(self, folder: str = BESTSELLERS_ARCHIVE_FOLDER) -> None:
+        """Every best sellers change, with the storefront at the time, stored once.
+
+        Documents are gzipped into `blobs/` under their sha256, so a storefront which did
+        not change between two best sellers updates takes no extra space. `index.jsonl`
+        lists the changes in order, one (timestamp, best sellers hash, shop hash) per line.
+        `ranks.db` holds the rank of every offer in every country for each best sellers
+        response, written when it is archived, so history queries never open a blob.
+        """
+
+        self.folder = folder
+        self.blobs_folder = os.path.join(folder, 'blobs')
+        self.index_path = os.path.join(folder, 'index.jsonl')
+        self.ranks_path = os.path.join(folder, 'ranks.db')
+
+        os.makedirs(self.blobs_folder, exist_ok=True)
+
+        self.entries: list[ArchiveEntry] = []
+        self._lock = threading.Lock()
+        # used from worker threads, always under _lock
+        self._ranks_db = sqlite3.connect(self.ranks_path, check_same_thread=False)
+        self._ranks_db.execute('''
+            CREATE TABLE IF NOT EXISTS ranks (
+                offer_id TEXT NOT NULL,
+                country TEXT NOT NULL,
+                bestsellers TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                PRIMARY KEY (offer_id, country, bestsellers)
+            ) WITHOUT ROWID
+        ''')
+        # best sellers responses whose ranks are in the table
+        self._ranks_db.execute("CREATE TABLE IF NOT EXISTS ranked (bestsellers TEXT PRIMARY KEY)")
+        self._ranks_db.commit()
+        # blobs which could not be ranked, so they are only complained about once
+        self._unrankable: set[str] = set()
+
+        self.load()
+
+    def load(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+
+        entries = []
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(ArchiveEntry.from_dict(json.loads(line)))
+                except Exception as e:
+                    # a line cut off by a crash mid write, the rest is still good
+                    logging.warning(f'Skipping a bad line in {self.index_path}', exc_info=e)
+
+        entries.sort(key=lambda entry: entry.timestamp)
+        self.entries = entries
+
+    def blob_path(self, blob_hash: str) -> str:
+        return os.path.join(self.blobs_folder, f'{blob_hash}.json.gz')
+
+    def put_blob(self, data: bytes) -> str:
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(blob_hash)
+        if os.path.exists(path):
+            return blob_hash
+
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return blob_hash
+
+    def get_blob(self, blob_hash: str) -> bytes:
+        with gzip.open(self.blob_path(blob_hash), 'rb') as f:
+            return f.read()
+
+    def add(self, timestamp: int, bestsellers_body: bytes, shop_data: Optional[dict]) -> ArchiveEntry:
+        bestsellers_hash = self.put_blob(bestsellers_body)
+
+        shop_hash = None
+        if shop_data is not None:
+            # keys sorted so the same storefront always hashes the same
+            shop_hash = self.put_blob(json.dumps(shop_data, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+        try:
+            self.index_ranks(bestsellers_hash, bestsellers_body)
+        except Exception as e:
+            # rank_history tries again from the blob
+            logging.warning(f'Could not index the ranks of best sellers {bestsellers_hash}', exc_info=e)
+
+        entry = ArchiveEntry(timestamp, bestsellers_hash, shop_hash)
+        with self._lock:
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry.to_dict()) + '\n')
+            self.entries.append(entry)
+        return entry
+
+    def latest(self) -> Optional[ArchiveEntry]:
+        return self.entries[-1] if self.entries else None
+
+    def between(self, since: int = None, until: int = None) -> list[ArchiveEntry]:
+        return [entry for entry in self.entries if (since is None or entry.timestamp >= since) and (until is None or entry.timestamp <= until)]
+
+    def rankings(self, bestsellers_body: bytes) -> dict[str, list[str]]:
+        """Country code -> offer ids in rank order, for one best sellers response."""
+
+        data = json.loads(bestsellers_body)
+        rankings = {}
+        for key, value in data.items():
+            if key.startswith('bestsellers_list_'):
+                rankings[key.replace('bestsellers_list_', '')] = value['offer_list']
+        return rankings
+
+    def index_ranks(self, bestsellers_hash: str, bestsellers_body: bytes) -> None:
+        rows = []
+        for country, offer_list in self.rankings(bestsellers_body).items():
+            # an offer listed twice keeps its best rank
+            for rank, offer_id in reversed(list(enumerate(offer_list, start=1))):
+                rows.append((offer_id, country, bestsellers_hash, rank))
+
+        with self._lock:
+            self._ranks_db.executemany("INSERT OR REPLACE INTO ranks (offer_id, country, bestsellers, rank) VALUES (?, ?, ?, ?)", rows)
+            self._ranks_db.execute("INSERT OR IGNORE INTO ranked (bestsellers) VALUES (?)", (bestsellers_hash,))
+            self._ranks_db.commit()
+
+    def _ranked_hashes(self) -> set[str]:
+        with self._lock:
+            return set(row[0] for row in self._ranks_db.execute("SELECT bestsellers FROM ranked"))
+
+    def index_missing_ranks(self) -> int:
+        """Indexes the ranks of archived responses which are not in `ranks.db` yet, e.g. from before it existed."""
+
+        ranked = self._ranked_hashes()
+        indexed = 0
+        for bestsellers_hash in dict.fromkeys(entry.bestsellers_hash for entry in self.entries):
+            if bestsellers_hash in ranked or bestsellers_hash in self._unrankable:
+                continue
+
+            try:
+                self.index_ranks(bestsellers_hash, self.get_blob(bestsellers_hash))
+                indexed += 1
+            except FileNotFoundError:
+                logging.warning(f'Best sellers blob {bestsellers_hash} is missing')
+                self._unrankable.add(bestsellers_hash)
+            except Exception as e:
+                logging.warning(f'Could not index the ranks of best sellers {bestsellers_hash}', exc_info=e)
+                self._unrankable.add(bestsellers_hash)
+
+        if indexed > 0:
+            logging.info(f'Indexed the ranks of {indexed} archived best sellers responses')
+        return indexed
+
+    def rank_history(self, offer_id: str, country_code: str, since: int = None, until: int = None) -> list[tuple[int, Optional[int]]]:
+        """(timestamp, rank) for every archived change, rank is None when the offer was not listed."""
+
+        self.index_missing_ranks()
+        ranked = self._ranked_hashes()
+        with self._lock:
+            ranks = dict(self._ranks_db.execute(
+                "SELECT bestsellers, rank FROM ranks WHERE offer_id = ? AND country = ?",
+                (offer_id, country_code.upper())
+            ).fetchall())
+
+        history = []
+        for entry in self.between(since, until):
+            if entry.bestsellers_hash not in ranked:
+                continue
+            history.append((entry.timestamp, ranks.get(entry.bestsellers_hash)))
+        return history
+
+    def import_legacy(self, folder: str = LEGACY_ARCHIVE_FOLDER) -> int:
+        """Moves `{hash}_{timestamp}/` folders of the old archive into the store, returns how many."""
+
+        if not os.path.isdir(folder):
+            return 0
+
+        known = set((entry.timestamp, entry.bestsellers_hash) for entry in self.entries)
+        imported = 0
+
+        with os.scandir(folder) as it:
+            legacy = sorted((entry for entry in it if entry.is_dir()), key=lambda entry: entry.name.rsplit('_', 1)[-1])
+
+        for entry in legacy:
+            try:
+                timestamp = int(entry.name.rsplit('_', 1)[-1])
+                with open(os.path.join(entry.path, 'BestSellers.json'), 'rb') as f:
+                    bestsellers_body = f.read()
+
+                shop_data = None
+                shop_path = os.path.join(entry.path, 'Shop.json')
+                if os.path.exists(shop_path):
+                    with open(shop_path, 'r', encoding='utf-8') as f:
+                        shop_data = json.load(f)
+
+                if (timestamp, hashlib.sha256(bestsellers_body).hexdigest()) not in known:
+                    self.add(timestamp, bestsellers_body, shop_data)
+                    imported += 1
+            except Exception as e:
+                logging.warning(f'Could not import {entry.path} into the best sellers archive', exc_info=e)
+                continue
+
+            # safe to drop, everything in it is in the store now
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+        if imported > 0:
+            self.entries.sort(key=lambda entry: entry.timestamp)
+            logging.info(f'Imported {imported} legacy best sellers archives')
+        return imported
+
+    def __str__(self) -> str:
+        return f"BestsellersArchive(entries={len(self.entries)}, blobs={len(os.listdir(self.blobs_folder))})"
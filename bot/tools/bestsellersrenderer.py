@@ -4,53 +4,99 @@ import asyncio
 from datetime import datetime, timezone
 import hashlib
 import logging
+import aiohttp
 import discord
-from playwright.async_api import async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 import requests
 import base64
 import time
-import os
 import json
 
 from bot import constants
+from bot.tools.browserpool import BROWSER_POOL
+from bot.tools.bestsellersarchive import BestsellersArchive
+from bot.tools.metrics import HTTP_TRACE, NOTIFICATIONS
 
+BESTSELLERS_DATA_URL = "https://cdn2.unrealengine.com/fn_bsdata/ebb74910-dd35-44b8-b826-d58dc16c6456.json"
 
 class BestsellersRenderer:
     def __init__(self, bot: constants.BotExt):
         self.bot = bot
         self.last_best_sellers_hash = None
         self.last_notified_hash = None
+        self.dumped_storefront_version = 0
+        self.archive = BestsellersArchive()
+        self.legacy_archive_imported = False
+
+        # conditional polling state for the best sellers data
+        self.bestsellers_body: bytes = None
+        self.bestsellers_hash: str = None
+        self.bestsellers_etag: str = None
+        self.bestsellers_last_modified: str = None
+        self.bestsellers_not_modified = 0
+        self.bestsellers_downloads = 0
+        self._session: aiohttp.ClientSession = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
+        return self._session
+
+    async def fetch_bestsellers(self) -> bool:
+        """Fetches the best sellers data unless it has not changed since the last fetch.
+
+        Returns whether a new body was downloaded. `bestsellers_body` and `bestsellers_hash`
+        always hold the latest data afterwards.
+        """
+
+        headers = {}
+        if self.bestsellers_body is not None:
+            if self.bestsellers_etag:
+                headers['If-None-Match'] = self.bestsellers_etag
+            if self.bestsellers_last_modified:
+                headers['If-Modified-Since'] = self.bestsellers_last_modified
+
+        logging.debug(f'[GET] {BESTSELLERS_DATA_URL}')
+        session = self._get_session()
+        async with session.get(BESTSELLERS_DATA_URL, headers=headers) as response:
+            if response.status == 304:
+                self.bestsellers_not_modified += 1
+                return False
+
+            response.raise_for_status()
+
+            md5 = hashlib.md5()
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                md5.update(chunk)
+                body.extend(chunk)
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        self.bestsellers_body = bytes(body)
+        self.bestsellers_hash = md5.hexdigest()
+        self.bestsellers_etag = etag
+        self.bestsellers_last_modified = last_modified
+        self.bestsellers_downloads += 1
+        return True
 
     async def get_leaving_new_lists(self) -> tuple:
         # numbers:numbers:numbers...
         leaving_today_string = []
 
         # we r making the value containing the ids for new and leaving soon tracks
-        logging.debug(f'[GET] {constants.FN_CATALOG}')
-        headers = {
-            'Authorization': self.bot.oauth_manager.session_token
-        }
-        response = requests.get(constants.FN_CATALOG, headers=headers)
-        if response.status_code == 401 or response.status_code == 403:
-            self.bot.oauth_manager._create_token()
-            raise Exception('Please try again.')
-        
-        data = response.json()
-
-        storefront = discord.utils.find(lambda storefront: storefront['name'] == 'BRWeeklyStorefront', data['storefronts'])
-        shop_tracks = storefront['catalogEntries']
+        storefront = await self.bot.storefront.get()
 
-        for track in shop_tracks:
-            if not track['meta']['templateId'].startswith('SparksSong:'):
-                continue
-            
+        for track in storefront.jam_track_offers:
             # offer_info contains the leaving date in ISO
             # check if it is the same day as today
 
             # set it to custom for testing
-            track['meta']['outDate'] = "2026-03-14T23:59:59.999Z"
+            # (not on the offer itself, the snapshot is shared with the rest of the bot)
+            out_date = "2026-03-14T23:59:59.999Z"
 
-            leaving_date = datetime.fromisoformat(track['meta']['outDate'])
+            leaving_date = datetime.fromisoformat(out_date)
             if leaving_date.date() != datetime.now(tz=timezone.utc).date():
                 continue
 
@@ -75,13 +121,9 @@ class BestsellersRenderer:
         return leaving_today_string, new_jam_track_string
 
     async def capture_renderer_screenshot(self, auto: bool = True, cols: int = 4) -> str:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=["--no-sandbox", "--disable-dev-shm-usage"]
-            )
-            page = await browser.new_page()
-                
+        async with BROWSER_POOL.page() as pooled:
+            page = pooled.page
+
             total_tracks_number = 0
             total_tracks_received = asyncio.Event()
             async def total_tracks_received_callback(msg, total_tracks):
@@ -94,7 +136,7 @@ class BestsellersRenderer:
             if not auto:
                 initial_cbtype = "image"
 
-            await page.expose_function("snapshot_ready", total_tracks_received_callback)
+            await pooled.expose("snapshot_ready", total_tracks_received_callback)
             
             leaving_today_string, new_jam_track_string = await self.get_leaving_new_lists()
             leaving_today_string = ":".join(leaving_today_string)
@@ -107,15 +149,13 @@ class BestsellersRenderer:
 
             print(url)
 
-            data_url = "https://cdn2.unrealengine.com/fn_bsdata/ebb74910-dd35-44b8-b826-d58dc16c6456.json"
             try:
-                req = requests.get(data_url)
-                req.raise_for_status()
+                await self.fetch_bestsellers()
             except Exception as e:
                 logging.error(f"Error fetching bestsellers data: {e}")
                 return
 
-            bestsellers_data = req.json()
+            bestsellers_data = json.loads(self.bestsellers_body)
             bestsellers_country_keys = bestsellers_data.keys()
 
             bestsellers_countries = []
@@ -174,27 +214,17 @@ class BestsellersRenderer:
 
             shop_entries = shop_data['data']['entries']
 
-            logging.debug(f'[GET] {constants.FN_CATALOG}')
-            headers = {
-                'Authorization': self.bot.oauth_manager.session_token
-            }
-            response = requests.get(constants.FN_CATALOG, headers=headers)
-            if response.status_code == 401 or response.status_code == 403:
-                self.bot.oauth_manager._create_token()
-                raise Exception('Please try again.')
-
-            data = response.json()
-            
-            storefront = discord.utils.find(lambda storefront: storefront['name'] == 'BRWeeklyStorefront', data['storefronts'])
-            entries = storefront['catalogEntries']
-            open('storefront.json', 'w').write(json.dumps(storefront, indent=4))
+            storefront = await self.bot.storefront.get()
+            if storefront.version != self.dumped_storefront_version:
+                open('storefront.json', 'w').write(json.dumps({'name': 'BRWeeklyStorefront', 'catalogEntries': storefront.weekly_entries}, indent=4))
+                self.dumped_storefront_version = storefront.version
 
             data_to_give_to_website = {
                 'items': []
             }
 
             for offer in per_offer_id.keys():
-                offer_info = next((x for x in entries if x['offerId'] == offer), None)
+                offer_info = storefront.offers_by_id.get(offer)
                 if offer_info is None:
                     logging.warning(f"Offer {offer} not found in storefront.")
                     continue
@@ -425,11 +455,15 @@ class BestsellersRenderer:
             open('items.json', 'w').write(json.dumps(data_to_give_to_website, indent=4))
 
             logging.debug(f"Navigating to {url}")
-            await page.goto(url)
+            await page.goto(url, wait_until="networkidle")
 
-            await asyncio.sleep(2)
             await page.evaluate(f"window.setBestsellersData({json.dumps(data_to_give_to_website)})", None)
-            await asyncio.sleep(3)
+
+            # wait for the item images and fonts instead of a fixed delay, they mostly come from the asset cache
+            try:
+                await page.wait_for_function("document.fonts.status === 'loaded' && Array.from(document.images).every(img => img.complete)", timeout=10000)
+            except PlaywrightTimeoutError:
+                logging.warning("Bestsellers renderer images did not finish loading, taking the screenshot anyway")
 
             try:
                 output_path = constants.CACHE_FOLDER + "bestsellers.png"
@@ -438,11 +472,9 @@ class BestsellersRenderer:
 
                 return output_path
                 
-            except asyncio.TimeoutError as e:
+            except (asyncio.TimeoutError, PlaywrightTimeoutError) as e:
                 logging.error(f"Timed out waiting for snapshot:", exc_info=e)
                 raise Exception("Timed out.")
-            finally:
-                await browser.close()
 
     async def handle_cacher(self):
         # this function is ran every minute
@@ -450,19 +482,27 @@ class BestsellersRenderer:
         # bestsellers hash is also saved locally
 
         logging.debug('Best sellers task loop start')
+
+        if not self.legacy_archive_imported:
+            self.legacy_archive_imported = True
+            try:
+                await asyncio.to_thread(self.archive.import_legacy)
+                # once per archive from before ranks.db, so history queries do not pay for it
+                await asyncio.to_thread(self.archive.index_missing_ranks)
+            except Exception as e:
+                logging.warning(f"Error importing legacy bestsellers archives: {e}")
         
-        url = "https://cdn2.unrealengine.com/fn_bsdata/ebb74910-dd35-44b8-b826-d58dc16c6456.json"
         try:
-            req = requests.get(url)
-            req.raise_for_status()
+            await self.fetch_bestsellers()
         except Exception as e:
             logging.error(f"Error fetching bestsellers data: {e}")
             return
 
         unix_ts = int(time.time())
 
-        # generate hash of the content to check for changes
-        best_sellers_hash = hashlib.md5(req.content).hexdigest()
+        # hashed while downloading, and unchanged when upstream answered 304
+        best_sellers_hash = self.bestsellers_hash
+        last_modified = self.bestsellers_last_modified or 'N/A'
 
         if self.last_best_sellers_hash == None:
             # init last best sellers hash
@@ -471,21 +511,14 @@ class BestsellersRenderer:
 
                 ch = await self.bot.fetch_channel(1328386911743639662)
                 await ch.send(f"Best Sellers init hashes at <t:{unix_ts}:F>:" +
-                f"\nCache: {self.last_best_sellers_hash}\nUpstream: {best_sellers_hash}\nLast Modified: {req.headers.get('Last-Modified', 'N/A')}")
+                f"\nCache: {self.last_best_sellers_hash}\nUpstream: {best_sellers_hash}\nLast Modified: {last_modified}")
             except Exception as e:
                 logging.warning(f"Error reading hash cache: {e}")
                 self.last_best_sellers_hash = ""
 
-        logging.debug(f'[GET] {constants.FN_CATALOG}')
-        headers = {
-            'Authorization': self.bot.oauth_manager.session_token
-        }
-        shop_response = requests.get(constants.FN_CATALOG, headers=headers)
-        shop_data = shop_response.json()
-
-        archive_path = f'{constants.CACHE_FOLDER}/archive_best_sellers/{best_sellers_hash}_{unix_ts}/'
-
         if self.last_best_sellers_hash != best_sellers_hash:
+            # only archived alongside a change, no need to hold on to it otherwise
+            shop_data = (await self.bot.storefront.get()).data
 
             channel: discord.TextChannel
             try:
@@ -498,7 +531,7 @@ class BestsellersRenderer:
                     f"Best Sellers response has changed" +
                     f"\nUpstream: {best_sellers_hash}" +
                     f"\nCache: {self.last_best_sellers_hash}" + 
-                    f"\nLast Modified header: {req.headers.get('Last-Modified', 'N/A')}")
+                    f"\nLast Modified header: {last_modified}")
 
                 await channel.send(
                     f"Rendering image..."
@@ -511,12 +544,7 @@ class BestsellersRenderer:
 
             self.last_best_sellers_hash = best_sellers_hash
             try:
-                os.makedirs(archive_path, exist_ok=True)
-                with open(f'{archive_path}BestSellers.json', 'wb') as f:
-                    f.write(req.content)
-
-                with open(f'{archive_path}Shop.json', 'w', encoding='utf-8') as f:
-                    json.dump(shop_data, f, indent=4)
+                await asyncio.to_thread(self.archive.add, unix_ts, self.bestsellers_body, shop_data)
             except Exception as e:
                 logging.error(f"Error archiving bestsellers: {e}")
 
@@ -608,9 +636,12 @@ class BestsellersRenderer:
                 if JamTrackEvents.BestSellers.value.id in channel_to_send.events:
                     try:
                         message = await channel.send(content=content, file=discord.File(constants.CACHE_FOLDER + "bestsellers.png", filename='bestsellers.png'))
+                        NOTIFICATIONS.inc(event=JamTrackEvents.BestSellers.value.id, outcome='sent')
                     except discord.Forbidden as e:
+                        NOTIFICATIONS.inc(event=JamTrackEvents.BestSellers.value.id, outcome='forbidden')
                         logging.warning(f"Channel {channel.id} cannot be sent messages to.", exc_info=e)
                     except Exception as e:
+                        NOTIFICATIONS.inc(event=JamTrackEvents.BestSellers.value.id, outcome='failed')
                         logging.warning(f"Error sending message to channel {channel.id}", exc_info=e)
 
             self.last_notified_hash = best_sellers_hash
@@ -0,0 +1,287 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import time
+from typing import AsyncIterator, Callable, Optional
+
+import discord.ext.tasks as tasks
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright, Route
+
+import bot.constants as constants
+from bot.tools.rendercache import FileCache
+from bot.tools.taskregistry import TASK_REGISTRY
+
+RENDERER_ASSETS_FOLDER = f'{constants.CACHE_FOLDER}renderer_assets/'
+
+# images and fonts are never changed in place, scripts and styles are redeployed now and then
+CACHED_RESOURCE_TYPES = {'image', 'font', 'stylesheet', 'script'}
+EXPIRING_RESOURCE_TYPES = {'stylesheet', 'script'}
+
+class PooledPage:
+    def __init__(self, context: BrowserContext, page: Page) -> None:
+        """A page kept open between renders, in its own browser context.
+
+        Properties:
+            `renders` Renders done with this page so far.
+            `crashed` Set when the page crashed, it is thrown away instead of reused.
+        """
+
+        self.context = context
+        self.page = page
+        self.renders = 0
+        self.crashed = False
+        self._handlers: dict[str, Callable] = {}
+        self._exposed: set[str] = set()
+
+        page.on('crash', lambda _: setattr(self, 'crashed', True))
+
+    async def expose(self, name: str, handler: Callable) -> None:
+        """Like `page.expose_function`, but can be called again for the next render."""
+
+        self._handlers[name] = handler
+        if name in self._exposed:
+            return
+
+        # a page can only expose a name once, so it goes through the current handler
+        async def dispatch(*args):
+            current = self._handlers.get(name)
+            if current is None:
+                return None
+            result = current(*args)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+
+        await self.page.expose_function(name, dispatch)
+        self._exposed.add(name)
+
+    async def close(self) -> None:
+        try:
+            await self.context.close()
+        except Exception as e:
+            logging.debug('Could not close a pooled page', exc_info=e)
+
+class BrowserPool:
+    def __init__(self, pages: int = 2, max_renders: int = 25, asset_ttl: float = 6 * 3600, max_asset_bytes: int = 128 * 1024 * 1024) -> None:
+        """One long lived headless Chromium with a few pages to render in.
+
+        The browser is started on first use and restarted if it disconnects or crashes.
+        Pages are reused between renders and replaced after `max_renders` of them, so the
+        memory a page collects over time is given back. Static assets the renderer loads
+        (images, fonts, scripts, styles) are served from a local cache; scripts and styles
+        are fetched again after `asset_ttl` seconds in case the renderer was redeployed.
+
+        Properties:
+            `pages` Pages, and so renders, allowed at once.
+            `max_renders` Renders a page does before it is replaced.
+            `assets` Where the renderer's static assets are kept.
+            `waiting` Renders waiting for a free page.
+        """
+
+        self.pages = pages
+        self.max_renders = max_renders
+        self.asset_ttl = asset_ttl
+        self.assets = FileCache(RENDERER_ASSETS_FOLDER, max_asset_bytes, name='renderer_assets')
+
+        self._playwright: Playwright = None
+        self._browser: Browser = None
+        self._idle: list[PooledPage] = []
+        self._semaphore = asyncio.Semaphore(pages)
+        self._start_lock = asyncio.Lock()
+        # url -> when it was last fetched, only kept for the expiring resource types
+        self._asset_fetched_at: dict[str, float] = {}
+
+        self.waiting = 0
+        self.launches = 0
+        self.renders = 0
+        self.recycled = 0
+        self.asset_hits = 0
+        self.asset_misses = 0
+
+        self.health_task: tasks.Loop = self.health_loop
+        TASK_REGISTRY.append(self.health_loop)
+
+    @property
+    def connected(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def _ensure_browser(self) -> Browser:
+        async with self._start_lock:
+            if self.connected:
+                return self._browser
+
+            # whatever was open belonged to the old browser
+            self._idle.clear()
+            await self._stop()
+
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
+                headless=True,
+                args=["--no-sandbox", "--disable-dev-shm-usage"]
+            )
+            self.launches += 1
+            logging.info(f'Renderer browser launched ({self.launches} launches so far)')
+            return self._browser
+
+    async def _stop(self) -> None:
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                logging.debug('Could not close the renderer browser', exc_info=e)
+            self._browser = None
+
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception as e:
+                logging.debug('Could not stop playwright', exc_info=e)
+            self._playwright = None
+
+    async def shutdown(self) -> None:
+        async with self._start_lock:
+            self._idle.clear()
+            await self._stop()
+
+    async def _new_page(self) -> PooledPage:
+        browser = await self._ensure_browser()
+        context = await browser.new_context()
+        await context.route('**/*', self._route_asset)
+        page = await context.new_page()
+        return PooledPage(context, page)
+
+    def _asset_name(self, url: str) -> str:
+        ext = os.path.splitext(url.split('?')[0])[1]
+        if len(ext) > 6:
+            ext = ''
+        return hashlib.sha1(url.encode('utf-8')).hexdigest() + ext
+
+    def _content_type_name(self, name: str) -> str:
+        # the upstream header is kept next to the blob, many asset URLs have no extension to guess from
+        return name + '.content-type'
+
+    def _read_content_type(self, name: str) -> Optional[str]:
+        path = self.assets.get(self._content_type_name(name))
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _store_asset(self, name: str, body: bytes, content_type: Optional[str]) -> None:
+        if content_type:
+            self.assets.put(self._content_type_name(name), content_type.encode('utf-8'))
+        else:
+            try:
+                os.remove(self.assets.path_for(self._content_type_name(name)))
+            except FileNotFoundError:
+                pass
+        self.assets.put(name, body)
+
+    async def _route_asset(self, route: Route) -> None:
+        request = route.request
+        if request.method != 'GET' or request.resource_type not in CACHED_RESOURCE_TYPES or not request.url.startswith('http'):
+            await route.continue_()
+            return
+
+        name = self._asset_name(request.url)
+        expires = request.resource_type in EXPIRING_RESOURCE_TYPES
+        fresh = not expires or time.time() - self._asset_fetched_at.get(request.url, 0) < self.asset_ttl
+
+        path = self.assets.get(name) if fresh else None
+        if path:
+            self.asset_hits += 1
+            content_type = await asyncio.to_thread(self._read_content_type, name)
+            # fonts and images are often cross origin
+            await route.fulfill(path=path, content_type=content_type, headers={'access-control-allow-origin': '*'})
+            return
+
+        self.asset_misses += 1
+        try:
+            response = await route.fetch()
+        except Exception as e:
+            logging.debug(f'Could not fetch renderer asset {request.url}', exc_info=e)
+            await route.abort()
+            return
+
+        if response.ok:
+            try:
+                body = await response.body()
+                await asyncio.to_thread(self._store_asset, name, body, response.headers.get('content-type'))
+                if expires:
+                    self._asset_fetched_at[request.url] = time.time()
+            except Exception as e:
+                logging.warning(f'Could not cache renderer asset {request.url}', exc_info=e)
+
+        await route.fulfill(response=response)
+
+    @contextlib.asynccontextmanager
+    async def page(self) -> AsyncIterator[PooledPage]:
+        """Borrows a page for one render, waiting for one to be free."""
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        try:
+            pooled: Optional[PooledPage] = None
+            while self._idle and pooled is None:
+                candidate = self._idle.pop()
+                if candidate.crashed or candidate.page.is_closed() or not self.connected:
+                    await candidate.close()
+                    continue
+                pooled = candidate
+
+            if pooled is None:
+                pooled = await self._new_page()
+
+            failed = False
+            try:
+                yield pooled
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                pooled.renders += 1
+                self.renders += 1
+                pooled._handlers.clear()
+
+                # a render that failed may have left the page in any state
+                if failed or pooled.crashed or pooled.renders >= self.max_renders or not self.connected:
+                    self.recycled += 1
+                    await pooled.close()
+                else:
+                    self._idle.append(pooled)
+        finally:
+            self._semaphore.release()
+
+    @tasks.loop(minutes=5, name="Check Renderer Browser")
+    async def health_loop(self):
+        if self._browser is None:
+            # not started yet, or nothing rendered since the last restart
+            return
+
+        if not self.connected:
+            logging.warning('Renderer browser disconnected, restarting it')
+            try:
+                await self._ensure_browser()
+            except Exception as e:
+                logging.warning('Could not restart the renderer browser', exc_info=e)
+            return
+
+        for pooled in list(self._idle):
+            if pooled.crashed or pooled.page.is_closed():
+                self._idle.remove(pooled)
+                await pooled.close()
+
+    def __str__(self) -> str:
+        return f"BrowserPool({self.pages=}, connected={self.connected}, idle={len(self._idle)}, {self.waiting=}, {self.launches=}, {self.renders=}, {self.recycled=}, {self.asset_hits=}, {self.asset_misses=})".replace('self.', '')
+
+# one browser for the whole bot, it is the expensive part
+BROWSER_POOL = BrowserPool()
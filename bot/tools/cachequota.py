@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Callable, Literal, Optional
+
+import discord.ext.tasks as tasks
+
+import bot.constants as constants
+from bot.tools.taskregistry import TASK_REGISTRY
+
+CACHE_JOURNAL_FILE = f'{constants.CACHE_FOLDER}CacheJournal.json'
+
+class QuotaCache:
+    def __init__(self, name: str, folder: str, max_bytes: int, unit: Literal['file', 'folder'] = 'file', keep: Callable[[], set[str]] = None) -> None:
+        """One cache folder with a byte budget.
+
+        Properties:
+            `name` Shown in stats and used in the access journal.
+            `folder` Where the cache lives.
+            `max_bytes` Budget, the least recently used entries are evicted past it.
+            `unit` Whether an entry is a file in `folder` or a whole sub folder (e.g. previews/<pid>/).
+            `keep` Returns the entry names which must never be evicted, e.g. charts still in the game.
+        """
+
+        self.name = name
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.unit = unit
+        self.keep = keep
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self.entries = 0
+        self.scanned_at: Optional[float] = None
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"QuotaCache({self.name=}, {self.size_bytes=}, {self.max_bytes=}, {self.hits=}, {self.misses=}, {self.evictions=})".replace('self.', '')
+
+class CacheQuotaManager:
+    def __init__(self, journal_path: str = CACHE_JOURNAL_FILE) -> None:
+        """Keeps every registered cache folder within its budget.
+
+        Caches report hits and misses here, which also records when each entry was last
+        used in an access journal (persisted, so the order survives restarts). A background
+        loop evicts the least recently used entries of every cache over budget; entries
+        the journal has never seen fall back to their modification time.
+        """
+
+        self.journal_path = journal_path
+        self.caches: dict[str, QuotaCache] = {}
+
+        # cache name -> entry name -> last access, as a unix timestamp
+        self._journal: dict[str, dict[str, float]] = {}
+        self._dirty = False
+
+        self.load()
+
+        self.evict_task: tasks.Loop = self.evict_loop
+        TASK_REGISTRY.append(self.evict_loop)
+
+    def register(self, name: str, folder: str, max_bytes: int, unit: Literal['file', 'folder'] = 'file', keep: Callable[[], set[str]] = None) -> QuotaCache:
+        os.makedirs(folder, exist_ok=True)
+        cache = QuotaCache(name, folder, max_bytes, unit=unit, keep=keep)
+        self.caches[name] = cache
+        return cache
+
+    def record(self, name: str, entry: str, hit: bool) -> None:
+        cache = self.caches.get(name)
+        if cache is None:
+            return
+
+        if hit:
+            cache.hits += 1
+        else:
+            cache.misses += 1
+
+        self._journal.setdefault(name, {})[entry] = time.time()
+        self._dirty = True
+
+    def load(self) -> None:
+        if not os.path.exists(self.journal_path):
+            return
+
+        try:
+            with open(self.journal_path, 'r') as f:
+                self._journal = json.load(f)
+        except Exception as e:
+            logging.warning(f'Could not load the cache journal from {self.journal_path}', exc_info=e)
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+
+        # copied first, this runs in a thread while the bot keeps recording accesses
+        journal = {name: dict(entries) for name, entries in list(self._journal.items())}
+
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(journal, f)
+        os.replace(tmp_path, self.journal_path)
+        self._dirty = False
+
+    def scan(self, cache: QuotaCache) -> list[tuple[float, int, str]]:
+        """Returns (last access, size, name) for every entry, and updates the cache's size."""
+
+        journal = self._journal.get(cache.name, {})
+        entries = []
+        with os.scandir(cache.folder) as it:
+            for entry in it:
+                if entry.name.endswith('.tmp'):
+                    continue
+
+                try:
+                    if cache.unit == 'folder':
+                        if not entry.is_dir():
+                            continue
+                        size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(entry.path) for file in files)
+                    else:
+                        if not entry.is_file():
+                            continue
+                        size = entry.stat().st_size
+
+                    last_access = max(journal.get(entry.name, 0), entry.stat().st_mtime)
+                except FileNotFoundError:
+                    continue
+
+                entries.append((last_access, size, entry.name))
+
+        # forget entries which are gone, e.g. evicted by the cache itself
+        seen = set(name for _, _, name in entries)
+        for name in [name for name in list(journal.keys()) if name not in seen]:
+            journal.pop(name, None)
+
+        cache.size_bytes = sum(size for _, size, _ in entries)
+        cache.entries = len(entries)
+        cache.scanned_at = time.time()
+        return entries
+
+    def enforce(self, cache: QuotaCache) -> int:
+        entries = self.scan(cache)
+        if cache.size_bytes <= cache.max_bytes:
+            return 0
+
+        keep = cache.keep() if cache.keep else set()
+        journal = self._journal.get(cache.name, {})
+
+        evicted = 0
+        entries.sort()
+        for _, size, name in entries:
+            if cache.size_bytes <= cache.max_bytes:
+                break
+            if name in keep:
+                continue
+
+            path = os.path.join(cache.folder, name)
+            try:
+                if cache.unit == 'folder':
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            cache.size_bytes -= size
+            cache.entries -= 1
+            journal.pop(name, None)
+            evicted += 1
+
+        cache.evictions += evicted
+        self._dirty = self._dirty or evicted > 0
+        logging.info(f'Evicted {evicted} entries from the {cache.name} cache, {cache.size_bytes} bytes remain')
+        return evicted
+
+    def enforce_all(self) -> None:
+        for cache in list(self.caches.values()):
+            try:
+                self.enforce(cache)
+            except Exception as e:
+                logging.warning(f'Could not enforce the quota of the {cache.name} cache', exc_info=e)
+        self.save()
+
+    @tasks.loop(minutes=15, name="Enforce Cache Quotas")
+    async def evict_loop(self):
+        await asyncio.to_thread(self.enforce_all)
+
+    def __str__(self) -> str:
+        return f"CacheQuotaManager(caches={list(self.caches.keys())})"
+
+# caches live in module level objects all over the bot, so the manager does too
+CACHE_QUOTAS = CacheQuotaManager()
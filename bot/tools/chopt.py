@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+import bot.constants as constants
+from bot.tools.rendercache import FileCache
+
+CHOPT_CACHE_FOLDER = f'{constants.CACHE_FOLDER}paths/'
+
+class ChoptError(Exception):
+    pass
+
+class ChoptResult:
+    def __init__(self, image_path: str, output: str, cached: bool) -> None:
+        """The outcome of one CHOpt run.
+
+        Properties:
+            `image_path` The path image, inside the result cache. Do not delete it.
+            `output` What CHOpt printed to stdout, stripped.
+            `cached` Whether it was served from the cache without running CHOpt.
+        """
+
+        self.image_path = image_path
+        self.output = output
+        self.cached = cached
+
+    def __str__(self) -> str:
+        return f"ChoptResult({self.image_path=}, {self.cached=})".replace('self.', '')
+
+class ChoptRunner:
+    def __init__(self, max_concurrent: int = 2, timeout: float = 300, max_bytes: int = 512 * 1024 * 1024) -> None:
+        """Runs CHOpt without blocking the event loop, caching what it produces.
+
+        Results are keyed by the chart contents, the song.ini and every CHOpt argument
+        (instrument, difficulty, squeeze, extra args) plus the binary, so switching back
+        to an instrument or another user asking for the same path never runs CHOpt again.
+        Identical jobs which are already running are waited on instead of started twice.
+
+        Background jobs (see `queue_background`) run one at a time, and only while a slot
+        is free and no user is waiting for one.
+
+        Properties:
+            `max_concurrent` CHOpt processes allowed at once.
+            `timeout` Seconds before a CHOpt process is killed.
+            `cache` Where path images (`{key}.png`) and outputs (`{key}.txt`) are kept.
+        """
+
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.cache = FileCache(CHOPT_CACHE_FOLDER, max_bytes, name='paths')
+
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._waiting = 0
+
+        self._background: asyncio.Queue = asyncio.Queue()
+        self._background_keys: set[str] = set()
+        self._background_worker: asyncio.Task = None
+
+        self.hits = 0
+        self.coalesced = 0
+        self.runs = 0
+        self.failed = 0
+        self.background_runs = 0
+        self.total_seconds = 0.0
+
+    def binary_path(self, binary_id: int) -> str:
+        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        if os.name == 'nt':
+            return os.path.join(script_dir, 'data', 'Binaries', 'Windows', 'CHOpt', str(binary_id), 'CHOpt.exe')
+        else:
+            return os.path.join(script_dir, 'data', 'Binaries', 'Linux', 'CHOpt', str(binary_id), 'CHOpt.sh')
+
+    def job_key(self, chart: bytes, chopt_args: list[str], binary_id: int, song_ini: str) -> str:
+        h = hashlib.sha256()
+        h.update(hashlib.sha256(chart).digest())
+        h.update(song_ini.encode('utf-8'))
+        h.update(f'\0{binary_id}\0'.encode('utf-8'))
+        h.update('\0'.join(chopt_args).encode('utf-8'))
+        return h.hexdigest()
+
+    def cached_result(self, key: str) -> Optional[ChoptResult]:
+        image_path = self.cache.get(f'{key}.png')
+        output_path = self.cache.get(f'{key}.txt')
+        if not image_path or not output_path:
+            return None
+
+        with open(output_path, 'r', encoding='utf-8') as f:
+            output = f.read()
+        return ChoptResult(image_path, output, True)
+
+    async def run(self, midi_file: str, chopt_args: list[str], binary_id: int = 1, song_ini: str = '') -> ChoptResult:
+        """Gets the result of running CHOpt on `midi_file`, from the cache if possible.
+
+        `chopt_args` are all the arguments except the input (`-f`) and output (`-o`),
+        which are filled in per job.
+        """
+
+        with open(midi_file, 'rb') as f:
+            chart = f.read()
+        return await self.run_chart(chart, chopt_args, binary_id, song_ini)
+
+    async def run_chart(self, chart: bytes, chopt_args: list[str], binary_id: int = 1, song_ini: str = '') -> ChoptResult:
+        key = self.job_key(chart, chopt_args, binary_id, song_ini)
+
+        cached = self.cached_result(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run_job(key, chart, chopt_args, binary_id, song_ini))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # shield so one user giving up does not kill the job for everyone waiting on it
+        return await asyncio.shield(task)
+
+    def queue_background(self, midi_file: str, chopt_args: list[str], binary_id: int = 1, song_ini: str = '') -> bool:
+        """Queues a low priority job to fill the cache ahead of time, returns False if there is nothing to do."""
+
+        with open(midi_file, 'rb') as f:
+            chart = f.read()
+        key = self.job_key(chart, chopt_args, binary_id, song_ini)
+
+        if key in self._background_keys or key in self._inflight or self.cached_result(key) is not None:
+            return False
+
+        self._background_keys.add(key)
+        self._background.put_nowait((key, chart, chopt_args, binary_id, song_ini))
+
+        if self._background_worker is None or self._background_worker.done():
+            self._background_worker = asyncio.create_task(self._run_background())
+        return True
+
+    async def _run_background(self):
+        while not self._background.empty():
+            key, chart, chopt_args, binary_id, song_ini = self._background.get_nowait()
+            try:
+                # users go first, wait until a slot is free and nobody is queued for one
+                while self._waiting > 0 or self._semaphore.locked():
+                    await asyncio.sleep(1)
+
+                result = await self.run_chart(chart, chopt_args, binary_id, song_ini)
+                if not result.cached:
+                    self.background_runs += 1
+            except Exception as e:
+                logging.warning(f'Could not precompute path {key}', exc_info=e)
+            finally:
+                self._background_keys.discard(key)
+
+    async def _run_job(self, key: str, chart: bytes, chopt_args: list[str], binary_id: int, song_ini: str) -> ChoptResult:
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        try:
+            # someone may have finished the same job while we were queued
+            cached = self.cached_result(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+            # every job gets its own folder, CHOpt reads song.ini from next to the chart
+            work_dir = os.path.abspath(tempfile.mkdtemp(prefix='chopt_', dir=constants.TEMP_FOLDER))
+            try:
+                midi_path = os.path.join(work_dir, 'notes.mid')
+                image_path = os.path.join(work_dir, 'path.png')
+                with open(midi_path, 'wb') as f:
+                    f.write(chart)
+                with open(os.path.join(work_dir, 'song.ini'), 'w', encoding='utf-8') as f:
+                    f.write(song_ini)
+
+                command = [self.binary_path(binary_id), '-f', midi_path, *chopt_args, '-o', image_path]
+                output = await self._execute(command)
+
+                if not os.path.exists(image_path):
+                    self.failed += 1
+                    raise ChoptError('CHOpt Error: no image was produced')
+
+                shutil.move(image_path, self.cache.path_for(f'{key}.png'))
+                self.cache.put(f'{key}.txt', output.encode('utf-8'))
+                return ChoptResult(self.cache.stored(f'{key}.png'), output, False)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        finally:
+            self._semaphore.release()
+
+    async def _execute(self, command: list[str]) -> str:
+        logging.info(f'Running CHOpt: "{' '.join(command)}"')
+
+        self.runs += 1
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+        except BaseException as e:
+            # timed out or the bot is shutting down, do not leave CHOpt running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            self.failed += 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise ChoptError(f'CHOpt Error: took longer than {self.timeout}s')
+            raise
+        finally:
+            self.total_seconds += time.perf_counter() - start
+
+        if process.returncode != 0:
+            self.failed += 1
+            raise ChoptError("CHOpt Error: " + stderr.decode('utf-8', errors='replace'))
+
+        return stdout.decode('utf-8', errors='replace').strip()
+
+    @property
+    def running(self) -> int:
+        return len(self._inflight)
+
+    def __str__(self) -> str:
+        return f"ChoptRunner({self.max_concurrent=}, running={self.running}, {self.hits=}, {self.coalesced=}, {self.runs=}, {self.failed=}, background_queued={self._background.qsize()}, {self.background_runs=})".replace('self.', '')
+
+# shared so identical jobs from different handlers are coalesced
+CHOPT_RUNNER = ChoptRunner()
@@ -0,0 +1,131 @@
+import math
+from typing import Optional
+
+class StreamingHistogram:
+    def __init__(self, min_value: float = 0.001, max_value: float = 900, growth: float = 1.05) -> None:
+        """Counts values in log spaced buckets, so its size never depends on how many were added.
+
+        Bucket `i` holds values up to `min_value * growth ** i`, which means a percentile read
+        from it is at most `growth - 1` (5%) above the real one. Values past `max_value` all
+        land in the last bucket.
+
+        Properties:
+            `count` Values added.
+            `total` Their sum.
+            `max` The largest one.
+        """
+
+        self.min_value = min_value
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self.counts = [0] * (math.ceil(math.log(max_value / min_value) / self._log_growth) + 2)
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return min(len(self.counts) - 1, math.ceil(math.log(value / self.min_value) / self._log_growth))
+
+    def add(self, value: float) -> None:
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The `q` (0 to 1) percentile, None if nothing was added."""
+
+        if self.count == 0:
+            return None
+
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                # the bucket's upper bound, but never more than what was actually seen
+                return min(self.min_value * self.growth ** index, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count > 0 else None
+
+    def __str__(self) -> str:
+        return f"StreamingHistogram({self.count=}, p50={self.percentile(0.5)}, p99={self.percentile(0.99)}, {self.max=})".replace('self.', '')
+
+class CommandStats:
+    def __init__(self, name: str) -> None:
+        """How one command did since the last report.
+
+        Properties:
+            `invocations` Times it finished, either way.
+            `errors` Times it raised.
+            `dm_invocations` Times it was used outside a guild.
+            `durations` Seconds each invocation took.
+        """
+
+        self.name = name
+        self.invocations = 0
+        self.errors = 0
+        self.dm_invocations = 0
+        self.durations = StreamingHistogram()
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.invocations if self.invocations > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"CommandStats({self.name=}, {self.invocations=}, {self.errors=}, {self.dm_invocations=})".replace('self.', '')
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    if seconds < 1:
+        return f'{seconds * 1000:.0f}ms'
+    return f'{seconds:.2f}s'
+
+class CommandAnalytics:
+    def __init__(self) -> None:
+        """Per command counts, error rates and latency percentiles between two reports.
+
+        Only one `CommandStats` is kept per command name, so memory stays the same however
+        many interactions come in. `take` hands the current stats over and starts afresh.
+        """
+
+        self.commands: dict[str, CommandStats] = {}
+
+    def record(self, command_name: str, duration: float, failed: bool, is_dm: bool) -> None:
+        stats = self.commands.get(command_name)
+        if stats is None:
+            stats = CommandStats(command_name)
+            self.commands[command_name] = stats
+
+        stats.invocations += 1
+        if failed:
+            stats.errors += 1
+        if is_dm:
+            stats.dm_invocations += 1
+        stats.durations.add(duration)
+
+    def take(self) -> dict[str, CommandStats]:
+        commands = self.commands
+        self.commands = {}
+        return commands
+
+    @staticmethod
+    def report_lines(commands: dict[str, CommandStats]) -> list[str]:
+        lines = []
+        for stats in sorted(commands.values(), key=lambda stats: stats.invocations, reverse=True):
+            durations = stats.durations
+            line = f'`/{stats.name}`: {stats.invocations} · p50 {format_duration(durations.percentile(0.5))} · p95 {format_duration(durations.percentile(0.95))} · p99 {format_duration(durations.percentile(0.99))}'
+            if stats.errors > 0:
+                line += f' · {stats.errors} errors ({stats.error_rate:.1%})'
+            lines.append(line)
+        return lines
+
+    def __str__(self) -> str:
+        return f"CommandAnalytics(commands={len(self.commands)})"
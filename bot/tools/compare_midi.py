@@ -719,7 +719,7 @@ def save_filtered_midi(input_file, output_file, tracks_to_remove, tempo_events):
         new_mid.save(output_file)
         logging.debug(f"Filtered update MIDI saved to '{output_file}'")
 
-def main(midi_file1, midi_file2, session_id, song_name, note_range=range(1, 128), artist_name = 'No artist'):
+def main(midi_file1, midi_file2, session_id, song_name, note_range=range(1, 128), artist_name = 'No artist', output_folder = constants.TEMP_FOLDER):
     base_name1, ext1 = os.path.splitext(midi_file1)
     base_name2, ext2 = os.path.splitext(midi_file2)
     session_id, ext3 = os.path.splitext(session_id)
@@ -728,7 +728,6 @@ def main(midi_file1, midi_file2, session_id, song_name, note_range=range(1, 128)
         logging.debug("Error: Could not extract session ID from the arg.")
         return False, None, None
 
-    output_folder = constants.TEMP_FOLDER
     os.makedirs(output_folder, exist_ok=True)
 
     if not os.path.exists(midi_file2):
@@ -798,8 +797,8 @@ if __name__ == "__main__":
         else:
             logging.debug("MIDI comparison failed.")
 
-def run_comparison(midi_file1, midi_file2, session_id, song_name = 'unknown', artist_name = 'No artist'):
-    result, m_old, m_new = main(midi_file1, midi_file2, session_id, song_name, artist_name = artist_name)
+def run_comparison(midi_file1, midi_file2, session_id, song_name = 'unknown', artist_name = 'No artist', output_folder = constants.TEMP_FOLDER):
+    result, m_old, m_new = main(midi_file1, midi_file2, session_id, song_name, artist_name = artist_name, output_folder = output_folder)
     if result:
         logging.debug("MIDI comparison completed successfully.")
     else:
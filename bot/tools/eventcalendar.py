@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import aiohttp
+import discord.ext.tasks as tasks
+
+import bot.constants as constants
+from bot.tools.oauthmanager import OAuthManager
+from bot.tools.taskregistry import TASK_REGISTRY
+from bot.tools.metrics import HTTP_TRACE
+
+def parse_date(date_string: str) -> Optional[datetime]:
+    if not date_string:
+        return None
+    return datetime.fromisoformat(date_string.replace('Z', '+00:00'))
+
+class CalendarSnapshot:
+    def __init__(self, data: dict, version: int, content_hash: str, fetched_at: float, now: datetime = None) -> None:
+        """What the calendar says is active right now, worked out once.
+
+        The answer only holds until the next `activeSince`, `activeUntil` or state
+        `validFrom` in the calendar, which is `expires_at`. After that the snapshot has to
+        be rebuilt, from the same data unless a newer calendar has been fetched since.
+
+        Properties:
+            `data` The raw calendar response.
+            `version` Goes up by one every time the calendar contents change.
+            `rotation` Shortnames of every song in the weekly rotation (including spotlight), in calendar order.
+            `spotlight` Shortnames of the songs in the spotlight.
+            `setlists` `setlist_{n}` -> (shortnames, active until), ordered by n.
+            `expires_at` When this snapshot stops being accurate, None if nothing is scheduled.
+            `has_state` Whether any calendar state was valid at all.
+        """
+
+        self.data = data
+        self.version = version
+        self.content_hash = content_hash
+        self.fetched_at = fetched_at
+        self.built_at = now or datetime.now(timezone.utc)
+
+        self.rotation: list[str] = []
+        self.spotlight: set[str] = set()
+        self.setlists: dict[str, tuple[list[str], datetime]] = {}
+        self.expires_at: Optional[datetime] = None
+        self.has_state = False
+
+        self._rotation_set: set[str] = set()
+        self._build()
+
+    def _expire_at(self, date: Optional[datetime]) -> None:
+        if date is None or date <= self.built_at:
+            return
+        if self.expires_at is None or date < self.expires_at:
+            self.expires_at = date
+
+    def _build(self) -> None:
+        current_time = self.built_at
+        states = self.data.get('channels', {}).get('client-events', {}).get('states', [])
+
+        active_state = None
+        active_state_from = None
+        for state in states:
+            valid_from = parse_date(state['validFrom'])
+            if valid_from > current_time:
+                # a later state takes over at that point
+                self._expire_at(valid_from)
+                continue
+
+            if active_state_from is None or valid_from > active_state_from:
+                active_state = state
+                active_state_from = valid_from
+
+        if active_state is None:
+            return
+        self.has_state = True
+
+        setlists = {}
+        for event in active_state.get('activeEvents', []):
+            event_type = event.get('eventType', '')
+            active_since_date = parse_date(event.get('activeSince', ''))
+            active_until_date = parse_date(event.get('activeUntil', ''))
+
+            is_song = event_type.startswith('PilgrimSong.') or event_type.startswith('Sparks.Spotlight.')
+            is_setlist = event_type.startswith('Sparks_CuratedSetlist')
+            if not (is_song or is_setlist) or not active_since_date or not active_until_date:
+                continue
+
+            self._expire_at(active_since_date)
+            self._expire_at(active_until_date)
+            if not (active_since_date <= current_time <= active_until_date):
+                continue
+
+            if is_song:
+                shortname = event_type.replace('PilgrimSong.', '').replace('Sparks.Spotlight.', '')
+                if event_type.startswith('Sparks.Spotlight.'):
+                    self.spotlight.add(shortname)
+                if shortname not in self._rotation_set:
+                    self._rotation_set.add(shortname)
+                    self.rotation.append(shortname)
+
+            else:
+                # one malformed setlist event must not take rotation and spotlight down with it
+                try:
+                    setlist_meta = event_type.split(':')[0]
+                    setlist_class = setlist_meta.split(',')[0]
+                    setlist_idx = int(setlist_class.split('_')[-1])
+
+                    setlist_values = event_type.split(':')[1]
+                    setlist_songs: list[str] = setlist_values.split(',')
+                    normalised = [song.strip() for song in setlist_songs]
+                except (IndexError, ValueError) as e:
+                    logging.warning(f'Skipping malformed setlist event {event_type}', exc_info=e)
+                    continue
+
+                setlists[setlist_idx] = (normalised, active_until_date)
+
+        self.setlists = {f'setlist_{idx}': setlists[idx] for idx in sorted(setlists.keys())}
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and datetime.now(timezone.utc) >= self.expires_at
+
+    def in_rotation(self, shortname: str) -> bool:
+        return shortname in self._rotation_set
+
+    def in_spotlight(self, shortname: str) -> bool:
+        return shortname in self.spotlight
+
+    def rebuild(self) -> 'CalendarSnapshot':
+        return CalendarSnapshot(self.data, self.version, self.content_hash, self.fetched_at)
+
+    def __str__(self) -> str:
+        return f"CalendarSnapshot({self.version=}, rotation={len(self.rotation)}, spotlight={len(self.spotlight)}, setlists={len(self.setlists)}, {self.expires_at=})".replace('self.', '')
+
+class CalendarService:
+    def __init__(self, oauth_manager: OAuthManager, max_age: float = 600) -> None:
+        """Fetches the event calendar every few minutes for the whole bot.
+
+        Rotation, spotlight and setlist questions are answered from a `CalendarSnapshot`.
+        A snapshot past its `expires_at` is rebuilt from the calendar already fetched,
+        without a request; one older than `max_age` seconds is refetched, with
+        concurrent callers sharing that fetch.
+        """
+
+        self.oauth_manager = oauth_manager
+        self.max_age = max_age
+
+        self._snapshot: CalendarSnapshot = None
+        self._inflight: asyncio.Task = None
+        self._session: aiohttp.ClientSession = None
+
+        self.fetches = 0
+        self.rebuilds = 0
+        self.failed = 0
+
+        self.poll_task: tasks.Loop = self.poll_loop
+        TASK_REGISTRY.append(self.poll_loop)
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version if self._snapshot else 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
+        return self._session
+
+    async def close(self) -> None:
+        if self._session:
+            await self._session.close()
+
+    async def get(self) -> CalendarSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot.fetched_at > self.max_age:
+            return await self.refresh()
+
+        if snapshot.expired:
+            # something started or ended since, the data we have already says what
+            snapshot = snapshot.rebuild()
+            self._snapshot = snapshot
+            self.rebuilds += 1
+        return snapshot
+
+    async def refresh(self) -> CalendarSnapshot:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._fetch())
+
+        # shield so one impatient caller cannot cancel the fetch for everybody else
+        return await asyncio.shield(self._inflight)
+
+    async def _fetch(self) -> CalendarSnapshot:
+        logging.debug(f'[GET] {constants.FN_CALENDAR}')
+        token = await self.oauth_manager.get_token()
+        headers = {
+            'Authorization': token
+        }
+
+        self.fetches += 1
+        session = self._get_session()
+        async with session.get(constants.FN_CALENDAR, headers=headers) as response:
+            if response.status == 401 or response.status == 403:
+                self.failed += 1
+                await self.oauth_manager.token_rejected(token)
+                raise Exception('Please try again.')
+
+            if not response.ok:
+                self.failed += 1
+            response.raise_for_status()
+            body = await response.read()
+
+        fetched_at = time.time()
+        content_hash = hashlib.md5(body).hexdigest()
+
+        previous = self._snapshot
+        if previous is not None and previous.content_hash == content_hash:
+            previous.fetched_at = fetched_at
+            if previous.expired:
+                self._snapshot = previous.rebuild()
+                self.rebuilds += 1
+            return self._snapshot
+
+        version = (previous.version if previous else 0) + 1
+        snapshot = CalendarSnapshot(json.loads(body), version, content_hash, fetched_at)
+        if not snapshot.has_state:
+            logging.warning('No valid calendar states found')
+
+        self._snapshot = snapshot
+        return snapshot
+
+    @tasks.loop(minutes=5, name="Poll Event Calendar")
+    async def poll_loop(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.warning('Could not poll the event calendar', exc_info=e)
+
+    def __str__(self) -> str:
+        return f"CalendarService({self.version=}, {self.fetches=}, {self.rebuilds=}, {self.failed=})".replace('self.', '')
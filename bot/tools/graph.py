@@ -245,7 +245,7 @@ class GraphingFuncs():
                 ])
 
         plt.tight_layout()
-        plt.savefig(os.path.join(const.TEMP_FOLDER, path), dpi=dpi)
+        plt.savefig(path, dpi=dpi)
 
         plt.close()
 
@@ -369,7 +369,7 @@ class GraphingFuncs():
                     path_effects.Stroke(linewidth=3, foreground='white'), path_effects.Normal()
                 ])
 
-        plt.savefig(os.path.join(const.TEMP_FOLDER, spath), dpi=dpi)
+        plt.savefig(spath, dpi=dpi)
 
         plt.close()
 
@@ -469,7 +469,7 @@ class GraphingFuncs():
         # Display the graph
         # plt.tight_layout()
         plt.tight_layout()
-        plt.savefig(os.path.join(const.TEMP_FOLDER, path), dpi=dpi)
+        plt.savefig(path, dpi=dpi)
 
         plt.close()
 
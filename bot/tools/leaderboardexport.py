@@ -0,0 +1,104 @@
+import asyncio
+import csv
+import gzip
+import logging
+import time
+from typing import Optional
+
+from bot.tools.leaderboards import LeaderboardBoard, LeaderboardPage, LeaderboardService
+
+EXPORT_COLUMNS = [
+    'rank', 'team_id', 'team_score', 'percentile',
+    'account_id', 'display_name',
+    'score', 'accuracy', 'full_combo', 'stars', 'difficulty', 'instrument', 'season',
+    'session_time'
+]
+
+class LeaderboardExportResult:
+    def __init__(self, path: str, pages: int, rows: int, duration: float) -> None:
+        self.path = path
+        self.pages = pages
+        self.rows = rows
+        self.duration = duration
+
+    def __str__(self) -> str:
+        return f"LeaderboardExportResult({self.path=}, {self.pages=}, {self.rows=}, {self.duration=})".replace('self.', '')
+
+class LeaderboardExporter:
+    def __init__(self, leaderboard_service: LeaderboardService, concurrency: int = 8) -> None:
+        """Exports whole leaderboards to gzipped CSV files.
+
+        Pages are fetched `concurrency` at a time but written strictly in order, so at most
+        `concurrency` pages are held in memory no matter how big the board is. There is one
+        row per player, band boards have one row for each member of the team.
+        """
+
+        self.leaderboard_service = leaderboard_service
+        self.concurrency = concurrency
+
+    def player_rows(self, entry: dict, account_names: dict[str, Optional[str]]) -> list[list]:
+        best_session = next((session for session in entry['sessionHistory'] if session['trackedStats']['SCORE'] == entry['score']), None)
+        stats = best_session['trackedStats'] if best_session else {}
+
+        rows = []
+        for account_id in entry['teamAccountIds']:
+            player_id = None
+            for key in stats.keys():
+                if key.startswith('M_') and key.endswith(f'_ID_{account_id}'):
+                    player_id = int(key.split('_')[1])
+                    break
+
+            def stat(name: str):
+                return stats.get(f'M_{player_id}_{name}') if player_id is not None else None
+
+            full_combo = stat('FULL_COMBO')
+            rows.append([
+                entry['rank'], entry['teamId'], entry['score'], entry.get('percentile'),
+                account_id, account_names.get(account_id),
+                stat('SCORE'), stat('ACCURACY'), None if full_combo is None else full_combo == 1,
+                stat('STARS_EARNED'), stat('DIFFICULTY'), stat('INSTRUMENT'), stat('SEASON'),
+                best_session.get('endTime') if best_session else None
+            ])
+
+        return rows
+
+    async def export(self, board: LeaderboardBoard, path: str) -> LeaderboardExportResult:
+        start = time.perf_counter()
+
+        first = await self.leaderboard_service.fetch_uncached(board, 0)
+        total_pages = first.total_pages
+        logging.info(f'Exporting {total_pages} pages of {board} to {path}')
+
+        rows = 0
+        with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+
+            def write_page(result: LeaderboardPage) -> int:
+                written = 0
+                for entry in result.entries:
+                    for row in self.player_rows(entry, result.account_names):
+                        writer.writerow(row)
+                        written += 1
+                return written
+
+            rows += write_page(first)
+
+            window: list[asyncio.Task] = []
+            next_page = 1
+            try:
+                while next_page < total_pages or window:
+                    while next_page < total_pages and len(window) < self.concurrency:
+                        window.append(asyncio.create_task(self.leaderboard_service.fetch_uncached(board, next_page)))
+                        next_page += 1
+
+                    # the oldest page goes to disk first, the rest keep downloading meanwhile
+                    result = await window.pop(0)
+                    rows += write_page(result)
+            finally:
+                for task in window:
+                    task.cancel()
+
+        duration = time.perf_counter() - start
+        logging.info(f'Exported {rows} rows from {total_pages} pages of {board} in {duration:.1f}s')
+        return LeaderboardExportResult(path, total_pages, rows, duration)
@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import aiohttp
+
+from bot.tools.accountcache import AccountNameCache
+from bot.tools.oauthmanager import OAuthManager
+from bot.tools.metrics import HTTP_TRACE
+
+LEADERBOARD_API = 'https://events-public-service-live.ol.epicgames.com/api/v1/leaderboards/FNFestival'
+
+class LeaderboardBoard:
+    def __init__(self, event_id: str, window_id: str) -> None:
+        """Identifies one leaderboard in the events service.
+
+        Properties:
+            `event_id` The event, e.g `season015_{su}` or `alltime_{su}_Solo_Guitar`.
+            `window_id` The event window, e.g `{su}_Solo_Guitar`, `{su}_Band_Duets` or `alltime`.
+        """
+
+        self.event_id = event_id
+        self.window_id = window_id
+
+    @classmethod
+    def solo(cls, season_str: str, song_event_id: str, lb_code: str) -> 'LeaderboardBoard':
+        return cls(f'{season_str}_{song_event_id}', f'{song_event_id}_{lb_code}')
+
+    @classmethod
+    def band(cls, season_str: str, song_event_id: str, band_code: str) -> 'LeaderboardBoard':
+        return cls(f'{season_str}_{song_event_id}', f'{song_event_id}_Band_{band_code}')
+
+    @classmethod
+    def alltime(cls, song_event_id: str, lbtype_code: str) -> 'LeaderboardBoard':
+        return cls(f'alltime_{song_event_id}_{lbtype_code}', 'alltime')
+
+    def key(self) -> tuple[str, str]:
+        return (self.event_id, self.window_id)
+
+    def __str__(self) -> str:
+        return f"LeaderboardBoard({self.event_id=}, {self.window_id=})".replace('self.', '')
+
+class LeaderboardPage:
+    def __init__(self, page: int, data: dict, account_names: dict[str, Optional[str]], fetched_at: float) -> None:
+        self.page = page
+        self.data = data
+        self.account_names = account_names
+        self.fetched_at = fetched_at
+
+    @property
+    def total_pages(self) -> int:
+        return self.data['totalPages']
+
+    @property
+    def entries(self) -> list[dict]:
+        return self.data['entries']
+
+    def index_of(self, team_id: str) -> Optional[int]:
+        for i, entry in enumerate(self.entries):
+            if entry['teamId'] == team_id:
+                return i
+        return None
+
+class LeaderboardService:
+    def __init__(self, oauth_manager: OAuthManager, account_cache: AccountNameCache, ttl: float = 120, max_pages: int = 512) -> None:
+        """Shared, async access to the events service leaderboards.
+
+        Pages are cached for `ttl` seconds under (event id, window id, page), so every
+        view of the same board shares them. Requests for a page which is already being
+        fetched wait on that fetch instead of starting another one.
+        """
+
+        self.oauth_manager = oauth_manager
+        self.account_cache = account_cache
+        self.ttl = ttl
+        self.max_pages = max_pages
+
+        self._pages: OrderedDict[tuple[str, str, int], LeaderboardPage] = OrderedDict()
+        self._inflight: dict[tuple[str, str, int], asyncio.Task] = {}
+        # how many callers are awaiting each in flight fetch, so an abandoned one can be cancelled
+        self._waiters: dict[asyncio.Task, int] = {}
+        self._session: aiohttp.ClientSession = None
+
+    def get_url(self, board: LeaderboardBoard, page: int) -> str:
+        return f'{LEADERBOARD_API}/{board.event_id}/{board.window_id}/{self.oauth_manager.account_id}?page={page}&rank=0&teamAccountIds&showLiveSessions=false&appId=Fortnite'
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
+        return self._session
+
+    async def close(self) -> None:
+        for task in self._inflight.values():
+            task.cancel()
+        if self._session:
+            await self._session.close()
+
+    def cached_page(self, board: LeaderboardBoard, page: int) -> Optional[LeaderboardPage]:
+        key = (*board.key(), page)
+        cached = self._pages.get(key)
+        if cached is None:
+            return None
+
+        if time.monotonic() - cached.fetched_at > self.ttl:
+            del self._pages[key]
+            return None
+
+        self._pages.move_to_end(key)
+        return cached
+
+    async def get_page(self, board: LeaderboardBoard, page: int, prefetch: bool = True) -> LeaderboardPage:
+        cached = self.cached_page(board, page)
+        if cached is None:
+            cached = await self._fetch_shared(board, page)
+
+        if prefetch:
+            self.prefetch(board, page - 1, cached.total_pages)
+            self.prefetch(board, page + 1, cached.total_pages)
+
+        return cached
+
+    def prefetch(self, board: LeaderboardBoard, page: int, total_pages: int) -> None:
+        if page < 0 or page >= total_pages:
+            return
+
+        key = (*board.key(), page)
+        if key in self._inflight or self.cached_page(board, page) is not None:
+            return
+
+        self._start_background_fetch(board, page)
+
+    def _start_background_fetch(self, board: LeaderboardBoard, page: int) -> asyncio.Task:
+        # nobody may be awaiting it, so its errors are logged here
+        task = self._start_fetch(board, page)
+        def _log_fetch_error(t: asyncio.Task):
+            if t.cancelled():
+                return
+            if t.exception():
+                logging.warning(f'Could not fetch page {page} of {board} in the background', exc_info=t.exception())
+
+        task.add_done_callback(_log_fetch_error)
+        return task
+
+    async def _fetch_shared(self, board: LeaderboardBoard, page: int) -> LeaderboardPage:
+        key = (*board.key(), page)
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start_fetch(board, page)
+
+        self._add_waiter(task)
+        try:
+            # shield so one impatient caller cannot cancel the fetch for everybody else
+            return await asyncio.shield(task)
+        finally:
+            self._remove_waiter(task)
+
+    def _add_waiter(self, task: asyncio.Task) -> None:
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+
+    def _remove_waiter(self, task: asyncio.Task) -> None:
+        count = self._waiters.get(task, 0) - 1
+        if count > 0:
+            self._waiters[task] = count
+        else:
+            self._waiters.pop(task, None)
+
+    def _cancel_unwanted(self, board: LeaderboardBoard, tasks: dict[asyncio.Task, int]) -> None:
+        """Cancels the fetches in `tasks` (task -> page) which nobody is waiting for anymore."""
+
+        for task, page in tasks.items():
+            if task.done() or self._waiters.get(task, 0) > 0:
+                continue
+
+            key = (*board.key(), page)
+            # forget it right away, so a viewer arriving now starts a new fetch instead of joining this one
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+            task.cancel()
+
+    def _start_fetch(self, board: LeaderboardBoard, page: int) -> asyncio.Task:
+        key = (*board.key(), page)
+        task = asyncio.create_task(self._fetch_page(board, page))
+        self._inflight[key] = task
+
+        def _forget(t: asyncio.Task):
+            if self._inflight.get(key) is t:
+                del self._inflight[key]
+            self._waiters.pop(t, None)
+
+        task.add_done_callback(_forget)
+        return task
+
+    async def _fetch_page(self, board: LeaderboardBoard, page: int, store: bool = True) -> LeaderboardPage:
+        url = self.get_url(board, page)
+        logging.info(f'[GET] {url}')
+        token = await self.oauth_manager.get_token()
+        headers = {
+            'Authorization': token
+        }
+
+        session = self._get_session()
+        async with session.get(url, headers=headers) as response:
+            if response.status == 401 or response.status == 403:
+                await self.oauth_manager.token_rejected(token)
+                raise Exception('Please try again.')
+
+            response.raise_for_status()
+            data = await response.json()
+
+        account_ids = []
+        for entry in data['entries']:
+            account_ids.extend(entry['teamAccountIds'])
+
+        account_names = await self.account_cache.get_names(account_ids)
+
+        result = LeaderboardPage(page, data, account_names, time.monotonic())
+        if store:
+            self._store(board, page, result)
+        return result
+
+    async def fetch_uncached(self, board: LeaderboardBoard, page: int) -> LeaderboardPage:
+        """Fetches a page without putting it in the page cache, for bulk reads like exports."""
+
+        cached = self.cached_page(board, page)
+        if cached is not None:
+            return cached
+        return await self._fetch_page(board, page, store=False)
+
+    async def lookup_team_rank(self, board: LeaderboardBoard, team_id: str) -> Optional[int]:
+        # asks the events service for the team directly, None means we have to scan instead
+        url = f'{LEADERBOARD_API}/{board.event_id}/{board.window_id}?accountId={self.oauth_manager.account_id}'
+        logging.info(f'[POST] {url} (team lookup)')
+        token = await self.oauth_manager.get_token()
+        headers = {
+            'Authorization': token
+        }
+
+        try:
+            session = self._get_session()
+            async with session.post(url, headers=headers, json={'teams': [[team_id]]}) as response:
+                if not response.ok:
+                    logging.debug(f'Team lookup returned {response.status}, falling back to scanning')
+                    return None
+                data = await response.json()
+        except Exception as e:
+            logging.debug('Team lookup failed, falling back to scanning', exc_info=e)
+            return None
+
+        entries = data.get('entries', []) if isinstance(data, dict) else data
+        for entry in entries:
+            if entry.get('teamId') == team_id and entry.get('rank'):
+                return int(entry['rank'])
+        return None
+
+    async def find_team(self, board: LeaderboardBoard, team_id: str, concurrency: int = 8) -> Optional[tuple[int, int]]:
+        """Finds a team on a board, returns (API page, index in page) or None.
+
+        Uses the direct team lookup when the service answers it, otherwise scans the
+        pages in waves of `concurrency` requests, stopping at the first hit. Fetches this
+        scan started are cancelled on a hit unless a viewer has attached to them since,
+        and pages which fail to load are skipped.
+        """
+
+        rank = await self.lookup_team_rank(board, team_id)
+        if rank is not None:
+            result = await self.get_page(board, (rank - 1) // 100, prefetch=False)
+            index = result.index_of(team_id)
+            if index is not None:
+                return (result.page, index)
+
+        first = await self.get_page(board, 0, prefetch=False)
+        index = first.index_of(team_id)
+        if index is not None:
+            return (0, index)
+
+        remaining = list(range(1, first.total_pages))
+        for i in range(0, len(remaining), concurrency):
+            wave = remaining[i:i + concurrency]
+            # task -> page, for everything this wave waits on and for what it started itself
+            waiting: dict[asyncio.Task, int] = {}
+            started: dict[asyncio.Task, int] = {}
+
+            for page in wave:
+                cached = self.cached_page(board, page)
+                if cached is not None:
+                    index = cached.index_of(team_id)
+                    if index is not None:
+                        return (page, index)
+                    continue
+
+                task = self._inflight.get((*board.key(), page))
+                if task is None:
+                    task = self._start_background_fetch(board, page)
+                    started[task] = page
+                self._add_waiter(task)
+                waiting[task] = page
+
+            try:
+                pending = set(waiting.keys())
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.cancelled() or task.exception() is not None:
+                            # one rate limited or failing page should not fail the whole search
+                            logging.warning(f'Skipping page {waiting[task]} of {board} while looking for {team_id}: {"cancelled" if task.cancelled() else task.exception()}')
+                            continue
+
+                        result: LeaderboardPage = task.result()
+                        index = result.index_of(team_id)
+                        if index is not None:
+                            return (result.page, index)
+            finally:
+                for task in waiting:
+                    self._remove_waiter(task)
+                # fetches joined from _inflight belong to someone else, ours go if nobody else wants them
+                self._cancel_unwanted(board, started)
+
+        return None
+
+    def _store(self, board: LeaderboardBoard, page: int, result: LeaderboardPage) -> None:
+        key = (*board.key(), page)
+        self._pages[key] = result
+        self._pages.move_to_end(key)
+
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
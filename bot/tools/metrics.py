@@ -0,0 +1,296 @@
+import asyncio
+import bisect
+import contextlib
+import functools
+import logging
+import time
+from typing import Callable, Iterator
+
+import aiohttp
+from aiohttp import web
+import discord.ext.tasks as tasks
+
+from bot.tools.taskregistry import TASK_REGISTRY
+
+# seconds, from a cached reply to a slow render
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        """One metric family, with a value per combination of label values.
+
+        Properties:
+            `name` Metric name, e.g. `festivaltracker_commands_total`.
+            `documentation` The HELP line.
+            `label_names` Names of the labels every value is recorded with.
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if set(labels.keys()) != set(self.label_names):
+            raise ValueError(f'{self.name} takes the labels {self.label_names}, got {tuple(labels.keys())}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def __str__(self) -> str:
+        return f"{type(self).__name__}({self.name=}, {self.label_names=})".replace('self.', '')
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels) -> None:
+        """For counters mirrored from an object which already counts, e.g. cache hits."""
+
+        self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self) -> list[str]:
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}' for key, value in list(self._values.items())]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (count per bucket, the last one being +Inf; sum; count)
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._values[key] = state
+
+        # counted in the first bucket it fits in, made cumulative when rendering
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {count}')
+        return lines
+
+class TimedLock:
+    def __init__(self, histogram: Histogram, **labels) -> None:
+        """An `asyncio.Lock` which records how long every `async with` waited for it."""
+
+        self.histogram = histogram
+        self.labels = labels
+        self._lock = asyncio.Lock()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def __aenter__(self) -> None:
+        start = time.perf_counter()
+        await self._lock.acquire()
+        self.histogram.observe(time.perf_counter() - start, **self.labels)
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._lock.release()
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """Every metric of the bot, served in the Prometheus text format.
+
+        Metrics are recorded where things happen. Numbers other objects already keep
+        (cache hits, pool queue depth) are copied in by collectors right before each
+        scrape instead, so those objects do not need to know about metrics at all.
+        """
+
+        self.metrics: dict[str, Metric] = {}
+        self.collectors: list[Callable[[], None]] = []
+
+        self._runner: web.AppRunner = None
+
+        self.loop_lag = self.histogram('festivaltracker_event_loop_lag_seconds', 'How late the event loop woke up a sleeping coroutine', buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+        self.task_duration = self.histogram('festivaltracker_task_duration_seconds', 'Duration of one run of a background task loop', ('task', 'outcome'), buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+        self.http_duration = self.histogram('festivaltracker_http_request_duration_seconds', 'Outbound HTTP requests made with aiohttp', ('host', 'method', 'status'))
+
+        self.lag_task: tasks.Loop = self.lag_loop
+        TASK_REGISTRY.append(self.lag_loop)
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                raise ValueError(f'{metric.name} is already registered as {existing}')
+            return existing
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                logging.warning(f'Metrics collector {collect.__name__} failed', exc_info=e)
+
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _timed(self, coro: Callable, name: str) -> Callable:
+        @functools.wraps(coro)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                return await coro(*args, **kwargs)
+            except BaseException:
+                outcome = 'error'
+                raise
+            finally:
+                self.task_duration.observe(time.perf_counter() - start, task=name, outcome=outcome)
+
+        timed.metrics_wrapped = True
+        return timed
+
+    def instrument_tasks(self, loops: list[tasks.Loop]) -> None:
+        """Times every run of each loop, by wrapping the coroutine it calls."""
+
+        for loop in loops:
+            if not getattr(loop.coro, 'metrics_wrapped', False):
+                loop.coro = self._timed(loop.coro, loop._name)
+
+    def http_trace_config(self) -> aiohttp.TraceConfig:
+        """Pass to `aiohttp.ClientSession(trace_configs=[...])` to time its requests."""
+
+        async def on_request_start(session, context, params: aiohttp.TraceRequestStartParams):
+            context.started_at = time.perf_counter()
+
+        async def on_request_end(session, context, params: aiohttp.TraceRequestEndParams):
+            self.http_duration.observe(time.perf_counter() - context.started_at, host=params.url.host or '', method=params.method, status=str(params.response.status))
+
+        async def on_request_exception(session, context, params: aiohttp.TraceRequestExceptionParams):
+            self.http_duration.observe(time.perf_counter() - context.started_at, host=params.url.host or '', method=params.method, status='error')
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    @tasks.loop(seconds=1, name="Measure Event Loop Lag")
+    async def lag_loop(self):
+        interval = 0.25
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        self.loop_lag.observe(max(0.0, time.perf_counter() - start - interval))
+
+    @property
+    def serving(self) -> bool:
+        return self._runner is not None
+
+    async def serve(self, host: str, port: int) -> None:
+        """Serves `/metrics` on `host:port`, meant to be scraped from the same machine."""
+
+        async def handle_metrics(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle_metrics)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            await runner.cleanup()
+            logging.warning(f'Could not serve metrics on {host}:{port}', exc_info=e)
+            return
+
+        self._runner = runner
+        logging.info(f'Serving metrics on http://{host}:{port}/metrics')
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def __str__(self) -> str:
+        return f"MetricsRegistry(metrics={len(self.metrics)}, collectors={len(self.collectors)}, serving={self.serving})"
+
+# recorded into from all over the bot, so it lives at module level like TASK_REGISTRY
+METRICS = MetricsRegistry()
+HTTP_TRACE = METRICS.http_trace_config()
+
+DB_LOCK_WAIT = METRICS.histogram('festivaltracker_db_lock_wait_seconds', 'Time spent waiting for the database lock', buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+NOTIFICATIONS = METRICS.counter('festivaltracker_notifications_total', 'Notifications sent to subscribed channels and users', ('event', 'outcome'))
@@ -1,4 +1,5 @@
 import base64
+import json
 import logging
 import os
 import subprocess
@@ -8,9 +9,29 @@ import mido
 import requests
 
 from bot import constants
+from bot.tools.cachequota import CACHE_QUOTAS
+from bot.tools.metrics import HTTP_TRACE
 
 import Crypto.Cipher.AES as AES
 
+def referenced_charts() -> set[str]:
+    """File names in the MIDI cache of the charts currently in the game, which are never evicted."""
+    try:
+        with open(constants.SONGS_FILE, 'r', encoding='utf-8') as f:
+            tracks = json.load(f)
+    except Exception as e:
+        # without the list nothing can be told apart, keep everything
+        logging.warning('Could not load the known tracks for the MIDI cache', exc_info=e)
+        return set(os.listdir(constants.MIDI_FOLDER))
+
+    names = set()
+    for track in tracks:
+        fname = track['track'].get('mu', '').split('/')[-1].split('.')[0]
+        names.add(f'{fname}.mid')
+        names.add(f'{fname}.dat')
+    return names
+
+CACHE_QUOTAS.register('midi', constants.MIDI_FOLDER, 1024 * 1024 * 1024, keep=referenced_charts)
 
 class MidiArchiveTools:
     def __init__(self) -> None:
@@ -40,6 +61,7 @@ class MidiArchiveTools:
         local_enc_path = os.path.join(constants.MIDI_FOLDER, encname)
 
         if os.path.exists(local_path):
+            CACHE_QUOTAS.record('midi', midiname, hit=True)
             
             if log:
                 logging.info(f"File {chart_url} already exists, using local copy.")
@@ -47,6 +69,7 @@ class MidiArchiveTools:
             return local_path
         
         elif os.path.exists(local_enc_path):
+            CACHE_QUOTAS.record('midi', encname, hit=True)
 
             if log:
                 logging.info(f"File [encrypted] {chart_url} already exists, using local copy.")
@@ -54,8 +77,9 @@ class MidiArchiveTools:
             open(local_path, 'wb').write(self.decrypt_bytes(open(local_enc_path, 'rb').read()))
             return local_path
         else:
+            CACHE_QUOTAS.record('midi', encname, hit=False)
             logging.debug(f'[GET] {chart_url}')
-            session = aiohttp.ClientSession()
+            session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
             response = await session.get(chart_url)
             response.raise_for_status()
 
@@ -77,7 +101,7 @@ class MidiArchiveTools:
             await session.close()
             return local_enc_path
         
-    def modify_midi_file(self, midi_file: str, instrument: constants.Instrument, session_hash: str, shortname: str) -> str:
+    def modify_midi_file(self, midi_file: str, instrument: constants.Instrument, session_hash: str, shortname: str, output_folder: str = constants.MIDI_FOLDER) -> str:
         mid = mido.MidiFile(midi_file)
         track_names_to_delete = []
         track_names_to_rename = {}
@@ -99,7 +123,6 @@ class MidiArchiveTools:
 
         mid.tracks = new_tracks
 
-        output_folder = constants.MIDI_FOLDER
         midi_file_name = os.path.basename(midi_file)
         modified_midi_file_name = f"{shortname}_{session_hash}.mid"
         modified_midi_file = os.path.join(output_folder, modified_midi_file_name)
@@ -1,7 +1,10 @@
+import asyncio
 import base64
 import datetime
 import json
+import time
 from typing import List
+import aiohttp
 import discord.ext.tasks as tasks
 import discord
 import requests
@@ -10,6 +13,10 @@ from bot.tools.taskregistry import register_task
 from discord.ext import commands
 import logging
 from bot.tools.taskregistry import TASK_REGISTRY
+from bot.tools.metrics import HTTP_TRACE
+
+EPIC_TOKEN_URL = 'https://account-public-service-prod.ol.epicgames.com/account/api/oauth/token'
+EPIC_VERIFY_URL = 'https://account-public-service-prod.ol.epicgames.com/account/api/oauth/verify'
 
 def b64_decode_padded(s: str) -> bytes:
     """Decodes a base64 string, adding padding if necessary."""
@@ -28,16 +35,32 @@ class EpicAccountPlatform:
 
 # this is th clsas that makes sure the device auth does not die
 class OAuthManager:
-    def __init__(self, bot: commands.Bot, device_id: str, account_id: str, device_secret: str):
+    def __init__(self, bot: commands.Bot, device_id: str, account_id: str, device_secret: str, refresh_ahead: float = 600):
+        """Keeps the device auth session alive without ever blocking a request on it.
+
+        The token expiry is read from the JWT once, when a token is stored. A loop
+        refreshes the session `refresh_ahead` seconds before it expires, and `get_token`
+        only waits when the token is missing or about to expire anyway. Every refresh,
+        whoever asked for it, goes through one in flight task which concurrent callers wait on.
+        """
+
         self.device_id = device_id
         self.account_id = account_id
         self.device_secret = device_secret
+        self.refresh_ahead = refresh_ahead
         self._access_token:str = None
         self._refresh_token:str = None
+        self._expires_at: float = 0
+        self._refresh_expires_at: float = 0
         self._session_data = None
+        self._inflight: asyncio.Task = None
+        self._session: aiohttp.ClientSession = None
         self.refresh_task: tasks.Loop = self.refresh_session
         self.bot = bot
 
+        self.refreshes = 0
+        self.failed_refreshes = 0
+
         self._spotify_session_data = None
         self._spotify_access_token:str = None
         self.epic_client_token = base64.b64encode(f'{constants.EPIC_DEVICE_AUTH_CLIENT_ID}:{constants.EPIC_DEVICE_AUTH_CLIENT_SECRET}'.encode('utf-8')).decode('utf-8')
@@ -46,27 +69,101 @@ class OAuthManager:
         TASK_REGISTRY.append(self.refresh_spotify_session)
         TASK_REGISTRY.append(self.verify_session)
 
-    def _create_token(self):
-        logging.info('[POST] https://account-public-service-prod.ol.epicgames.com/account/api/oauth/token (create)')
-        url = 'https://account-public-service-prod.ol.epicgames.com/account/api/oauth/token'
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
+        return self._session
+
+    def _store_session(self, session_data: dict):
+        self._session_data = session_data
+        self._access_token = session_data['access_token']
+        self._refresh_token = session_data.get('refresh_token')
+
+        # TS PMO
+        payload = json.loads(b64_decode_padded(self._access_token.split('.')[1]))
+        self._expires_at = payload['exp']
+
+        refresh_expires_at = session_data.get('refresh_expires_at')
+        if refresh_expires_at:
+            self._refresh_expires_at = datetime.datetime.fromisoformat(refresh_expires_at.replace('Z', '+00:00')).timestamp()
+        else:
+            self._refresh_expires_at = 0
+
+    async def _request_token(self, data: dict) -> dict:
         headers = {
             'Authorization': f'Basic {self.epic_client_token}',
             'Content-Type': 'application/x-www-form-urlencoded'
         }
-        data = {
+        session = self._get_session()
+        async with session.post(EPIC_TOKEN_URL, headers=headers, data=data) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _create_token(self):
+        logging.info(f'[POST] {EPIC_TOKEN_URL} (create)')
+        session_data = await self._request_token({
             'grant_type': 'device_auth',
             'account_id': self.account_id,
             'device_id': self.device_id,
             'secret': self.device_secret,
             'token_type': 'eg1'
-        }
-        response = requests.post(url, headers=headers, data=data)
-        # print(response.json())
-        response.raise_for_status()
-        self._session_data = response.json()
-        self._access_token = self._session_data['access_token']
-        self._refresh_token = self._session_data['refresh_token']
+        })
+        self._store_session(session_data)
+
+    async def _refresh_token_grant(self):
+        logging.info(f'[POST] {EPIC_TOKEN_URL} (refresh)')
+        session_data = await self._request_token({
+            'grant_type': 'refresh_token',
+            'refresh_token': self._refresh_token
+        })
+        self._store_session(session_data)
 
+    async def _refresh(self):
+        self.refreshes += 1
+        try:
+            if self._refresh_token and self._refresh_expires_at - time.time() > 60:
+                try:
+                    await self._refresh_token_grant()
+                    return
+                except Exception as e:
+                    logging.warning('Could not refresh the device auth session, creating a new one', exc_info=e)
+
+            await self._create_token()
+        except Exception:
+            self.failed_refreshes += 1
+            raise
+
+    async def refresh(self):
+        """Refreshes the session, or waits for the refresh which is already running."""
+
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._refresh())
+
+        # shield so one impatient caller cannot cancel the refresh for everybody else
+        await asyncio.shield(self._inflight)
+
+    @property
+    def expires_in(self) -> float:
+        return self._expires_at - time.time()
+
+    async def get_token(self) -> str:
+        """The Authorization header value, only waits if the token is missing or (about to be) expired."""
+
+        if self._access_token is None or self.expires_in < 30:
+            await self.refresh()
+
+        return f'Bearer {self._access_token}'
+
+    async def token_rejected(self, token: str):
+        """Call when Epic answered 401/403 to `token`, as returned by `get_token`.
+
+        Only the first caller for a token refreshes, everybody else who was using the same
+        token waits on that refresh or finds a new token already in place.
+        """
+
+        if token == f'Bearer {self._access_token}':
+            self._expires_at = 0
+        await self.get_token()
 
     def _create_spotify_token(self):
         url = "https://accounts.spotify.com/api/token"
@@ -86,54 +183,38 @@ class OAuthManager:
         self._spotify_session_data = data
         self._spotify_access_token = self._spotify_session_data['access_token']
 
-    async def create_session(self, skip_create: bool = False):
+    async def create_session(self):
         try:
-            self._create_token()
+            await self.refresh()
 
             logging.info(f'Logged into EOS as {self.account_id}')
 
             await constants.msg_log(self.bot, f'Device auth session started for {self._session_data['displayName']}')
 
-            if not skip_create:
-                try:
-                    self.refresh_task.start()
-                    self.verify_session.start()
-                except RuntimeError as e:
-                    logging.debug(f'The task was already running...', exc_info=e)
+            if not self.refresh_session.is_running():
+                self.refresh_session.start()
+            if not self.verify_session.is_running():
+                self.verify_session.start()
 
-            self._create_spotify_token()
+            await asyncio.to_thread(self._create_spotify_token)
             logging.info('Spotify token created successfully.')
             await constants.msg_log(self.bot, f'Spotify session started successfully.')
 
-            if not skip_create:
-                try:
-                    self.refresh_spotify_session.start()
-                except RuntimeError as e:
-                    logging.debug(f'The task was already running...', exc_info=e)
+            if not self.refresh_spotify_session.is_running():
+                self.refresh_spotify_session.start()
             
         except Exception as e:
             logging.critical(f'Cannot create token:', exc_info=e)
             await constants.msg_log(self.bot, f'Device auth session cannot be started because of {e}')
 
-    @tasks.loop(seconds=6900, name="Refresh Epic Session")
+    @tasks.loop(seconds=60, name="Refresh Epic Session")
     async def refresh_session(self):
-        logging.info('[POST] https://account-public-service-prod.ol.epicgames.com/account/api/oauth/token (refresh)')
-        try:
-            url = 'https://account-public-service-prod.ol.epicgames.com/account/api/oauth/token'
-            headers = {
-                'Authorization': f'Basic {self.epic_client_token}',
-                'Content-Type': 'application/x-www-form-urlencoded'
-            }
-            data = {
-                'grant_type': 'refresh_token',
-                'refresh_token': self._refresh_token
-            }
-            response = requests.post(url, headers=headers, data=data)
-            response.raise_for_status()
-            self._session_data = response.json()
-            self._access_token = self._session_data['access_token']
-            self._refresh_token = self._session_data['refresh_token']
+        # the expiry is already known, this only costs a request when it is close
+        if self._access_token is not None and self.expires_in > self.refresh_ahead:
+            return
 
+        try:
+            await self.refresh()
             await constants.msg_log(self.bot, f'Device auth session refreshed for {self._session_data['displayName']}')
         except Exception as e:
             logging.critical(f'Device auth session cannot be refreshed because of {e}')
@@ -142,53 +223,36 @@ class OAuthManager:
     @tasks.loop(seconds=3500, name="Refresh Spotify Session")
     async def refresh_spotify_session(self):
         try:
-            self._create_spotify_token()
+            await asyncio.to_thread(self._create_spotify_token)
         except Exception as e:
             logging.critical(f'Spotify token cannot be refreshed because of {e}')
             await constants.msg_log(self.bot, f'Spotify token cannot be refreshed because of {e}')
 
-    @tasks.loop(seconds=60, name="Verify Epic Session")
+    @tasks.loop(minutes=5, name="Verify Epic Session")
     async def verify_session(self):
-        logging.info('[GET] https://account-public-service-prod.ol.epicgames.com/account/api/oauth/verify (verify)')
-        url = 'https://account-public-service-prod.ol.epicgames.com/account/api/oauth/verify'
-        headers = {
-            'Authorization': self.session_token
-        }
-        response = requests.get(url, headers=headers)
-        # response.raise_for_status()
-        if not response.ok:
-            await constants.msg_log(self.bot, f'Device auth session ended for {self._session_data['displayName']}')
-            await self.create_session(skip_create=True)
-
-    @property
-    def session_token(self) -> str:
-        if self._access_token == None:
-            raise Exception("Festival Tracker is not ready yet! Please try again in a few moments.")
-
-        payload = json.loads(b64_decode_padded(self._access_token.split('.')[1]))
-        # TS PMO
-        ts_exp = payload['exp']
-        # ts_exp = 0
-        date_exp = datetime.datetime.fromtimestamp(ts_exp, tz=datetime.timezone.utc)
-
-        if datetime.datetime.now(tz=datetime.timezone.utc) > date_exp:
-            self._create_token()
-            logging.critical('Token forcefully regenerated as it was detected to be expired!')
-            # why arent you running
-            if not self.refresh_session.is_running():
-                logging.critical('Token refresh is not running')
-                self.refresh_session.start()
-            if not self.verify_session.is_running():
-                logging.critical('Token verify is not running')
-                self.verify_session.start()
+        # catches sessions killed on Epic's side, expiry is handled by refresh_session
+        logging.info(f'[GET] {EPIC_VERIFY_URL} (verify)')
+        token = await self.get_token()
+        try:
+            session = self._get_session()
+            async with session.get(EPIC_VERIFY_URL, headers={'Authorization': token}) as response:
+                verified = response.ok
+        except Exception as e:
+            logging.warning('Could not verify the device auth session', exc_info=e)
+            return
 
-        # return 'lol' # testing only
-    
-        return f'Bearer {self._access_token}'
+        if not verified:
+            await constants.msg_log(self.bot, f'Device auth session ended for {self._session_data['displayName']}')
+            try:
+                await self.token_rejected(token)
+            except Exception as e:
+                logging.critical(f'Device auth session cannot be started because of {e}')
+                await constants.msg_log(self.bot, f'Device auth session cannot be started because of {e}')
     
-    def get_accounts(self, account_ids: List[str]) -> List[EpicAccount]:
+    async def get_accounts(self, account_ids: List[str]) -> List[EpicAccount]:
         logging.info(f'[get accounts] {len(account_ids)} account ids given')
 
+        session = self._get_session()
         accounts = []
         for i in range(0, len(account_ids), 100):
             batch_ids = account_ids[i:i + 100]
@@ -197,37 +261,40 @@ class OAuthManager:
 
             logging.info(f'[GET] {url}')
             headers = {
-                'Authorization': self.session_token
+                'Authorization': await self.get_token()
             }
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            async with session.get(url, headers=headers) as response:
+                response.raise_for_status()
+                data = await response.json()
             
-            accounts.extend([EpicAccount(account['id'], account.get('displayName', None)) for account in response.json()])
+            accounts.extend([EpicAccount(account['id'], account.get('displayName', None)) for account in data])
         
         return accounts
     
-    def get_account_from_display_name(self, display_name: str) -> EpicAccount:
+    async def get_account_from_display_name(self, display_name: str) -> EpicAccount:
         url = f'https://account-public-service-prod.ol.epicgames.com/account/api/public/account/displayName/{display_name}'
         logging.info(f'[GET] {url}')
         headers = {
-            'Authorization': self.session_token
+            'Authorization': await self.get_token()
         }
 
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        account = response.json()
+        session = self._get_session()
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            account = await response.json()
         return EpicAccount(account['id'], account['displayName'])
     
-    def search_users(self, username_prefix: str) -> EpicAccountPlatform:
+    async def search_users(self, username_prefix: str) -> EpicAccountPlatform:
         url = f'https://user-search-service-prod.ol.epicgames.com/api/v1/search/{self.account_id}?platform=epic&prefix={username_prefix}'
         logging.info(f'[GET] {url}')
         headers = {
-            'Authorization': self.session_token
+            'Authorization': await self.get_token()
         }
 
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        matches = response.json()
+        session = self._get_session()
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            matches = await response.json()
         print(matches)
         
         matchlist = []
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Optional
+
+import aiohttp
+from PIL import Image
+
+import bot.constants as constants
+from bot.tools.cachequota import CACHE_QUOTAS
+from bot.tools.metrics import HTTP_TRACE
+
+def temp_path_next_to(path: str) -> str:
+    """A new, unique temp file in the folder of `path`, to write to and then `os.replace` over it.
+
+    Unique so writers racing on the same `path` never replace each other's half written file,
+    and ending in `.tmp` so eviction leaves it alone.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path) or '.')
+    os.close(fd)
+    return tmp_path
+
+def replace_from_temp(tmp_path: str, path: str) -> None:
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+class FileCache:
+    def __init__(self, folder: str, max_bytes: int, name: str = None) -> None:
+        """A folder of cached files, evicting the least recently used ones past `max_bytes`.
+
+        Properties:
+            `folder` Where the files are kept.
+            `max_bytes` Total size allowed for the folder.
+            `name` Name of the cache in the quota stats, the folder by default.
+        """
+
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.name = name or folder
+
+        os.makedirs(self.folder, exist_ok=True)
+        CACHE_QUOTAS.register(self.name, self.folder, self.max_bytes)
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    def get(self, name: str) -> Optional[str]:
+        path = self.path_for(name)
+        if not os.path.exists(path):
+            CACHE_QUOTAS.record(self.name, name, hit=False)
+            return None
+
+        CACHE_QUOTAS.record(self.name, name, hit=True)
+        # mtime doubles as the last use time, atime is unreliable on most mounts
+        os.utime(path, None)
+        return path
+
+    def put(self, name: str, data: bytes) -> str:
+        path = self.path_for(name)
+        tmp_path = temp_path_next_to(path)
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        replace_from_temp(tmp_path, path)
+
+        self.evict()
+        return path
+
+    def stored(self, name: str) -> str:
+        """Call after writing `name` directly, so the cache can account for it."""
+
+        self.evict()
+        return self.path_for(name)
+
+    def evict(self) -> None:
+        files = []
+        total = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+        logging.info(f'Evicted files from {self.folder}, {total} bytes remain')
+
+class AlbumArtCache(FileCache):
+    def __init__(self, folder: str = f'{constants.CACHE_FOLDER}album_art/', max_bytes: int = 128 * 1024 * 1024) -> None:
+        """Album art by URL, as downloaded and as square thumbnails of any size.
+
+        Downloads of the same URL which overlap share one request, and `fetch_many`
+        downloads a whole list at once.
+        """
+
+        super().__init__(folder, max_bytes, name='album_art')
+
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._session: aiohttp.ClientSession = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
+        return self._session
+
+    def name_for(self, url: str) -> str:
+        ext = os.path.splitext(url.split('?')[0])[1] or '.jpg'
+        return hashlib.sha1(url.encode('utf-8')).hexdigest() + ext
+
+    def thumbnail_name_for(self, url: str, size: int) -> str:
+        return f'{hashlib.sha1(url.encode("utf-8")).hexdigest()}_{size}.png'
+
+    async def fetch(self, url: str) -> str:
+        name = self.name_for(url)
+        path = self.get(name)
+        if path:
+            return path
+
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.create_task(self._download(url, name))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+
+        # shield so one impatient caller cannot cancel the download for everybody else
+        return await asyncio.shield(task)
+
+    async def _download(self, url: str, name: str) -> str:
+        logging.info(f'[GET] {url}')
+        session = self._get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            data = await response.read()
+
+        return await asyncio.to_thread(self.put, name, data)
+
+    async def fetch_many(self, urls: list[str]) -> list[str]:
+        return await asyncio.gather(*[self.fetch(url) for url in urls])
+
+    async def thumbnail(self, url: str, size: int = 512) -> str:
+        """Path to a `size` x `size` RGBA PNG of the art, resized once and kept."""
+
+        name = self.thumbnail_name_for(url, size)
+        path = self.get(name)
+        if path:
+            return path
+
+        # two setlists sharing a cover resize it once
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.create_task(self._make_thumbnail(url, name, size))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+
+        return await asyncio.shield(task)
+
+    async def _make_thumbnail(self, url: str, name: str, size: int) -> str:
+        original = await self.fetch(url)
+        await asyncio.to_thread(make_thumbnail, original, self.path_for(name), size)
+        return self.stored(name)
+
+    async def thumbnails(self, urls: list[str], size: int = 512) -> list[str]:
+        return await asyncio.gather(*[self.thumbnail(url, size) for url in urls])
+
+def save_image(image: Image.Image, destination: str) -> None:
+    """Saves `image` as a PNG without anyone ever seeing half of it at `destination`."""
+
+    tmp_path = temp_path_next_to(destination)
+    try:
+        image.save(tmp_path, format="PNG")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    replace_from_temp(tmp_path, destination)
+
+def make_thumbnail(source: str, destination: str, size: int) -> None:
+    with Image.open(source) as img:
+        save_image(img.convert("RGBA").resize((size, size)), destination)
+
+# album art is shared by every command which draws it
+ALBUM_ART_CACHE = AlbumArtCache()
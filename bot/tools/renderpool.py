@@ -0,0 +1,126 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from typing import Any, Callable
+
+def _warm_worker():
+    # pay for matplotlib, the font registration in graph.py and PIL once per worker instead of per job
+    # an initializer which raises breaks the whole pool, so this is only ever best effort
+    try:
+        import bot.tools.graph
+        import bot.commands.lyrics
+        from PIL import ImageFont
+        ImageFont.truetype('bot/data/Fonts/InterTight-Bold.ttf', 40)
+    except Exception as e:
+        logging.warning('Could not warm up render worker', exc_info=e)
+
+def _ping():
+    return None
+
+class RenderTimeout(Exception):
+    pass
+
+class RenderPool:
+    def __init__(self, workers: int = None, timeout: float = 60) -> None:
+        """Runs CPU heavy image renders (PIL, matplotlib) in worker processes, off the event loop.
+
+        Jobs must be module level functions (or methods of picklable objects) and should take
+        and return small values, like paths or bytes, rather than images.
+
+        Properties:
+            `workers` Number of worker processes.
+            `timeout` Default seconds a job may take before the caller gives up on it.
+            `queue_depth` Jobs submitted which have not finished yet.
+        """
+
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.timeout = timeout
+        self._executor: concurrent.futures.ProcessPoolExecutor = None
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.total_seconds = 0.0
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+
+        # spawn, forking a process with a running event loop and threads is asking for trouble
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_worker
+        )
+        logging.info(f'Render pool started with {self.workers} workers')
+
+    async def warm(self) -> None:
+        """Starts every worker now, so the first renders do not wait for processes to spawn and import."""
+
+        if self._executor is not None:
+            return
+
+        self.start()
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            # the executor spawns a worker per job while none is idle, so this brings up all of them
+            await asyncio.gather(*[loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)])
+        except Exception as e:
+            logging.warning('Could not warm up the render pool', exc_info=e)
+            return
+
+        logging.info(f'Render pool warmed up in {time.perf_counter() - start:.1f}s')
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, func: Callable, *args, timeout: float = None, **kwargs) -> Any:
+        self.start()
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+        self.submitted += 1
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        start = time.perf_counter()
+
+        try:
+            result = await asyncio.wait_for(future, timeout or self.timeout)
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            # the worker still finishes the job, the result is just thrown away
+            self.timed_out += 1
+            raise RenderTimeout(f'Rendering took longer than {timeout or self.timeout}s')
+        except concurrent.futures.process.BrokenProcessPool:
+            # a worker died (e.g. out of memory), start fresh workers for the next job
+            self.failed += 1
+            self._executor = None
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.queue_depth -= 1
+            self.total_seconds += time.perf_counter() - start
+
+    @property
+    def average_seconds(self) -> float:
+        finished = self.completed + self.failed + self.timed_out
+        return self.total_seconds / finished if finished > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"RenderPool({self.workers=}, {self.queue_depth=}, {self.submitted=}, {self.completed=}, {self.failed=}, {self.timed_out=})".replace('self.', '')
+
+RENDER_POOL = RenderPool()
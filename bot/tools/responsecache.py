@@ -0,0 +1,316 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import aiosqlite
+import discord.ext.tasks as tasks
+
+import bot.constants as constants
+from bot.tools.taskregistry import TASK_REGISTRY
+
+RESPONSE_CACHE_FILE = f'{constants.CACHE_FOLDER}ResponseCache.db'
+
+class RateLimited(Exception):
+    def __init__(self, upstream: str, retry_after: float) -> None:
+        super().__init__(f'{upstream} is rate limited for another {retry_after:.1f}s')
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, capacity: int) -> None:
+        """Requests allowed to one upstream, shared by the whole bot.
+
+        Holds up to `capacity` tokens, refilled at `rate` tokens per second; a request
+        takes one. When the upstream answers 429 anyway, `throttle` stops everything
+        for as long as it asked.
+
+        Properties:
+            `name` Shown in errors and stats.
+            `rate` Tokens added per second.
+            `capacity` Most tokens held at once, i.e. the largest burst.
+        """
+
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+        self.granted = 0
+        self.refused = 0
+        self.throttled = 0
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self, max_wait: float = 0) -> None:
+        """Takes a token, waiting up to `max_wait` seconds for one, otherwise raises `RateLimited`."""
+
+        while True:
+            wait = self.wait_time()
+            if wait <= 0:
+                self._tokens -= 1
+                self.granted += 1
+                return
+
+            if wait > max_wait:
+                self.refused += 1
+                raise RateLimited(self.name, wait)
+
+            # somebody else may take the token first, so check again after waking up
+            await asyncio.sleep(wait)
+            max_wait -= wait
+
+    def throttle(self, retry_after: float) -> None:
+        self._tokens = 0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        self.throttled += 1
+        logging.warning(f'{self.name} rate limited us, pausing requests for {retry_after:.0f}s')
+
+    def __str__(self) -> str:
+        return f"TokenBucket({self.name=}, {self.rate=}, {self.capacity=}, {self.granted=}, {self.refused=}, {self.throttled=})".replace('self.', '')
+
+class CachedResponse:
+    def __init__(self, value: Any, country: str, fetched_at: float, expires_at: float, stale_until: float) -> None:
+        """One cached upstream response.
+
+        Properties:
+            `value` The parsed response, None if the upstream had nothing (a negative entry).
+            `country` Country the response was fetched for, '' when it does not depend on one.
+            `fetched_at` When it was fetched, unix seconds.
+            `expires_at` Until when it is served as is.
+            `stale_until` Until when it is still served, while a fresh copy is fetched in the background.
+        """
+
+        self.value = value
+        self.country = country
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+
+    @property
+    def negative(self) -> bool:
+        return self.value is None
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    @property
+    def usable(self) -> bool:
+        return time.time() < self.stale_until
+
+    def __str__(self) -> str:
+        return f"CachedResponse({self.country=}, {self.negative=}, {self.fetched_at=}, {self.expires_at=}, {self.stale_until=})".replace('self.', '')
+
+class ResponseCache:
+    def __init__(self, path: str = RESPONSE_CACHE_FILE) -> None:
+        """Third party API responses, in one SQLite table.
+
+        Entries are keyed by (namespace, key, country). A fresh entry is returned as is. A
+        stale one (past its TTL but within its stale window) is returned straight away while
+        it is fetched again in the background. Upstreams which had nothing are cached too,
+        as negative entries with a shorter TTL, so the same miss is not asked for on every
+        command. When a fetch fails (e.g. rate limited) the same key cached for another
+        country is used instead, found through the primary key rather than the filesystem.
+        """
+
+        self.path = path
+        self._db: aiosqlite.Connection = None
+        self._connect_lock = asyncio.Lock()
+
+        self._inflight: dict[tuple[str, str, str], asyncio.Task] = {}
+        # keeps background revalidations referenced until they finish
+        self._background: set[asyncio.Task] = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.failed = 0
+
+        self.prune_task: tasks.Loop = self.prune_loop
+        TASK_REGISTRY.append(self.prune_loop)
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        async with self._connect_lock:
+            if self._db is not None:
+                return self._db
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = await aiosqlite.connect(self.path)
+            await db.execute("PRAGMA journal_mode=WAL;")
+            # a NULL body is a negative entry
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    country TEXT NOT NULL,
+                    body TEXT,
+                    fetched_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    stale_until REAL NOT NULL,
+                    PRIMARY KEY (namespace, key, country)
+                );
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_responses_stale_until ON responses (stale_until)")
+            await db.commit()
+
+            self._db = db
+            return db
+
+    async def close(self) -> None:
+        if self._db:
+            await self._db.close()
+            self._db = None
+
+    async def get(self, namespace: str, key: str, country: str = '') -> Optional[CachedResponse]:
+        db = await self._get_db()
+        async with db.execute(
+            "SELECT body, country, fetched_at, expires_at, stale_until FROM responses WHERE namespace = ? AND key = ? AND country = ?",
+            (namespace, key, country)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+        return CachedResponse(json.loads(row[0]) if row[0] is not None else None, row[1], row[2], row[3], row[4])
+
+    async def put(self, namespace: str, key: str, country: str, value: Any, ttl: float, stale_ttl: float, fetched_at: float = None) -> CachedResponse:
+        fetched_at = fetched_at or time.time()
+        body = json.dumps(value, separators=(',', ':')) if value is not None else None
+
+        db = await self._get_db()
+        await db.execute(
+            "INSERT OR REPLACE INTO responses (namespace, key, country, body, fetched_at, expires_at, stale_until) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (namespace, key, country, body, fetched_at, fetched_at + ttl, fetched_at + ttl + stale_ttl)
+        )
+        await db.commit()
+        return CachedResponse(value, country, fetched_at, fetched_at + ttl, fetched_at + ttl + stale_ttl)
+
+    async def other_country(self, namespace: str, key: str, preferred: list[str] = ['US']) -> Optional[CachedResponse]:
+        """The most recent usable non-negative entry for `key` in any country, `preferred` ones first."""
+
+        db = await self._get_db()
+        async with db.execute(
+            "SELECT body, country, fetched_at, expires_at, stale_until FROM responses WHERE namespace = ? AND key = ? AND body IS NOT NULL AND stale_until > ?",
+            (namespace, key, time.time())
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+        if not rows:
+            return None
+
+        rows.sort(key=lambda row: (row[1] not in preferred, preferred.index(row[1]) if row[1] in preferred else 0, -row[2]))
+        row = rows[0]
+        return CachedResponse(json.loads(row[0]), row[1], row[2], row[3], row[4])
+
+    async def _fetch_and_store(self, namespace: str, key: str, country: str, fetch: Callable[[], Awaitable[Any]], ttl: float, negative_ttl: float, stale_ttl: float) -> CachedResponse:
+        value = await fetch()
+        if value is None:
+            # nothing to serve once a negative entry expires, so it gets no stale window
+            return await self.put(namespace, key, country, None, negative_ttl, 0)
+        return await self.put(namespace, key, country, value, ttl, stale_ttl)
+
+    def _start_fetch(self, namespace: str, key: str, country: str, fetch: Callable[[], Awaitable[Any]], ttl: float, negative_ttl: float, stale_ttl: float) -> asyncio.Task:
+        cache_key = (namespace, key, country)
+        task = self._inflight.get(cache_key)
+        if task is None or task.done():
+            task = asyncio.create_task(self._fetch_and_store(namespace, key, country, fetch, ttl, negative_ttl, stale_ttl))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None) if self._inflight.get(cache_key) is task else None)
+        return task
+
+    def _revalidate(self, namespace: str, key: str, country: str, fetch: Callable[[], Awaitable[Any]], ttl: float, negative_ttl: float, stale_ttl: float) -> None:
+        async def revalidate():
+            try:
+                await self._start_fetch(namespace, key, country, fetch, ttl, negative_ttl, stale_ttl)
+            except Exception as e:
+                # the stale entry keeps being served until its window closes
+                logging.warning(f'Could not revalidate {namespace}/{key} ({country or "any"})', exc_info=e)
+
+        task = asyncio.create_task(revalidate())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def get_or_fetch(self, namespace: str, key: str, fetch: Callable[[], Awaitable[Any]], ttl: float, negative_ttl: float, stale_ttl: float, country: str = '', fallback_countries: list[str] = None) -> Optional[Any]:
+        """The cached value for `key`, calling `fetch` when there is none.
+
+        `fetch` returns the parsed response, or None when the upstream had nothing for the
+        key, and raises when the request itself failed. Concurrent calls for the same key
+        share one fetch. Returns None for negative entries, and when the fetch failed with
+        nothing cached to fall back to.
+
+        `fallback_countries` Countries tried first when falling back to another country's entry,
+            no fallback at all when None.
+        """
+
+        cached = await self.get(namespace, key, country)
+        if cached is not None and cached.fresh:
+            if cached.negative:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return cached.value
+
+        if cached is not None and cached.usable:
+            self.stale_hits += 1
+            self._revalidate(namespace, key, country, fetch, ttl, negative_ttl, stale_ttl)
+            return cached.value
+
+        self.misses += 1
+        try:
+            # shield so one impatient caller cannot cancel the fetch for everybody else
+            fetched = await asyncio.shield(self._start_fetch(namespace, key, country, fetch, ttl, negative_ttl, stale_ttl))
+            return fetched.value
+        except Exception as e:
+            self.failed += 1
+            if isinstance(e, RateLimited):
+                logging.info(f'Not fetching {namespace}/{key} ({country or "any"}): {e}')
+            else:
+                logging.warning(f'Could not fetch {namespace}/{key} ({country or "any"})', exc_info=e)
+
+        if fallback_countries is not None:
+            fallback = await self.other_country(namespace, key, preferred=fallback_countries)
+            if fallback is not None:
+                self.fallbacks += 1
+                return fallback.value
+
+        return None
+
+    async def prune(self) -> int:
+        db = await self._get_db()
+        cursor = await db.execute("DELETE FROM responses WHERE stale_until < ?", (time.time(),))
+        await db.commit()
+        return cursor.rowcount
+
+    @tasks.loop(hours=1, name="Prune Response Cache")
+    async def prune_loop(self):
+        try:
+            pruned = await self.prune()
+            if pruned > 0:
+                logging.info(f'Pruned {pruned} expired responses from the response cache')
+        except Exception as e:
+            logging.warning('Could not prune the response cache', exc_info=e)
+
+    def __str__(self) -> str:
+        return f"ResponseCache({self.hits=}, {self.stale_hits=}, {self.negative_hits=}, {self.misses=}, {self.fallbacks=}, {self.failed=})".replace('self.', '')
+
+# shared by every upstream, one database connection is plenty
+RESPONSE_CACHE = ResponseCache()
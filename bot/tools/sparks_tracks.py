@@ -8,6 +8,7 @@ from datetime import datetime
 import aiohttp
 
 from bot import constants
+from bot.tools.metrics import HTTP_TRACE
 
 # Constants
 REPO_OWNER = "FNLookup"
@@ -28,7 +29,7 @@ async def get_commit_history():
     all_commits = []
     page = 1
 
-    session = aiohttp.ClientSession()
+    session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
 
     while True:
         params["page"] = page
@@ -62,7 +63,7 @@ async def download_file_at_commit(commit_sha, commit_timestamp):
     if GITHUB_TOKEN:
         headers["Authorization"] = f"token {GITHUB_TOKEN}"
 
-    session = aiohttp.ClientSession()
+    session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
     
     raw_url = f"https://raw.githubusercontent.com/{REPO_OWNER}/{REPO_NAME}/{commit_sha}/{FILE_PATH}"
     logging.debug(f'[GET] {raw_url}')
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Optional
+
+import aiohttp
+import discord.ext.tasks as tasks
+
+import bot.constants as constants
+from bot.tools.oauthmanager import OAuthManager
+from bot.tools.taskregistry import TASK_REGISTRY
+from bot.tools.metrics import HTTP_TRACE
+
+class StorefrontSnapshot:
+    def __init__(self, data: dict, version: int, content_hash: str, fetched_at: float) -> None:
+        """One parsed copy of the catalog, indexed once so callers never scan it.
+
+        Apart from `fetched_at`, snapshots are never modified after they are built, so
+        hold on to one for as long as needed.
+
+        Properties:
+            `data` The raw catalog response.
+            `version` Goes up by one every time the catalog contents change.
+            `content_hash` md5 of the response body.
+            `fetched_at` When this snapshot was fetched, from `time.time()`.
+            `weekly_entries` Every catalog entry of the BRWeeklyStorefront.
+            `offers_by_id` offerId -> weekly entry.
+            `offers_by_template` templateId -> weekly entry sold by itself.
+            `bundles_by_template` templateId -> DynamicBundle entries containing that item.
+            `jam_track_offers` Weekly entries selling a Jam Track (`SparksSong:`).
+        """
+
+        self.data = data
+        self.version = version
+        self.content_hash = content_hash
+        self.fetched_at = fetched_at
+
+        self.weekly_entries: list[dict] = []
+        self.offers_by_id: dict[str, dict] = {}
+        self.offers_by_template: dict[str, dict] = {}
+        self.bundles_by_template: dict[str, list[dict]] = {}
+        self.jam_track_offers: list[dict] = []
+
+        for storefront in data.get('storefronts', []):
+            if storefront['name'] == 'BRWeeklyStorefront':
+                self.weekly_entries = storefront['catalogEntries']
+                break
+
+        for entry in self.weekly_entries:
+            self.offers_by_id[entry['offerId']] = entry
+
+            if entry.get('offerType') == 'DynamicBundle':
+                for item in entry['dynamicBundleInfo']['bundleItems']:
+                    self.bundles_by_template.setdefault(item['item']['templateId'], []).append(entry)
+                continue
+
+            template_id = entry['meta'].get('templateId')
+            if not template_id:
+                continue
+
+            self.offers_by_template[template_id] = entry
+            if template_id.startswith('SparksSong:'):
+                self.jam_track_offers.append(entry)
+
+    def offer(self, template_id: str) -> Optional[dict]:
+        return self.offers_by_template.get(template_id)
+
+    def bundles_with(self, template_id: str) -> list[dict]:
+        return self.bundles_by_template.get(template_id, [])
+
+    def __str__(self) -> str:
+        return f"StorefrontSnapshot({self.version=}, {self.content_hash=}, entries={len(self.weekly_entries)}, jam_tracks={len(self.jam_track_offers)})".replace('self.', '')
+
+class StorefrontService:
+    def __init__(self, oauth_manager: OAuthManager, max_age: float = 90) -> None:
+        """Fetches the catalog once a minute for the whole bot.
+
+        Everything which needs the Item Shop reads the latest snapshot from here instead
+        of fetching the catalog itself. A snapshot older than `max_age` seconds (e.g. the
+        loop has not run yet, or it is failing) is refetched on demand; callers asking at
+        the same time share that fetch.
+
+        Properties:
+            `version` Version of the latest snapshot, 0 before the first fetch. Compare it
+                with the one you last handled to skip work when the shop has not changed.
+        """
+
+        self.oauth_manager = oauth_manager
+        self.max_age = max_age
+
+        self._snapshot: StorefrontSnapshot = None
+        self._inflight: asyncio.Task = None
+        self._session: aiohttp.ClientSession = None
+
+        self.fetches = 0
+        self.changes = 0
+        self.failed = 0
+
+        self.poll_task: tasks.Loop = self.poll_loop
+        TASK_REGISTRY.append(self.poll_loop)
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version if self._snapshot else 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
+        return self._session
+
+    async def close(self) -> None:
+        if self._session:
+            await self._session.close()
+
+    def cached(self) -> Optional[StorefrontSnapshot]:
+        """The latest snapshot however old it is, without fetching."""
+
+        return self._snapshot
+
+    async def get(self) -> StorefrontSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.time() - snapshot.fetched_at <= self.max_age:
+            return snapshot
+        return await self.refresh()
+
+    async def refresh(self) -> StorefrontSnapshot:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._fetch())
+
+        # shield so one impatient caller cannot cancel the fetch for everybody else
+        return await asyncio.shield(self._inflight)
+
+    async def _fetch(self) -> StorefrontSnapshot:
+        logging.debug(f'[GET] {constants.FN_CATALOG}')
+        token = await self.oauth_manager.get_token()
+        headers = {
+            'Authorization': token
+        }
+
+        self.fetches += 1
+        session = self._get_session()
+        async with session.get(constants.FN_CATALOG, headers=headers) as response:
+            if response.status == 401 or response.status == 403:
+                self.failed += 1
+                await self.oauth_manager.token_rejected(token)
+                raise Exception('Please try again.')
+
+            if not response.ok:
+                self.failed += 1
+            response.raise_for_status()
+            body = await response.read()
+
+        fetched_at = time.time()
+        content_hash = hashlib.md5(body).hexdigest()
+
+        previous = self._snapshot
+        if previous is not None and previous.content_hash == content_hash:
+            previous.fetched_at = fetched_at
+            return previous
+
+        version = (previous.version if previous else 0) + 1
+        snapshot = await asyncio.to_thread(lambda: StorefrontSnapshot(json.loads(body), version, content_hash, fetched_at))
+        self._snapshot = snapshot
+        self.changes += 1
+
+        logging.info(f'Storefront changed, now at version {version} ({len(snapshot.weekly_entries)} entries)')
+        return snapshot
+
+    @tasks.loop(minutes=1, name="Poll Storefront")
+    async def poll_loop(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.warning('Could not poll the storefront', exc_info=e)
+
+    def __str__(self) -> str:
+        return f"StorefrontService({self.version=}, {self.fetches=}, {self.changes=}, {self.failed=})".replace('self.', '')
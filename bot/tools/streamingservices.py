@@ -1,23 +1,101 @@
-from os import access
-from datetime import tzinfo
 import re
 from bot.tracks import JamTrackHandler
-from requests.models import HTTPError
-from datetime import datetime, timedelta, timezone
-from os import makedirs
+from datetime import datetime, timezone
 import os
 from bot import constants
+from bot.tools.responsecache import RESPONSE_CACHE, RateLimited, TokenBucket
+from bot.tools.metrics import HTTP_TRACE
+import aiohttp
 import logging
 import discord
-import requests
 import json
 import urllib.parse
 
+LEGACY_ODESLI_FOLDER = os.path.join(constants.CACHE_FOLDER, 'odesli')
+
+# the public Odesli API allows about 10 requests a minute
+ODESLI_LIMITER = TokenBucket('Odesli', rate=10 / 60, capacity=10)
+SPOTIFY_LIMITER = TokenBucket('Spotify', rate=5, capacity=20)
+
+ODESLI_TTL = 7 * 24 * 3600
+ODESLI_STALE_TTL = 30 * 24 * 3600
+SPOTIFY_TTL = 24 * 3600
+SPOTIFY_STALE_TTL = 7 * 24 * 3600
+# how long "nothing found" is remembered
+NEGATIVE_TTL = 3600
+
+_session: aiohttp.ClientSession = None
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(trace_configs=[HTTP_TRACE])
+    return _session
+
+async def get_upstream_json(limiter: TokenBucket, url: str, headers: dict = None) -> dict | None:
+    """GETs `url` within `limiter`, None if the upstream has nothing for it."""
+
+    # interactions are deferred, a short wait for a token is fine
+    await limiter.acquire(max_wait=3)
+    logging.debug(f'[GET] {url}')
+
+    async with _get_session().get(url, headers=headers) as response:
+        if response.status == 429:
+            try:
+                retry_after = float(response.headers.get('Retry-After', 65))
+            except ValueError:
+                retry_after = 65
+            limiter.throttle(retry_after)
+            raise RateLimited(limiter.name, retry_after)
+
+        if response.status == 400 or response.status == 404:
+            return None
+
+        response.raise_for_status()
+        return await response.json()
+
+async def import_legacy_odesli_cache() -> int:
+    """Moves the old `odesli/{shortname}.{country}[.album.{id}].json` files into the response cache."""
+
+    if not os.path.isdir(LEGACY_ODESLI_FOLDER):
+        return 0
+
+    imported = 0
+    for name in os.listdir(LEGACY_ODESLI_FOLDER):
+        path = os.path.join(LEGACY_ODESLI_FOLDER, name)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+
+            # the files were named by shortname, the cache is keyed by what was asked for
+            entity_type, _, entity_id = data.get('entityUniqueId', '').partition('::')
+            spotify_type = {'SPOTIFY_SONG': 'track', 'SPOTIFY_ALBUM': 'album'}.get(entity_type)
+            country = name.split('.')[1]
+            if spotify_type and entity_id:
+                spotify_uri = f'spotify:{spotify_type}:{entity_id}'
+                if await RESPONSE_CACHE.get('odesli', spotify_uri, country) is None:
+                    await RESPONSE_CACHE.put('odesli', spotify_uri, country, data, ODESLI_TTL, ODESLI_STALE_TTL, fetched_at=os.path.getmtime(path))
+                    imported += 1
+        except Exception as e:
+            logging.warning(f'Could not import {path} into the response cache', exc_info=e)
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    try:
+        os.rmdir(LEGACY_ODESLI_FOLDER)
+    except OSError:
+        pass
+
+    logging.info(f'Imported {imported} legacy Odesli responses')
+    return imported
+
 # this class handles the streaming services option in action menu dropdown
 class StreamingServicesManager:
     def __init__(self):
         self.oauth_manager = constants.OAUTH_MANAGER
-        self.do_not_request_odesli_until: datetime = None
         self.supported_countries = [
             "US",
             "GB",
@@ -69,7 +147,7 @@ class StreamingServicesManager:
         }
         self.search_handler = JamTrackHandler(None)
 
-    def get_spotify_data(self, track_data: any, isrc: str, market: str | None = None):
+    async def get_spotify_data(self, track_data: any, isrc: str, market: str | None = None):
         if not self.oauth_manager:
             raise ValueError('OAuthManager instance is required to get Spotify link.')
         
@@ -87,24 +165,17 @@ class StreamingServicesManager:
 
         song_url = f'https://api.spotify.com/v1/search?{urllib.parse.urlencode(params)}'
 
-        client_token = self.oauth_manager._spotify_access_token
-        logging.debug(f'[GET] {song_url}')
-        link = requests.get(song_url, headers={'Authorization': f'Bearer {client_token}'})
+        async def fetch():
+            client_token = self.oauth_manager._spotify_access_token
+            return await get_upstream_json(SPOTIFY_LIMITER, song_url, headers={'Authorization': f'Bearer {client_token}'})
 
-        try:
-            link.raise_for_status()
-        except Exception as e:
-            logging.error(f'Spotify Link GET returned {link.status_code}', exc_info=e)
-            return None
-        
-        result = link.json()
-
-        with open('spotify_result.json', 'w') as f:
-            f.write(json.dumps(result, indent=4))
-
-        return result
+        return await RESPONSE_CACHE.get_or_fetch(
+            'spotify_search', normalized_isrc, fetch,
+            ttl=SPOTIFY_TTL, negative_ttl=NEGATIVE_TTL, stale_ttl=SPOTIFY_STALE_TTL,
+            country=market or ''
+        )
 
-    def get_album(self, spotify_album_id: str, market: str | None = None):
+    async def get_album(self, spotify_album_id: str, market: str | None = None):
         if not self.oauth_manager:
             raise ValueError('OAuthManager instance is required to get Spotify link.')
         
@@ -114,75 +185,35 @@ class StreamingServicesManager:
         if market:
             album_url += f'?market={market}'
 
-        client_token = self.oauth_manager._spotify_access_token
-        logging.debug(f'[GET] {album_url}')
-        album = requests.get(album_url, headers={'Authorization': f'Bearer {client_token}'})
-
-        try:
-            album.raise_for_status()
-        except Exception as e:
-            logging.error(f'Spotify Album GET returned {album.status_code}', exc_info=e)
-            return None
-        
-        result = album.json()
-
-        with open('spotify_album_result.json', 'w') as f:
-            f.write(json.dumps(result, indent=4))
+        async def fetch():
+            client_token = self.oauth_manager._spotify_access_token
+            return await get_upstream_json(SPOTIFY_LIMITER, album_url, headers={'Authorization': f'Bearer {client_token}'})
 
-        return result
+        return await RESPONSE_CACHE.get_or_fetch(
+            'spotify_album', normalized_album_id, fetch,
+            ttl=SPOTIFY_TTL, negative_ttl=NEGATIVE_TTL, stale_ttl=SPOTIFY_STALE_TTL,
+            country=market or ''
+        )
         
-    def fetch_odesli_data(self, spotify_uri: str, user_country: str):
-        url = f"https://api.odesli.co/matches?url={spotify_uri}&userCountry={user_country}&key={constants.ODESLI_API_KEY}"
-        logging.debug(f'[GET] {url}')
-
-        odesli = requests.get(url)
-        odesli.raise_for_status()
-        result = odesli.json()
-        return result
-
-    def get_cached_odesli_data(self, shortname: str, spotify_uri: str, file_sub_identifier: str, user_country: str, auto_fetch: bool = False):
-        cache_file = os.path.join(constants.CACHE_FOLDER, 'odesli', f'{shortname}.{user_country}.json')
-        if file_sub_identifier:
-            cache_file = os.path.join(constants.CACHE_FOLDER, 'odesli', f'{shortname}.{user_country}.{file_sub_identifier}.json')
+    async def fetch_odesli_data(self, spotify_uri: str, user_country: str):
+        params = {
+            "url": spotify_uri,
+            "userCountry": user_country,
+            "key": constants.ODESLI_API_KEY
+        }
+        url = f"https://api.odesli.co/matches?{urllib.parse.urlencode(params)}"
+        return await get_upstream_json(ODESLI_LIMITER, url)
 
+    async def get_cached_odesli_data(self, spotify_uri: str, user_country: str):
         if user_country not in self.supported_countries:
             user_country = "US"
 
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r') as f:
-                return json.load(f)
-        else:
-            if not auto_fetch:
-                return None
-
-            try:
-                if self.do_not_request_odesli_until:
-                    if datetime.now(timezone.utc) < self.do_not_request_odesli_until:
-                        return None
-                    self.do_not_request_odesli_until = None
-                    
-                odesli_data = self.fetch_odesli_data(spotify_uri, user_country)
-            except HTTPError as e:
-                if e.response.status_code == 429:
-                    logging.error(exc_info=e)
-                    self.do_not_request_odesli_until = datetime.now(timezone.utc) + timedelta(minutes=1, seconds=5)
-
-                    # try US fallback
-                    if user_country != 'US':
-                        return self.get_cached_odesli_data(shortname=shortname, spotify_uri=spotify_uri, user_country="US")
-                    else:
-                        # try any other country
-                        for country in self.supported_countries:
-                            country_path = os.path.join(constants.CACHE_FOLDER, 'odesli', f'{shortname}.{country}.json')
-                            if os.path.exists(country_path):
-                                return json.load(open(country_path, 'r'))
-
-                return None
-
-            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
-            with open(cache_file, 'w') as f:
-                json.dump(odesli_data, f, indent=4)
-            return odesli_data
+        # links rarely differ between countries, another country's beats none at all
+        return await RESPONSE_CACHE.get_or_fetch(
+            'odesli', spotify_uri, lambda: self.fetch_odesli_data(spotify_uri, user_country),
+            ttl=ODESLI_TTL, negative_ttl=NEGATIVE_TTL, stale_ttl=ODESLI_STALE_TTL,
+            country=user_country, fallback_countries=['US']
+        )
 
     def get_user_country(self, locale: str):
         return {
@@ -243,11 +274,10 @@ class StreamingServicesManager:
 
         market = self.get_user_country(interaction.locale.value)
         isrc = track['track'].get('isrc', None)
-        shortname = track['track']['sn']
 
         if isrc:
             normalized_isrc = isrc.lstrip().rstrip()
-            spotify_data = self.get_spotify_data(track_data=track, isrc=normalized_isrc, market=market)
+            spotify_data = await self.get_spotify_data(track_data=track, isrc=normalized_isrc, market=market)
             if not spotify_data:
                 return
 
@@ -255,16 +285,9 @@ class StreamingServicesManager:
             if len(items) > 0:
                 # find first that is the isrc result
                 item = discord.utils.find(lambda i: i.get('external_ids', {}).get('isrc', '') == normalized_isrc, items)
-                print(item)
                 spotify_url = item['external_urls'].get('spotify', None)
                 spotify_uri = item['uri']
-                odesli_data = self.get_cached_odesli_data(
-                    shortname=shortname, 
-                    file_sub_identifier=None,
-                    spotify_uri=spotify_uri, 
-                    user_country=market,
-                    auto_fetch=True
-                )
+                odesli_data = await self.get_cached_odesli_data(spotify_uri=spotify_uri, user_country=market)
 
                 explicit_label = "<:explicit:1539105312542564372>" if item.get('explicit', False) else ""
 
@@ -411,10 +434,13 @@ class StreamingServicesManager:
 
         market = self.get_user_country(interaction.locale.value)
         isrc = track['track'].get('isrc', None)
-        shortname = track['track']['sn']
 
         # get spotify data
-        album_data = self.get_album(spotify_album_id=spotify_id, market=market)
+        album_data = await self.get_album(spotify_album_id=spotify_id, market=market)
+        if not album_data:
+            await interaction.edit_original_response(embed=constants.common_error_embed("Could not load this album, please try again later."))
+            return
+
         artists = f"*{', '.join(map(lambda a: a['name'], album_data['artists']))}*"
         r_date = album_data['release_date']
         date_released = datetime.fromisoformat(r_date).astimezone(timezone.utc)
@@ -438,13 +464,7 @@ class StreamingServicesManager:
 
         spotify_uri = album_data['uri']
         spotify_id = album_data['id']
-        odesli_data = self.get_cached_odesli_data(
-            shortname=shortname, 
-            spotify_uri=spotify_uri, 
-            file_sub_identifier=f"album.{spotify_id}",
-            user_country=market,
-            auto_fetch=True
-        )
+        odesli_data = await self.get_cached_odesli_data(spotify_uri=spotify_uri, user_country=market)
 
         
         container.add_item(initial_section)
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+
+import discord.ext.tasks as tasks
+
+import bot.constants as constants
+from bot.tools.taskregistry import TASK_REGISTRY
+
+class TempSweeper:
+    def __init__(self, ttl: float = 6 * 3600) -> None:
+        """Removes whatever is left in the temp folder after `ttl` seconds.
+
+        Sessions normally delete their own folder, this catches the ones which did not
+        (errors, views which never timed out, restarts) and loose files in the temp folder.
+
+        Properties:
+            `ttl` Seconds a file or session folder may stay untouched.
+            `removed` Entries removed since startup.
+            `freed_bytes` Bytes freed since startup.
+        """
+
+        self.ttl = ttl
+
+        self.removed = 0
+        self.freed_bytes = 0
+
+        self.sweep_task: tasks.Loop = self.sweep_loop
+        TASK_REGISTRY.append(self.sweep_loop)
+
+    def sweep(self) -> tuple[int, int]:
+        """Sweeps once, returns (entries removed, bytes freed)."""
+
+        cutoff = time.time() - self.ttl
+        removed = 0
+        freed = 0
+
+        sessions_folder = os.path.normpath(constants.SESSIONS_FOLDER)
+        for folder in [constants.TEMP_FOLDER, constants.SESSIONS_FOLDER]:
+            with os.scandir(folder) as it:
+                entries = list(it)
+
+            for entry in entries:
+                if os.path.normpath(entry.path) == sessions_folder:
+                    continue
+
+                try:
+                    # a folder's mtime changes whenever something is added to it
+                    if entry.stat().st_mtime > cutoff:
+                        continue
+
+                    if entry.is_dir(follow_symlinks=False):
+                        size = folder_size(entry.path)[1]
+                        shutil.rmtree(entry.path)
+                    else:
+                        size = entry.stat().st_size
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+
+                removed += 1
+                freed += size
+
+        self.removed += removed
+        self.freed_bytes += freed
+        if removed > 0:
+            logging.info(f'Swept {removed} stale entries ({freed} bytes) from {constants.TEMP_FOLDER}')
+        return (removed, freed)
+
+    @tasks.loop(minutes=30, name="Sweep Temp Files")
+    async def sweep_loop(self):
+        try:
+            await asyncio.to_thread(self.sweep)
+        except Exception as e:
+            logging.warning('Could not sweep temp files', exc_info=e)
+
+    def disk_usage(self) -> list[tuple[str, int, int]]:
+        """(folder, files, bytes) for the temp, session and every cache folder."""
+
+        folders = [constants.TEMP_FOLDER, constants.SESSIONS_FOLDER, constants.LOCAL_JSON_FOLDER]
+        with os.scandir(constants.CACHE_FOLDER) as it:
+            folders.extend(sorted(os.path.join(constants.CACHE_FOLDER, entry.name) + '/' for entry in it if entry.is_dir()))
+
+        usage = []
+        for folder in folders:
+            files, size = folder_size(folder)
+            usage.append((folder, files, size))
+        return usage
+
+    def __str__(self) -> str:
+        return f"TempSweeper({self.ttl=}, {self.removed=}, {self.freed_bytes=})".replace('self.', '')
+
+def folder_size(folder: str) -> tuple[int, int]:
+    files = 0
+    size = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except FileNotFoundError:
+                pass
+    return (files, size)
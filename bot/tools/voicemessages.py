@@ -22,28 +22,40 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
+import asyncio
 from hashlib import md5
 import json
-import math
-import concurrent
 import os
 from pathlib import Path
-import subprocess
+from typing import AsyncIterator
 import discord
 from discord.ext import commands
 
+import aiohttp
 import requests
 import xmltodict
 import base64
 
 import logging
 
-from pydub import AudioSegment
-from pydub import utils as pdutils
 import numpy as np
-import base64
 
 from bot import constants
+from bot.tools.cachequota import CACHE_QUOTAS
+from bot.tools.waveform import WaveformBuilder, to_waveform_bytes
+from bot.tools.metrics import HTTP_TRACE
+
+# the waveform and duration only need a mono signal, 16kHz is plenty for that
+PCM_SAMPLE_RATE = 16000
+
+# points in the voice message waveform
+WAVEFORM_BUCKETS = 256
+
+# every preview is a folder (audio + envelope) named after its pid
+CACHE_QUOTAS.register('previews', constants.PREVIEW_FOLDER, 512 * 1024 * 1024, unit='folder')
+
+# pid -> task making the preview, so two people previewing the same song share one download
+_preview_jobs: dict[str, asyncio.Task] = {}
 
 class PreviewAudioMgr:
     def __init__(self, bot: discord.Client, track: any, interaction: discord.Interaction):
@@ -54,16 +66,12 @@ class PreviewAudioMgr:
         self.audio_duration = 0
 
         qi = self.track['track']['qi']
-        quicksilver_data = json.loads(qi)
-        self.pid = quicksilver_data['pid']
-
-        output_path = f'{constants.PREVIEW_FOLDER}{self.pid}/preview.ogg'
-        if not os.path.exists(output_path):
-            mpd = self.acquire_mpegdash_playlist(quicksilver_data)
-            master_audio_path = self.download_mpd_playlist(mpd)
-            output_path = self.convert_to_ogg(master_audio_path)
+        self.quicksilver_data = json.loads(qi)
+        self.pid = self.quicksilver_data['pid']
 
-        self.output_path = output_path
+        self.preview_folder = f'{constants.PREVIEW_FOLDER}{self.pid}'
+        self.output_path = f'{self.preview_folder}/preview.ogg'
+        self.envelope_path = f'{self.preview_folder}/envelope.npz'
 
     def _get_ffmpeg_path(self) -> str:
         if os.name == 'nt':
@@ -76,160 +84,136 @@ class PreviewAudioMgr:
 
         if Path.exists(ffmpeg_path):
             return str(ffmpeg_path.resolve()).replace('\\', '/')
-        
-    def _get_ffprobe_path(self) -> str:
-        if os.name == 'nt':
-            ffprobe_path = Path('bot/data/Binaries/Windows/FFmpeg/bin/ffprobe.exe')
-        else:
-             ffprobe_path = Path('bot/data/Binaries/Linux/FFmpeg/bin/ffprobe')
-             if not ffprobe_path.exists():
-                 import shutil
-                 return shutil.which('ffprobe')
 
-        if Path.exists(ffprobe_path):
-            return str(ffprobe_path.resolve()).replace('\\', '/')
+    async def ensure_preview(self) -> None:
+        if os.path.exists(self.output_path):
+            CACHE_QUOTAS.record('previews', self.pid, hit=True)
+            return
+
+        CACHE_QUOTAS.record('previews', self.pid, hit=False)
+
+        task = _preview_jobs.get(self.pid)
+        if task is None:
+            task = asyncio.create_task(self.create_preview())
+            _preview_jobs[self.pid] = task
+            task.add_done_callback(lambda _: _preview_jobs.pop(self.pid, None))
 
-    def acquire_mpegdash_playlist(self, quicksilver_data: any) -> str:
+        # shield so one interaction going away does not break the preview for everyone else
+        await asyncio.shield(task)
+
+    async def acquire_mpegdash_playlist(self, session: aiohttp.ClientSession, quicksilver_data: any) -> bytes:
         endpoint = 'https://cdn.qstv.on.epicgames.com/'
         url = endpoint + quicksilver_data['pid']
 
         logging.info(f'[GET] {url}')
-        vod_data = requests.get(url)
-        vod_data.raise_for_status()
+        async with session.get(url) as vod_data:
+            vod_data.raise_for_status()
+            data = await vod_data.json()
 
-        data = vod_data.json()
         playlist = base64.b64decode(data['playlist'])
         return playlist
-    
-    def download_mpd_playlist(self, mpd: str) -> str:
+
+    def parse_mpd_playlist(self, mpd: bytes) -> str:
         data = xmltodict.parse(mpd)
         mpd_node = data['MPD']
 
-        # print(json.dumps(mpd_node, indent=4))
-
         base_url = mpd_node['BaseURL']
         audio_duration = float(mpd_node['@mediaPresentationDuration'].replace('PT', '').replace('S', ''))
 
         self.audio_duration = audio_duration
 
-        # segment_duration = float(mpd_node['@maxSegmentDuration'].replace('PT', '').replace('S', ''))
-
-        # num_segments = math.ceil(audio_duration / segment_duration)
-
+        # the preview is a single file, its init segment holds all the audio
         representation = mpd_node['Period']['AdaptationSet']['Representation']
-        # repr_id = int(representation['@id'])
-        # sample_rate = int(representation['@audioSamplingRate'])
-
-        # init_template = representation['SegmentTemplate']['@initialization']
-        # segment_template = representation['SegmentTemplate']['@media']
-        # segment_start = int(representation['SegmentTemplate']['@startNumber'])
-
-        output = f'temp/streaming_{self.hash}_'
-        init_file = representation['BaseURL']
-        init_path = output + init_file
-        init_url = base_url + init_file
-        logging.info(f'[GET] {init_url}')
-
-        init_data = requests.get(init_url)
-        with open(init_path, 'wb') as init_file_io:
-            init_file_io.write(init_data.content)
-
-        # segments = []
-            
-        # def download_segment(segment_id):
-        #     segment_file = segment_template.replace('$RepresentationID$', str(repr_id)).replace('$Number$', str(segment_id))
-        #     segment_path = output + segment_file
-        #     segment_url = base_url + segment_file
-
-        #     logging.info(f'[GET] {segment_url}')
-
-        #     segment_data = requests.get(segment_url)
-        #     with open(segment_path, 'wb') as segment_file_io:
-        #         segment_file_io.write(segment_data.content)
-        #         segments.append(segment_path)
-
-        # with concurrent.futures.ThreadPoolExecutor(max_workers=15) as executor:
-        #     futures = [executor.submit(download_segment, idx) for idx in range(segment_start, num_segments + 1)]
-        #     concurrent.futures.wait(futures)
-
-        # segments.sort(key=lambda x: int(x.split('_')[-1].split('.')[0]))
-
-        master_file = output + 'master_audio.mp4'
-        with open(master_file, 'wb') as master:
-            master.write(open(init_path, 'rb').read())
-            os.remove(init_path)
-
-            # for segment in segments:
-            #     master.write(open(segment, 'rb').read())
-            #     os.remove(segment)
-
-        return master_file
-    
-    def convert_to_ogg(self, master_audio_path):
-        output_path = f'{constants.PREVIEW_FOLDER}{self.pid}'
-        os.makedirs(output_path, exist_ok=True)
-        output_path += '/preview.ogg'
-
-        ffmpeg_path = self._get_ffmpeg_path()
-        ffmpeg_command = [
-            ffmpeg_path,
-            '-i',
-            master_audio_path,
-            '-acodec', 
-            'libopus',
-            '-ar',
-            '48000',
-            output_path
-        ]
-        subprocess.run(ffmpeg_command)
-        return output_path
-
-    def get_waveform_bytearray(self) -> tuple[np.uint8, float]:
-        AudioSegment.converter = self._get_ffmpeg_path()
-
-        def override_prober() -> str:
-            return self._get_ffprobe_path()
-        
-        pdutils.get_prober_name = override_prober
-
-        if os.path.exists(self.output_path.replace('preview.ogg', 'waveform.dat')):
-            with open(self.output_path.replace('preview.ogg', 'waveform.dat'), 'rb') as f:
-
-                if os.path.exists(self.output_path.replace('preview.ogg', 'duration.dat')):
-                    duration = float(open(self.output_path.replace('preview.ogg', 'duration.dat'), 'r').read())
-                else:
-                    audio = AudioSegment.from_file(self.output_path, format="ogg")
-                    duration = audio.duration_seconds
-                    open(self.output_path.replace('preview.ogg', 'duration.dat'), 'w').write(f'{duration}')
-
-                return (np.frombuffer(f.read(), dtype=np.uint8), duration)
-
-        audio = AudioSegment.from_file(self.output_path, format="ogg")
-        audio.converter = self._get_ffmpeg_path()
-        duration = audio.duration_seconds
-
-        samples = np.array(audio.get_array_of_samples())
-        sample_rate = audio.frame_rate
-
-        # Normalize to range [-1.0, 1.0]
-        samples = samples / np.max(np.abs(samples))
-
-        # Downsample to 256 points
-        total_samples = len(samples)
-        stride = max(1, total_samples // 256)
-        downsampled = samples[::stride][:256]
-
-        # Scale to 0-255
-        byte_array = np.uint8((downsampled + 1.0) * 127.5)
-
-        # Cache the waveform bytearray
-        with open(self.output_path.replace('preview.ogg', 'waveform.dat'), 'wb') as f:
-            f.write(byte_array.tobytes())
-
-        with open(self.output_path.replace('preview.ogg', 'duration.dat'), 'w') as f:
-            f.write(f'{duration}')
+        return base_url + representation['BaseURL']
+
+    async def create_preview(self) -> None:
+        """Streams the preview audio straight into FFmpeg, which writes the Opus file and hands back
+        PCM for the waveform and duration at the same time. Nothing is written to temp/."""
+
+        os.makedirs(self.preview_folder, exist_ok=True)
+        tmp_output_path = self.output_path + '.tmp'
+
+        async with aiohttp.ClientSession(trace_configs=[HTTP_TRACE]) as session:
+            mpd = await self.acquire_mpegdash_playlist(session, self.quicksilver_data)
+            audio_url = self.parse_mpd_playlist(mpd)
+
+            logging.info(f'[GET] {audio_url}')
+            async with session.get(audio_url) as response:
+                response.raise_for_status()
+                waveform = await self.run_ffmpeg(['-i', 'pipe:0'], response.content.iter_chunked(64 * 1024), ogg_output=tmp_output_path)
+
+        try:
+            waveform.save(self.envelope_path)
+        except BaseException:
+            os.remove(tmp_output_path)
+            raise
+
+        # the ogg goes in last, once it exists the envelope does too
+        os.replace(tmp_output_path, self.output_path)
+
+    async def run_ffmpeg(self, input_args: list[str], chunks: AsyncIterator[bytes] = None, ogg_output: str = None) -> WaveformBuilder:
+        """Runs FFmpeg on `input_args`, feeding it `chunks` over stdin if given.
+        Returns the waveform of the audio, and also writes an Opus file to `ogg_output` if given."""
+
+        ffmpeg_command = [self._get_ffmpeg_path(), '-hide_banner', '-loglevel', 'error', *input_args]
+        if ogg_output:
+            ffmpeg_command.extend(['-map', '0:a:0', '-acodec', 'libopus', '-ar', '48000', '-f', 'ogg', '-y', ogg_output])
+        ffmpeg_command.extend(['-map', '0:a:0', '-ac', '1', '-ar', str(PCM_SAMPLE_RATE), '-f', 's16le', 'pipe:1'])
+
+        process = await asyncio.create_subprocess_exec(
+            *ffmpeg_command,
+            stdin=asyncio.subprocess.PIPE if chunks is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        async def feed():
+            try:
+                async for chunk in chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # ffmpeg gave up early, its exit code and stderr say why
+                pass
+            finally:
+                process.stdin.close()
+
+        waveform = WaveformBuilder(PCM_SAMPLE_RATE)
+
+        async def read_pcm():
+            # the PCM is folded into the waveform as it arrives, it is never held whole
+            while chunk := await process.stdout.read(64 * 1024):
+                waveform.feed(chunk)
+            waveform.finish()
+
+        try:
+            # stdout has to be read while we write, or both sides end up waiting on full pipes
+            jobs = [process.stderr.read(), read_pcm()]
+            if chunks is not None:
+                jobs.append(feed())
+            stderr, *_ = await asyncio.gather(*jobs)
+            await process.wait()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+        if process.returncode != 0:
+            raise Exception("FFmpeg Error: " + stderr.decode('utf-8', errors='replace'))
+
+        return waveform
+
+    async def get_waveform_bytearray(self) -> tuple[np.uint8, float]:
+        if os.path.exists(self.envelope_path):
+            waveform = WaveformBuilder.load(self.envelope_path)
+        else:
+            # previews cached before the envelope was saved with them, decode them once
+            waveform = await self.run_ffmpeg(['-i', self.output_path])
+            waveform.save(self.envelope_path)
 
-        return (byte_array, duration)
+        peak, _ = waveform.envelope(WAVEFORM_BUCKETS)
+        return (to_waveform_bytes(peak), waveform.duration)
 
     async def reply_to_interaction_message(self):
         msg = self.interaction.message
@@ -244,7 +228,8 @@ class PreviewAudioMgr:
         flags = discord.MessageFlags()
         flags.voice = True
 
-        wvform_bytearray, audio_duration = self.get_waveform_bytearray()
+        await self.ensure_preview()
+        wvform_bytearray, audio_duration = await self.get_waveform_bytearray()
         wvform_b64 = base64.b64encode(wvform_bytearray.tobytes()).decode('utf-8')
 
         payload = {
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+
+class WaveformBuilder:
+    def __init__(self, sample_rate: int, block_size: int = 256) -> None:
+        """Builds peak and RMS envelopes from mono s16le PCM as it streams in.
+
+        Only the peak and sum of squares of every `block_size` samples are kept, so
+        memory stays small however long the audio is, and envelopes with any number of
+        buckets can be made from them afterwards (bucket edges snap to whole blocks).
+
+        Properties:
+            `sample_rate` Samples per second of the PCM.
+            `samples` Samples fed so far.
+        """
+
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.samples = 0
+
+        self._peaks: list[np.ndarray] = []
+        self._squares: list[np.ndarray] = []
+        self._counts: list[np.ndarray] = []
+        self._pending = bytearray()
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+    def feed(self, data: bytes) -> None:
+        self._pending.extend(data)
+
+        whole_blocks = len(self._pending) // (2 * self.block_size)
+        if whole_blocks == 0:
+            return
+
+        size = whole_blocks * self.block_size * 2
+        # copied out, a bytearray cannot shrink while numpy is looking at it
+        chunk = bytes(self._pending[:size])
+        del self._pending[:size]
+        self._add_blocks(np.frombuffer(chunk, dtype=np.int16).reshape(whole_blocks, self.block_size))
+
+    def finish(self) -> 'WaveformBuilder':
+        """Accounts for the last, partial block. Call once no more PCM will come."""
+
+        # an odd trailing byte is half a sample, drop it
+        usable = len(self._pending) - len(self._pending) % 2
+        chunk = bytes(self._pending[:usable])
+        self._pending.clear()
+        if usable > 0:
+            self._add_blocks(np.frombuffer(chunk, dtype=np.int16).reshape(1, -1))
+        return self
+
+    def _add_blocks(self, blocks: np.ndarray) -> None:
+        values = blocks.astype(np.float32) / 32768.0
+        self._peaks.append(np.abs(values).max(axis=1))
+        self._squares.append(np.square(values, dtype=np.float64).sum(axis=1))
+        self._counts.append(np.full(len(blocks), blocks.shape[1], dtype=np.int64))
+        self.samples += blocks.size
+
+    def _blocks(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if not self._peaks:
+            return (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64))
+
+        if len(self._peaks) > 1:
+            # keep them merged so repeated envelopes do not concatenate every time
+            self._peaks = [np.concatenate(self._peaks)]
+            self._squares = [np.concatenate(self._squares)]
+            self._counts = [np.concatenate(self._counts)]
+
+        return (self._peaks[0], self._squares[0], self._counts[0])
+
+    def envelope(self, buckets: int = 256) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (peak, rms) per bucket, both in [0, 1] of full scale."""
+
+        peaks, squares, counts = self._blocks()
+        if len(peaks) == 0:
+            return (np.zeros(buckets, dtype=np.float32), np.zeros(buckets, dtype=np.float32))
+
+        # first block of every bucket. with fewer blocks than buckets some starts repeat,
+        # reduceat then gives those buckets the single block they fall in
+        starts = (np.arange(buckets) * len(peaks)) // buckets
+
+        peak = np.maximum.reduceat(peaks, starts).astype(np.float32)
+        rms = np.sqrt(np.add.reduceat(squares, starts) / np.add.reduceat(counts, starts)).astype(np.float32)
+        return (peak, rms)
+
+    def save(self, path: str) -> None:
+        peaks, squares, counts = self._blocks()
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, peaks=peaks, squares=squares, counts=counts, sample_rate=self.sample_rate, block_size=self.block_size)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'WaveformBuilder':
+        with np.load(path) as data:
+            builder = cls(int(data['sample_rate']), int(data['block_size']))
+            builder._peaks = [data['peaks']]
+            builder._squares = [data['squares']]
+            builder._counts = [data['counts']]
+            builder.samples = int(data['counts'].sum())
+        return builder
+
+    def __str__(self) -> str:
+        return f"WaveformBuilder({self.sample_rate=}, {self.block_size=}, {self.samples=})".replace('self.', '')
+
+def to_waveform_bytes(envelope: np.ndarray) -> np.ndarray:
+    """Scales an envelope to 0-255, relative to its loudest bucket, the way Discord draws voice messages."""
+
+    loudest = float(envelope.max(initial=0))
+    if loudest <= 0:
+        return np.zeros(len(envelope), dtype=np.uint8)
+    return np.round(envelope / loudest * 255).astype(np.uint8)
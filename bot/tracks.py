@@ -280,8 +280,8 @@ class SearchCommandHandler:
             await interaction.edit_original_response(embed=constants.common_error_embed('Could not get Jam Tracks.'))
             return
 
-        weekly_tracks = self.daily_handler.fetch_daily_shortnames()
-        shop_tracks = self.shop_handler.fetch_shop_tracks()
+        weekly_tracks = await self.daily_handler.fetch_daily_shortnames()
+        shop_tracks = await self.shop_handler.fetch_shop_tracks()
 
         matched_tracks = self.jam_track_handler.fuzzy_search_tracks(tracks, query)
         if not matched_tracks:
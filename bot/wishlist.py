@@ -1,3 +1,4 @@
+import asyncio
 import json
 import requests
 import logging
@@ -6,6 +7,7 @@ from bot import constants, database
 from bot.helpers import DailyCommandHandler, ShopCommandHandler
 from bot.views.wishlistpersist import WishlistButton
 from bot.tracks import JamTrackHandler
+from bot.tools.metrics import NOTIFICATIONS
 
 class AlreadyInWishlistError(Exception):
     pass
@@ -19,20 +21,26 @@ class WishlistManager():
         self.config: database.Config = self.bot.config
         self.daily_handler = DailyCommandHandler(self.bot)
         self.shop_handler = ShopCommandHandler(self.bot)
+        self.last_shop_state = None
 
     async def handle_wishlists(self):
         all_wishlists: list[database.WishlistEntry] = await self.config.wishlist('get_all')
         logging.info('Processing wishlists...')
         all_tracks = constants.get_jam_tracks(use_cache=True, max_cache_age=60)
-        rotation = self.daily_handler.fetch_daily_shortnames()
+        # every entry needs its track, looked up by shortname instead of scanning the list each time
+        tracks_by_shortname = {track['track']['sn']: track for track in all_tracks}
+        calendar = await self.bot.calendar.get()
+        if not calendar.has_state:
+            # everything would look like it left rotation
+            raise ValueError("No valid states found")
 
         for entry in all_wishlists:
-            rotation_entry = discord.utils.find(lambda x: x['metadata']['track']['sn'] == entry.shortname, rotation)
+            in_rotation = calendar.in_rotation(entry.shortname)
 
-            track = discord.utils.find(lambda x: x['track']['sn'] == entry.shortname, all_tracks)
+            track = tracks_by_shortname.get(entry.shortname)
 
             # the track is NOT in the current rotation
-            if not rotation_entry:
+            if not in_rotation:
 
                 if entry.lock_rotation_active:
                     # the lock is active so we unlock the wishlist entry so that we can notify the user again
@@ -56,7 +64,9 @@ class WishlistManager():
                     if user:
                         try:
                             await user.send(embed=embed)
+                            NOTIFICATIONS.inc(event='wishlist', outcome='sent')
                         except Exception as e:
+                            NOTIFICATIONS.inc(event='wishlist', outcome='failed')
                             logging.error("Cannot notify wishlist ocurrence", exc_info=e)
 
                 # stop here
@@ -89,37 +99,31 @@ class WishlistManager():
             if user:
                 try:
                     await user.send(embed=embed)
+                    NOTIFICATIONS.inc(event='wishlist', outcome='sent')
                 except Exception as e:
+                    NOTIFICATIONS.inc(event='wishlist', outcome='failed')
                     logging.error("Cannot notify wishlist ocurrence", exc_info=e)
 
         # handle everything again but this time for shop
 
-        logging.debug(f'[GET] {constants.FN_CATALOG}')
-        headers = {
-            'Authorization': self.bot.oauth_manager.session_token
-        }
-        response = requests.get(constants.FN_CATALOG, headers=headers)
-        if response.status_code == 401 or response.status_code == 403:
-            self.bot.oauth_manager._create_token()
-            raise Exception('Please try again.')
+        storefront = await self.bot.storefront.get()
 
-        data = response.json()
+        # nothing can change if neither the shop nor anybody's wishlist did since the last run
+        shop_state = (storefront.version, tuple((entry.user.id, entry.shortname, entry.lock_shop_active) for entry in all_wishlists))
+        if shop_state == self.last_shop_state:
+            return
 
-        fortnite_api_shop_data_url = 'https://fortnite-api.com/v2/shop' # TODO: language target
-        response = requests.get(fortnite_api_shop_data_url)
-        marlon_data = response.json()
-
-        storefront = discord.utils.find(lambda storefront: storefront['name'] == 'BRWeeklyStorefront', data['storefronts'])
-        # open('shop_test.json', 'w').write(json.dumps(storefront, indent=4))
-
-        shop_tracks = list(filter(lambda item: item['meta']['templateId'].startswith('SparksSong:'), storefront['catalogEntries']))
-        bundles = list(filter(lambda item: item['offerType'] == 'DynamicBundle', storefront['catalogEntries']))
+        # only needed for bundle details, fetched the first time a bundle notification is sent
+        marlon_data = None
 
         for entry in all_wishlists:
-            track = discord.utils.find(lambda x: x['track']['sn'] == entry.shortname, all_tracks)
-            shop_entry = discord.utils.find(lambda offer: offer['meta']['templateId'] == track['track']['ti'], shop_tracks)
+            track = tracks_by_shortname.get(entry.shortname)
+            shop_entry = storefront.offer(track['track']['ti'])
 
             bundle_with_track = None
+            bundles_with_track = storefront.bundles_with(track['track']['ti'])
+            if bundles_with_track:
+                bundle_with_track = bundles_with_track[-1]
 
             shop_notification_level = entry.lock_shop_active
             # LOCK LEVELS
@@ -140,17 +144,6 @@ class WishlistManager():
             if shop_notification_level == 3:
                 corrected_state = 13
 
-            # is this costly?
-            for bundle in bundles:
-                track_template_id = track['track']['ti']
-                bundle_offers = bundle['dynamicBundleInfo']['bundleItems']
-                for item in bundle_offers:
-                    # pass
-                    if item['item']['templateId'] == track_template_id:
-                        bundle_with_track = bundle
-                        break
-
-
             track_not_in_shop = (shop_entry is None) and (bundle_with_track is None)
             # the track is NOT in the current shop
 
@@ -189,7 +182,9 @@ class WishlistManager():
                     if user:
                         try:
                             await user.send(embed=embed)
+                            NOTIFICATIONS.inc(event='wishlist', outcome='sent')
                         except Exception as e:
+                            NOTIFICATIONS.inc(event='wishlist', outcome='failed')
                             logging.error("Cannot notify wishlist ocurrence", exc_info=e)
 
                 # stop here
@@ -262,11 +257,14 @@ class WishlistManager():
             if current_state in [11, 13]:
                 if bundle_with_track:
                     # cross reference bundle's offer id with the unofficial api data
+                    if marlon_data is None:
+                        marlon_data = await self.fetch_unofficial_shop()
+
                     offer_id1 = bundle_with_track['offerId']
                     unofficial_bundle = discord.utils.find(lambda x: x['offerId'] == offer_id1, marlon_data['data']['entries'])
 
                     bundle_price = bundle_with_track['dynamicBundleInfo']['floorPrice']
-                    bundle_offers = bundle['dynamicBundleInfo']['bundleItems']
+                    bundle_offers = bundle_with_track['dynamicBundleInfo']['bundleItems']
                     for item in bundle_offers:
                         bundle_price += item['regularPrice']
 
@@ -301,12 +299,22 @@ class WishlistManager():
             if user:
                 try:
                     await user.send(embed=embed)
+                    NOTIFICATIONS.inc(event='wishlist', outcome='sent')
                 except Exception as e:
+                    NOTIFICATIONS.inc(event='wishlist', outcome='failed')
                     logging.error("Cannot notify wishlist ocurrence", exc_info=e)
 
             # we lock the wishlist entry so that we don't notify the user again
             await self.config.wishlist('set_lock_status', lock_type='shop', entry=entry, lock_status=new_notification_level)
 
+        self.last_shop_state = shop_state
+
+    async def fetch_unofficial_shop(self) -> dict:
+        fortnite_api_shop_data_url = 'https://fortnite-api.com/v2/shop' # TODO: language target
+        logging.debug(f'[GET] {fortnite_api_shop_data_url}')
+        response = await asyncio.to_thread(requests.get, fortnite_api_shop_data_url)
+        return response.json()
+
     async def handle_display(self, interaction: discord.Interaction, page = 0):
         first_time = not interaction.response.is_done()
         if first_time:
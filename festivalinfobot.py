@@ -1,5 +1,6 @@
 from bot.tools.streamingservices import StreamingViewButton
 from bot.tools.streamingservices import StreamingServicesManager
+from bot.tools.streamingservices import import_legacy_odesli_cache
 from bot.views.votebutton import UpdateVotesButton
 from bot.views.votebutton import VoteButton
 from bot.embeds import SearchEmbedHandler
@@ -8,6 +9,7 @@ import difflib
 import io
 import json
 import logging
+import math
 import datetime as dt
 from datetime import datetime, timezone, timedelta, time
 import os
@@ -46,6 +48,17 @@ from bot.tracks import SearchCommandHandler, JamTrackHandler
 from bot.helpers import DailyCommandHandler, ShopCommandHandler, TracklistHandler
 from bot.commands.mix import MixHandler
 from bot.tools.oauthmanager import OAuthManager
+from bot.tools.leaderboards import LeaderboardService
+from bot.tools.storefront import StorefrontService
+from bot.tools.eventcalendar import CalendarService
+from bot.tools.accountcache import AccountNameCache
+from bot.tools.tempsweeper import TempSweeper
+from bot.tools.cachequota import CACHE_QUOTAS
+from bot.tools.browserpool import BROWSER_POOL
+from bot.tools.responsecache import RESPONSE_CACHE
+from bot.tools.renderpool import RENDER_POOL
+from bot.tools.metrics import METRICS
+from bot.tools.commandstats import CommandAnalytics
 from bot.tools.events import EventListener
 from bot.views.actionmenu import ActionSelect
 
@@ -182,6 +195,9 @@ class FestivalTracker(commands.AutoShardedBot):
         open(f'{constants.CACHE_FOLDER}CommandTree.dat', 'wb').write(bytes.fromhex(tree_commands_hash))
         open(f'{constants.CACHE_FOLDER}CommandTreeTestGuild.dat', 'wb').write(bytes.fromhex(tree_commands_hash_test))
     
+        # before the loops and commands start rendering
+        await RENDER_POOL.warm()
+
         if not self.activity_task.is_running():
             self.activity_task.start()
 
@@ -190,6 +206,12 @@ class FestivalTracker(commands.AutoShardedBot):
 
         await self.oauth_manager.create_session()
 
+        if not self.storefront.poll_task.is_running():
+            self.storefront.poll_task.start()
+
+        if not self.calendar.poll_task.is_running():
+            self.calendar.poll_task.start()
+
         uptime = datetime.now() - datetime.fromtimestamp(self.connection_time)
         await constants.msg_log(self, f"Ready in {uptime.seconds}s")
 
@@ -228,6 +250,29 @@ class FestivalTracker(commands.AutoShardedBot):
             logging.debug("Starting bestsellers cacher loop task...")
             self.bestsellers_cacher_loop.start()
 
+        if not self.account_cache.save_task.is_running():
+            self.account_cache.save_task.start()
+
+        if not self.temp_sweeper.sweep_task.is_running():
+            self.temp_sweeper.sweep_task.start()
+
+        if not CACHE_QUOTAS.evict_task.is_running():
+            CACHE_QUOTAS.evict_task.start()
+
+        if not BROWSER_POOL.health_task.is_running():
+            BROWSER_POOL.health_task.start()
+
+        if not RESPONSE_CACHE.prune_task.is_running():
+            await import_legacy_odesli_cache()
+            RESPONSE_CACHE.prune_task.start()
+
+        METRICS.instrument_tasks(constants.TASK_REGISTRY)
+        if not METRICS.lag_task.is_running():
+            METRICS.lag_task.start()
+
+        if constants.METRICS_PORT and not METRICS.serving:
+            await METRICS.serve(constants.METRICS_HOST, constants.METRICS_PORT)
+
         logging.debug("on_ready finished!")
 
         self.bot_is_ready = True
@@ -265,6 +310,7 @@ class FestivalTracker(commands.AutoShardedBot):
         # Bot configuration properties
         self.UTILITY_TASK_INTERVAL = config.getint('bot', 'utility_task_interval', fallback=5)
         self.CHECK_FOR_NEW_SONGS = config.getboolean('bot', 'check_for_new_songs', fallback=True)
+        self.PRECOMPUTE_PATHS = config.getboolean('bot', 'precompute_paths', fallback=True)
         self.DEVELOPER = config.getboolean('bot', 'is_developer_environment', fallback=True)
 
         self.DISCORD_APP_CLIENT_ID = config.get('bot', 'discord_app_client_id')
@@ -272,7 +318,7 @@ class FestivalTracker(commands.AutoShardedBot):
 
         self.start_time = time.time()
         self.connection_time = self.start_time
-        self.analytics: list[constants.Analytic] = []
+        self.command_analytics = CommandAnalytics()
 
         # Set up Discord bot with necessary intents
         intents = discord.Intents.default()
@@ -303,12 +349,18 @@ class FestivalTracker(commands.AutoShardedBot):
         self.check_handler = LoopCheckHandler(self)
         self.oauth_manager = OAuthManager(self, constants.EPIC_DEVICE_ID, constants.EPIC_ACCOUNT_ID, constants.EPIC_DEVICE_SECRET)
         constants.OAUTH_MANAGER = self.oauth_manager
+        self.account_cache = AccountNameCache(self.oauth_manager)
+        self.leaderboard_service = LeaderboardService(self.oauth_manager, self.account_cache)
+        self.storefront = StorefrontService(self.oauth_manager)
+        self.calendar = CalendarService(self.oauth_manager)
+        self.temp_sweeper = TempSweeper()
         self.mix_handler = MixHandler()
         self.wishlist_handler = WishlistManager(self)
         self.setlist_handler = SetlistHandler(self)
         self.bestsellers_renderer = BestsellersRenderer(self)
 
         self.setup_commands()
+        self.setup_metrics()
 
         self.tree.on_error = self.custom_on_error
         async def _on_error_wrapper(error: str, *args, **kwargs):
@@ -349,6 +401,8 @@ class FestivalTracker(commands.AutoShardedBot):
     # CUSTOM ERROR HANDLER
     async def custom_on_error(self, interaction: discord.Interaction, error: Exception, is_piped: bool = False):
         command = interaction.command if interaction else None
+        if interaction:
+            self.record_command(interaction, 'error')
 
         if isinstance(error, discord.app_commands.errors.CommandInvokeError):
             if isinstance(error.original, discord.NotFound):
@@ -500,6 +554,7 @@ class FestivalTracker(commands.AutoShardedBot):
 
     async def _pre_command(self, interaction: discord.Interaction):
         command = interaction.command
+        interaction.extras['started_at'] = time.perf_counter()
 
         place = f'DMs with {interaction.user.display_name} (`{interaction.user.id}`)'
         if interaction.guild:
@@ -513,11 +568,54 @@ class FestivalTracker(commands.AutoShardedBot):
             
         await constants.msg_log(self, f'`/{command.qualified_name}` invoked in {place}{parsed_namespace}')
 
-        analytic = constants.Analytic(interaction)
-        self.analytics.append(analytic)
-
         return await self.check_agreements(interaction)
 
+    async def on_app_command_completion(self, interaction: discord.Interaction, command: app_commands.Command | app_commands.ContextMenu):
+        self.record_command(interaction, 'ok')
+
+    def record_command(self, interaction: discord.Interaction, outcome: str):
+        started_at = interaction.extras.pop('started_at', None)
+        if started_at is None or not interaction.command:
+            # autocomplete, or already recorded
+            return
+
+        duration = time.perf_counter() - started_at
+        self.command_duration.observe(duration, command=interaction.command.qualified_name, outcome=outcome)
+        self.command_analytics.record(interaction.command.qualified_name, duration, failed=outcome == 'error', is_dm=interaction.guild is None)
+
+    def setup_metrics(self):
+        self.command_duration = METRICS.histogram('festivaltracker_command_duration_seconds', 'Time from a slash command being checked to its handler finishing', ('command', 'outcome'))
+
+        cache_hits = METRICS.counter('festivaltracker_cache_hits_total', 'Cache lookups answered from the cache', ('cache',))
+        cache_misses = METRICS.counter('festivaltracker_cache_misses_total', 'Cache lookups which had to fetch or render', ('cache',))
+        cache_hit_ratio = METRICS.gauge('festivaltracker_cache_hit_ratio', 'Hits over lookups since startup', ('cache',))
+        cache_size = METRICS.gauge('festivaltracker_cache_size_bytes', 'Size of a cache folder at its last quota scan', ('cache',))
+        queue_depth = METRICS.gauge('festivaltracker_render_queue_depth', 'Renders submitted which have not finished, or are waiting for a page', ('pool',))
+        guilds = METRICS.gauge('festivaltracker_guilds', 'Guilds the bot is in')
+        gateway_latency = METRICS.gauge('festivaltracker_gateway_latency_seconds', 'Discord websocket heartbeat latency')
+
+        def set_cache(name: str, hits: int, misses: int):
+            cache_hits.set(hits, cache=name)
+            cache_misses.set(misses, cache=name)
+            cache_hit_ratio.set(hits / (hits + misses) if hits + misses > 0 else 0, cache=name)
+
+        @METRICS.collector
+        def collect_caches():
+            for cache in list(CACHE_QUOTAS.caches.values()):
+                set_cache(cache.name, cache.hits, cache.misses)
+                cache_size.set(cache.size_bytes, cache=cache.name)
+
+            set_cache('responses', RESPONSE_CACHE.hits + RESPONSE_CACHE.stale_hits + RESPONSE_CACHE.negative_hits, RESPONSE_CACHE.misses)
+
+        @METRICS.collector
+        def collect_bot():
+            queue_depth.set(RENDER_POOL.queue_depth, pool='render')
+            queue_depth.set(BROWSER_POOL.waiting, pool='browser')
+            guilds.set(len(self.guilds))
+            # nan or inf until the first heartbeat
+            if math.isfinite(self.latency):
+                gateway_latency.set(self.latency)
+
     def setup_commands(self):
         self.tree.interaction_check = self._pre_command
 
@@ -550,6 +648,15 @@ class FestivalTracker(commands.AutoShardedBot):
                 return
 
             await self.analytics_task()
+            self.account_cache.save()
+            CACHE_QUOTAS.save()
+            # do not leave a Chromium behind for the new process
+            await BROWSER_POOL.shutdown()
+            # queued renders are dropped instead of holding up the exit
+            RENDER_POOL.shutdown()
+            await RESPONSE_CACHE.close()
+            # the new process binds the same port
+            await METRICS.stop()
             await ctx.message.add_reaction("✅")
             print('\n' * 10)
 
@@ -1133,52 +1240,21 @@ class FestivalTracker(commands.AutoShardedBot):
         fmt_last = discord.utils.format_dt(self.last_analytic if self.last_analytic else datetime.now(), 'F')
         fmt_now = discord.utils.format_dt(datetime.now(), 'F')
         text = f"From {fmt_last} to {fmt_now}:\n"
-        all_analytics = self.analytics.copy() # i hope this works
-        self.analytics = []
-        command_counts = dict()
-        for analytic in all_analytics:
-            if command_counts.get(analytic.command_name, None):
-                command_counts[analytic.command_name] = command_counts.get(analytic.command_name) + 1
-            else:
-                command_counts[analytic.command_name] = 1
-            
-        text += "Command counts:\n"
-        for cmd, ammo in command_counts.items():
-            text += f'`/{cmd}`: {ammo}\n'
-
-        await self.get_partial_messageable(constants.ANALYTICS_CHANNEL).send(text)
-
-        dm_commands = 0
-
-        # guild_rank = "Guilds ranked by commands:\n"
-        # guilds = []
-        for analytic in all_analytics:
-            if analytic.is_dm:
-                dm_commands += 1
-        #         continue
-
-        #     if not any(g[0] == analytic.guild_id for g in guilds):
-        #         guilds.append((analytic.guild_id, len(
-        #             list(
-        #                 filter(
-        #                     lambda a: a.guild_id == analytic.guild_id, all_analytics
-        #                     )
-        #                 )
-        #             )
-        #         ))
-
-        # # filter(lambda )
-
-        # guilds.sort(key=lambda g: g[1], reverse=True)
-        # for i, guild in enumerate(guilds[:10]):
-        #     guild_obj = self.get_guild(guild[0])
-        #     if not guild_obj: 
-        #         continue
+        command_stats = self.command_analytics.take()
 
-        #     guild_rank += f"{i+1}. {guild_obj.name} (`{guild[0]}`): {guild[1]} commands\n"
+        text += "Command counts (latency p50/p95/p99):\n"
+        messages = []
+        for line in CommandAnalytics.report_lines(command_stats):
+            if len(text) + len(line) + 1 > 2000:
+                messages.append(text)
+                text = ""
+            text += f'{line}\n'
+        messages.append(text)
 
-        # await self.get_channel(constants.ANALYTICS_CHANNEL).send(guild_rank)
+        for message in messages:
+            await self.get_partial_messageable(constants.ANALYTICS_CHANNEL).send(message)
 
+        dm_commands = sum(stats.dm_invocations for stats in command_stats.values())
         await self.get_partial_messageable(constants.ANALYTICS_CHANNEL).send(f"DM Commands: {dm_commands}")
         self.last_analytic = datetime.now()
 